@@ -2,14 +2,27 @@
 #
 # SPDX-License-Identifier: MIT
 from pathlib import Path
+from typing import Optional
 
+import typer
 from snk_cli import CLI
 
 episodic = CLI(Path(__file__).parent.parent)
 
 @episodic.app.command()
-def template():
+def template(
+    path: Optional[Path] = typer.Option(None, "--path", help="Custom template to use instead of the bundled template."),
+    compile_template: bool = typer.Option(
+        False, "--compile", help="Compile the template into the template cache instead of showing it."
+    ),
+):
     """Show the BEAST XML template."""
-    template_path = episodic.workflow.path / "workflow/templates/beast_xml_template.jinja"
+    template_path = path or episodic.workflow.path / "workflow/templates/beast_xml_template.jinja"
+    if compile_template:
+        from episodic.workflow.scripts.populate_beast_template import load_beast_template, template_cache_dir
+
+        load_beast_template(template_path)
+        episodic.echo(f"Compiled {template_path} into {template_cache_dir()}")
+        return
     template = template_path.read_text()
     episodic.echo(template)
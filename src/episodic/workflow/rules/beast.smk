@@ -1,5 +1,15 @@
 
 import hashlib
+import json
+
+from scripts.resource_model import (
+    FEATURES_SUFFIX,
+    AlignmentStatistics,
+    JobFeatures,
+    estimate_resources,
+    load_resource_model,
+    read_alignment_statistics,
+)
 
 MAX_BEAST_SEED = 2**31 - 1
 
@@ -13,90 +23,360 @@ def beast_seed(wildcards):
     seed_hash = hashlib.sha256(seed_key.encode()).hexdigest()
     return int(seed_hash[:8], 16) % MAX_BEAST_SEED + 1
 
-rule create_beast_xml:
+rule alignment_sidecar:
+    """
+    Parses and validates the alignment partitions once. The XML jobs, the taxon groups and the
+    Snakefile read the sidecar instead of re-parsing the FASTA files.
+    """
     input:
-        alignments = config["alignment"],
-        groups_file = OUT_DIR / "taxon_groups.tsv",
+        alignments = alignment_paths,
     output:
-        beast_XML_file = CLOCK_DIR / "{clock}" / "{name}" / "{name}.xml",
+        ALIGNMENT_SIDECAR,
     params:
-        template = beast_xml_template,
-        alignments = lambda wildcards, input: " ".join(f"--alignment {alignment}" for alignment in input.alignments),
         date_delimiter = "\|" if config.get("date_delimiter") == "|" else config.get("date_delimiter"),
         date_index = config.get("date_index", -1),
-        clock = lambda wildcards: wildcards.clock.split("_")[0],
-        rate_gamma_prior_shape = config.get("rate_gamma_prior_shape"),
-        rate_gamma_prior_scale = config.get("rate_gamma_prior_scale"),
-        chain_length = config["beast"].get("chain_length"),
-        samples = config["beast"].get("samples"),
-        mle = lambda wildcards: "--mle" if "mle" in wildcards.name else "",
-        mle_chain_length = f"--mle-chain-length {config['marginal_likelihood'].get('chain_length')}",
-        mle_path_steps = f"--mle-path-steps {config['marginal_likelihood'].get('path_steps')}",
-        mle_log_every = f"--mle-log-every {config['marginal_likelihood'].get('log_every')}",
-        no_trace = lambda wildcards: "--no-trace" if "mle" in wildcards.name else "",
-        no_trees = lambda wildcards: "--no-trees" if "mle" in wildcards.name else "",
-        fixed_tree = f'--fixed-tree {config.get("newick")}'  if config.get("newick") else "",
-        foreground_label = f'--foreground-label {config.get("foreground_label")}' if config.get("foreground_label") else "",
-        background_label = f'--background-label {config.get("background_label")}' if config.get("background_label") else "",
     shell:
         """
-        python {SCRIPT_DIR}/populate_beast_template.py \
-            {params.template} \
-            --output {output.beast_XML_file} \
-            {params.alignments} \
+        python {SCRIPT_DIR}/alignment_sidecar.py {output} {input.alignments} \
             --date-delimiter {params.date_delimiter} \
-            --date-index {params.date_index} \
-            --groups-file {input.groups_file} \
-            --clock {params.clock} \
-            --rate-gamma-prior-shape {params.rate_gamma_prior_shape} \
-            --rate-gamma-prior-scale {params.rate_gamma_prior_scale} \
-            --chain-length {params.chain_length} \
-            --samples {params.samples} \
-            {params.mle} \
-            {params.mle_chain_length} \
-            {params.mle_path_steps} \
-            {params.mle_log_every} \
-            {params.no_trace} \
-            {params.no_trees} \
-            {params.fixed_tree} \
-            {params.foreground_label} \
-            {params.background_label}
+            --date-index {params.date_index}
+        """
+
+MLE_OUT_DIR = OUT_DIR / "mle" / "{clock}"
+BENCHMARK_DIR = OUT_DIR / "benchmarks"
+XML_STATISTICS = OUT_DIR / "xml" / "alignment_statistics.json"
+ADAPTIVE = config["beast"].get("adaptive", False)
+CHECKPOINT_EVERY = config["beast"].get("checkpoint_every", 0)
+
+# adaptive runs are rendered with the longest chain they may need and stopped once converged,
+# logging at the same interval as a fixed-length run
+XML_CHAIN_LENGTH = config["beast"].get("max_chain_length") if ADAPTIVE else config["beast"].get("chain_length")
+XML_SAMPLES = config["beast"].get("samples") * XML_CHAIN_LENGTH // config["beast"].get("chain_length")
+XML_STORE = OUT_DIR / "xml"
+
+# a chunked MLE run splits its path steps across chunk jobs, each sampling every power posterior
+# for its share of the chain length, starting from the state at the end of a shared burn-in
+MLE_CHUNKS = config["marginal_likelihood"].get("chunks", 1)
+MLE_BURNIN = config["marginal_likelihood"].get("burnin")
+MLE_JOB_CHAIN_LENGTH = -(-config["marginal_likelihood"].get("chain_length") // MLE_CHUNKS)
+
+def mle_job_names(clock, duplicate):
+    """The names of the BEAST jobs of an MLE run, its chunks if it is chunked."""
+    name = f"{clock}_mle_{duplicate}"
+    if MLE_CHUNKS == 1:
+        return [name]
+    return [f"{name}_chunk_{chunk}" for chunk in range(1, MLE_CHUNKS + 1)]
+
+def mle_xml(clock, name):
+    return OUT_DIR / "mle" / clock / name / f"{name}.xml"
+
+# every BEAST and MLE XML as (clock model, output file, populate_beast_template.py option)
+XML_VARIANTS = [
+    (clock.split("_")[0], CLOCK_DIR / clock / f"{clock}_{duplicate}" / f"{clock}_{duplicate}.xml", "xml")
+    for clock in clocks
+    for duplicate in duplicates
+] + [
+    (clock.split("_")[0], mle_xml(clock, name), "mle-xml")
+    for clock in clocks
+    for duplicate in mle_duplicates
+    for name in mle_job_names(clock, duplicate)
+] + [
+    (clock.split("_")[0], mle_xml(clock, f"{clock}_mle_{duplicate}_burnin"), "mle-burnin-xml")
+    for clock in clocks
+    for duplicate in (mle_duplicates if MLE_CHUNKS > 1 else [])
+]
+
+if XML_VARIANTS:
+    rule create_beast_xmls:
         """
+        Renders every BEAST and MLE XML in one job, compiling the template and reading the
+        partitions once. Duplicates render identically, so each distinct XML is written once to
+        the content-addressed XML store and the per-run XMLs are hard links to it.
+        """
+        input:
+            alignment_sidecar = ALIGNMENT_SIDECAR,
+            groups_file = TAXON_REGISTRY,
+        output:
+            [path for _, path, _ in XML_VARIANTS],
+            statistics = XML_STATISTICS,
+        threads: 4
+        params:
+            template = beast_xml_template,
+            xmls = " ".join(f"--{option} {clock} {path}" for clock, path, option in XML_VARIANTS),
+            rate_gamma_prior_shape = config.get("rate_gamma_prior_shape"),
+            rate_gamma_prior_scale = config.get("rate_gamma_prior_scale"),
+            chain_length = XML_CHAIN_LENGTH,
+            samples = XML_SAMPLES,
+            mle_chain_length = f"--mle-chain-length {MLE_JOB_CHAIN_LENGTH}",
+            mle_path_steps = f"--mle-path-steps {config['marginal_likelihood'].get('path_steps')}",
+            mle_log_every = f"--mle-log-every {config['marginal_likelihood'].get('log_every')}",
+            mle_burnin_length = f"--mle-burnin-length {MLE_BURNIN}",
+            fixed_tree = f'--fixed-tree {config.get("newick")}'  if config.get("newick") else "",
+            compress_patterns = "--compress-patterns" if config["beast"].get("compress_patterns") else "",
+            foreground_label = f'--foreground-label {config.get("foreground_label")}' if config.get("foreground_label") else "",
+            background_label = f'--background-label {config.get("background_label")}' if config.get("background_label") else "",
+        shell:
+            """
+            python {SCRIPT_DIR}/populate_beast_template.py \
+                {params.template} \
+                {params.xmls} \
+                --jobs {threads} \
+                --xml-store {XML_STORE} \
+                --statistics {output.statistics} \
+                --alignment-sidecar {input.alignment_sidecar} \
+                --groups-file {input.groups_file} \
+                --rate-gamma-prior-shape {params.rate_gamma_prior_shape} \
+                --rate-gamma-prior-scale {params.rate_gamma_prior_scale} \
+                --chain-length {params.chain_length} \
+                --samples {params.samples} \
+                {params.mle_chain_length} \
+                {params.mle_path_steps} \
+                {params.mle_log_every} \
+                {params.mle_burnin_length} \
+                {params.fixed_tree} \
+                {params.compress_patterns} \
+                {params.foreground_label} \
+                {params.background_label}
+            """
+
+def compressed_later(path):
+    """BEAST outputs that are compressed afterwards are only kept in their compressed form."""
+    return temp(path) if COMPRESSION != "none" else path
 
 TREES = {"beast_trees_file": CLOCK_DIR / "{clock}" / "{name}" / "{name}.trees"} if config.get("trees") else {}
 
+def beast_args(wildcards, resources):
+    """Additional BEAST arguments, switched to the GPU BEAGLE resource for jobs that request a GPU."""
+    args = config["beast"].get("args", "")
+    if "gpu" in str(getattr(resources, "gres", "")):
+        return args.replace("-beagle_CPU", "-beagle_GPU")
+    return args
+
+def beast_supervisor(wildcards):
+    """
+    Prefix for the BEAST command of adaptive runs. The supervisor follows the run's trace log
+    and stops BEAST once the run, and its R-hat against the other duplicates, has converged.
+    """
+    if not ADAPTIVE:
+        return ""
+    run_dir = CLOCK_DIR / wildcards.clock / wildcards.name
+    other_chains = [
+        CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}"
+        for duplicate in duplicates
+        if f"{wildcards.clock}_{duplicate}" != wildcards.name
+    ]
+    return " ".join([
+        f"python {SCRIPT_DIR}/beast_supervisor.py",
+        f"--log {run_dir / 'beast.log'}",
+        f"--trees {run_dir / 'beast.trees'}",
+        *(f"--chain {chain}" for chain in other_chains),
+        f"--min-ess {config['beast'].get('min_ess')}",
+        f"--max-rhat {config['beast'].get('max_rhat')}",
+        f"--check-every {config['beast'].get('check_every')}",
+        "--",
+    ])
+
+def beast_checkpoint(wildcards):
+    """
+    The checkpoint file a BEAST run saves its state to, next to its run directory, or "" if
+    checkpointing is disabled. The path is absolute because BEAST runs with `-working`.
+    """
+    if not CHECKPOINT_EVERY:
+        return ""
+    return (CLOCK_DIR / wildcards.clock / f"{wildcards.name}.checkpoint").absolute()
+
+RESOURCE_MODEL = load_resource_model(config.get("resource_model", {}).get("path"))
+MLE_STATES = MLE_JOB_CHAIN_LENGTH * config["marginal_likelihood"].get("path_steps")
+
+def job_features(wildcards, input, mle=False, gpu=None, states=None):
+    """
+    The properties of a BEAST or MLE job its resources are estimated from. Until the XMLs, and
+    the alignment statistics written with them, exist (e.g. in a dry run) the number of site
+    patterns is taken to be the number of taxa. `states` overrides the chain length of the job.
+    """
+    if Path(input.statistics).exists():
+        statistics = read_alignment_statistics(input.statistics)
+    else:
+        statistics = AlignmentStatistics(alignment_summary.taxa, [alignment_summary.taxa] * len(alignment_paths))
+    return JobFeatures.from_statistics(
+        statistics,
+        states=states or (MLE_STATES if mle else XML_CHAIN_LENGTH),
+        clock=wildcards.clock.split("_")[0],
+        gpu=config.get("resource_model", {}).get("gpu", False) if gpu is None else gpu,
+        mle=mle,
+    )
+
+def predicted_resource(resource, mle=False, states=None):
+    """A resource callable returning the `mem_mb` or `runtime` the resource model estimates for a job."""
+    return lambda wildcards, input, attempt: estimate_resources(
+        RESOURCE_MODEL, job_features(wildcards, input, mle=mle, states=states), attempt
+    )[resource]
+
+def recorded_features(mle=False, states=None):
+    """A params callable with the job features to record next to the benchmark, with the BEAGLE resource the job got."""
+    return lambda wildcards, input, resources: json.dumps(
+        job_features(wildcards, input, mle=mle, gpu="gpu" in str(getattr(resources, "gres", "")), states=states)._asdict()
+    )
+
 rule beast:
     input:
-        beast_XML_file = rules.create_beast_xml.output.beast_XML_file,
+        beast_XML_file = CLOCK_DIR / "{clock}" / "{name}" / "{name}.xml",
+        statistics = XML_STATISTICS,
     output:
         beast_stdout_file = CLOCK_DIR / "{clock}" / "{name}" / "{name}.stdout",
-        beast_log_file = CLOCK_DIR / "{clock}" / "{name}" / "{name}.log",
-        beast_trees_file =  CLOCK_DIR / "{clock}" / "{name}" / "{name}.trees",
+        beast_log_file = compressed_later(CLOCK_DIR / "{clock}" / "{name}" / "{name}.log"),
+        beast_trees_file = compressed_later(CLOCK_DIR / "{clock}" / "{name}" / "{name}.trees"),
+        features = BENCHMARK_DIR / "beast" / "{clock}" / ("{name}" + FEATURES_SUFFIX),
+    benchmark:
+        BENCHMARK_DIR / "beast" / "{clock}" / "{name}.tsv"
     threads: config["beast"].get("threads")
+    resources:
+        mem_mb = predicted_resource("mem_mb"),
+        runtime = predicted_resource("runtime"),
     envmodules:
         *config["beast"].get("envmodules", []),
     conda:
         "../envs/beast.yml"
     params:
-        beast_args = lambda wildcards, resources: (
-            config["beast"].get("args", "").replace("-beagle_CPU", "-beagle_GPU")
-            if "gpu" in str(getattr(resources, "gres", ""))
-            else config["beast"].get("args", "")
-        ),
+        beast_args = beast_args,
         seed = beast_seed,
+        supervisor = beast_supervisor,
+        checkpoint = beast_checkpoint,
+        features = recorded_features(),
     shell:
         """
-        beast -seed {params.seed} -working -overwrite {params.beast_args} -threads {threads} {input.beast_XML_file} > {output.beast_stdout_file}
+        echo '{params.features}' > {output.features}
+        run_dir=$(dirname {input.beast_XML_file})
+        # resume from the checkpoint of an interrupted run, appending to its log and trees
+        checkpoint_args=-overwrite
+        if [ -n "{params.checkpoint}" ]; then
+            checkpoint_args=$(python {SCRIPT_DIR}/beast_checkpoint.py {params.checkpoint} {input.beast_XML_file} \
+                "$run_dir"/beast.log "$run_dir"/beast.trees --save-every {CHECKPOINT_EVERY})
+        fi
+        {params.supervisor} beast -seed {params.seed} -working $checkpoint_args {params.beast_args} -threads {threads} {input.beast_XML_file} > {output.beast_stdout_file}
+        # XMLs from the XML store name their output files beast.*, so rename them after the run
+        for file in "$run_dir"/beast.*; do
+            if [ -e "$file" ]; then
+                mv "$file" "$run_dir/{wildcards.name}${{file#$run_dir/beast}}"
+            fi
+        done
+        rm -f {params.checkpoint}
         """
 
-MLE_OUT_DIR = OUT_DIR / "mle" / "{clock}"
+BEAST_LOG = CLOCK_DIR / "{clock}" / "{name}" / ("{name}" + LOG_EXT)
+BEAST_TREES = CLOCK_DIR / "{clock}" / "{name}" / ("{name}" + TREES_EXT)
 
-use rule create_beast_xml as create_mle_xml with:
-    output:
-        beast_XML_file = MLE_OUT_DIR / "{name}.xml",
+if COMPRESSION != "none":
+    rule compress_beast_output:
+        """
+        Compresses a finished BEAST log or trees file. Downstream rules read the compressed file
+        and the uncompressed BEAST output is removed once it has been compressed.
+        """
+        input:
+            CLOCK_DIR / "{clock}" / "{name}" / "{name}.{output_type}",
+        output:
+            CLOCK_DIR / "{clock}" / "{name}" / ("{name}.{output_type}" + COMPRESSION_SUFFIX),
+        wildcard_constraints:
+            output_type = "log|trees",
+        conda:
+            "../envs/python.yml"
+        shell:
+            """
+            python {SCRIPT_DIR}/compression.py compress {input} {output} --method {COMPRESSION}
+            """
 
-use rule beast as mle with:
-    input:
-        beast_XML_file = rules.create_mle_xml.output.beast_XML_file,
-    output:
-        beast_stdout_file = MLE_OUT_DIR / "{name}.stdout",
+if MLE_CHUNKS == 1:
+    use rule beast as mle with:
+        input:
+            beast_XML_file = MLE_OUT_DIR / "{name}" / "{name}.xml",
+            statistics = XML_STATISTICS,
+        output:
+            beast_stdout_file = MLE_OUT_DIR / "{name}.stdout",
+            features = BENCHMARK_DIR / "mle" / "{clock}" / ("{name}" + FEATURES_SUFFIX),
+        benchmark:
+            BENCHMARK_DIR / "mle" / "{clock}" / "{name}.tsv"
+        resources:
+            mem_mb = predicted_resource("mem_mb", mle=True),
+            runtime = predicted_resource("runtime", mle=True),
+        params:
+            beast_args = beast_args,
+            seed = beast_seed,
+            supervisor = "",
+            # checkpoints hold the MCMC state but not the progress through the path steps
+            checkpoint = "",
+            features = recorded_features(mle=True),
+else:
+    def mle_burnin_state(wildcards):
+        """The state a chunk of an MLE run starts from, saved at the end of the run's burn-in."""
+        run = wildcards.name.rsplit("_chunk_", 1)[0]
+        return OUT_DIR / "mle" / wildcards.clock / f"{run}_burnin.checkpoint"
+
+    use rule beast as mle_burnin with:
+        input:
+            beast_XML_file = MLE_OUT_DIR / "{name}" / "{name}.xml",
+            statistics = XML_STATISTICS,
+        output:
+            # not .stdout, which extract_mle.py reads the estimates from
+            beast_stdout_file = MLE_OUT_DIR / "{name}" / "{name}.out",
+            state = MLE_OUT_DIR / "{name}.checkpoint",
+            features = BENCHMARK_DIR / "mle" / "{clock}" / ("{name}" + FEATURES_SUFFIX),
+        wildcard_constraints:
+            name = r".+_burnin",
+        benchmark:
+            BENCHMARK_DIR / "mle" / "{clock}" / "{name}.tsv"
+        resources:
+            mem_mb = predicted_resource("mem_mb", states=MLE_BURNIN),
+            runtime = predicted_resource("runtime", states=MLE_BURNIN),
+        params:
+            # the XML runs one state past the burn-in, so its last saved state is the end of the burn-in
+            beast_args = lambda wildcards, output, resources: (
+                f"{beast_args(wildcards, resources)} -save_every {MLE_BURNIN} -save_state {Path(output.state).absolute()}"
+            ),
+            seed = beast_seed,
+            supervisor = "",
+            checkpoint = "",
+            features = recorded_features(states=MLE_BURNIN),
+
+    use rule beast as mle_chunk with:
+        input:
+            beast_XML_file = MLE_OUT_DIR / "{name}" / "{name}.xml",
+            statistics = XML_STATISTICS,
+            state = mle_burnin_state,
+        output:
+            beast_stdout_file = MLE_OUT_DIR / "{name}" / "{name}.out",
+            mle_log = MLE_OUT_DIR / "{name}" / "{name}.mle.log",
+            features = BENCHMARK_DIR / "mle" / "{clock}" / ("{name}" + FEATURES_SUFFIX),
+        wildcard_constraints:
+            name = r".+_chunk_\d+",
+        benchmark:
+            BENCHMARK_DIR / "mle" / "{clock}" / "{name}.tsv"
+        resources:
+            mem_mb = predicted_resource("mem_mb", mle=True),
+            runtime = predicted_resource("runtime", mle=True),
+        params:
+            beast_args = lambda wildcards, input, resources: (
+                f"{beast_args(wildcards, resources)} -load_state {Path(input.state).absolute()}"
+            ),
+            seed = beast_seed,
+            supervisor = "",
+            checkpoint = "",
+            features = recorded_features(mle=True),
+
+    rule combine_mle:
+        """
+        Combines the MLE logs of the chunks of an MLE run into its path sampling and
+        stepping-stone estimates, written in the format of the BEAST output of an unchunked run.
+        """
+        input:
+            lambda wildcards: [
+                OUT_DIR / "mle" / wildcards.clock / f"{wildcards.name}_chunk_{chunk}" / f"{wildcards.name}_chunk_{chunk}.mle.log"
+                for chunk in range(1, MLE_CHUNKS + 1)
+            ],
+        output:
+            MLE_OUT_DIR / "{name}.stdout",
+        conda:
+            "../envs/python.yml"
+        shell:
+            """
+            python {SCRIPT_DIR}/combine_mle.py {input} --output {output}
+            """
@@ -19,9 +19,12 @@ rule plot_traces:
     Makes trace plots from the beast log file.
     """
     input:
-        rules.beast.output.beast_log_file,
+        BEAST_LOG,
     output:
         directory(CLOCK_DIR / "{clock}" / "{name}" / "{name}_trace_plots/"),
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/python.yml"
     shell:
@@ -39,6 +42,9 @@ rule summary:
         posterior_svg=CLOCK_DIR / "{clock}" / "{clock}-summary.csv",
     params:
         output=lambda wildcards: CLOCK_DIR / f"{wildcards.clock}" / f"{wildcards.clock}-summary.csv",
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/arviz.yml"
     shell:
@@ -51,7 +57,7 @@ rule plot_flc_rates:
     Makes plots from the flc clock files.
     """
     input:
-        lambda wildcards: [CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}.log" for duplicate in duplicates if "flc" in wildcards.clock],
+        lambda wildcards: [CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}{LOG_EXT}" for duplicate in duplicates if "flc" in wildcards.clock],
     output:
         rate_svg=CLOCK_DIR / "{clock}" / "{clock}-violin.svg",
         forest_svg=CLOCK_DIR / "{clock}" / "{clock}-forest.svg",
@@ -61,6 +67,9 @@ rule plot_flc_rates:
         output_prefix=lambda wildcards: CLOCK_DIR / f"{wildcards.clock}" / f"{wildcards.clock}",
         gamma_shape=rate_gamma_prior_shape,
         gamma_scale=rate_gamma_prior_scale,
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/arviz.yml"
     shell:
@@ -71,7 +80,7 @@ rule plot_flc_rates:
 
 use rule plot_flc_rates as plot_rates with:
     input:
-        expand(CLOCK_DIR / "{clock}" / "{clock}_{duplicate}" / "{clock}_{duplicate}.log", clock=clocks, duplicate=duplicates),
+        ALL_LOG_FILES,
     output:
         clocks_violin=CLOCK_DIR / "clocks_{rate_gamma_prior_shape}_{rate_gamma_prior_scale}-violin.svg",
         clocks_trace=CLOCK_DIR / "clocks_{rate_gamma_prior_shape}_{rate_gamma_prior_scale}-trace.svg",
@@ -85,7 +94,7 @@ use rule plot_flc_rates as plot_rates with:
 
 rule calculate_odds:
     input:
-        lambda wildcards: [CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}.log" for duplicate in duplicates if "flc" in wildcards.clock],
+        lambda wildcards: [CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}{LOG_EXT}" for duplicate in duplicates if "flc" in wildcards.clock],
     output:
         rate_svg=CLOCK_DIR / "{clock}" / "{clock}-odds.csv" 
     params:
@@ -94,6 +103,9 @@ rule calculate_odds:
         gamma_scale=rate_gamma_prior_scale,
         foreground_label=f'--foreground-label {config.get("foreground_label")}' if config.get("foreground_label") else "",
         background_label=f'--background-label {config.get("background_label")}' if config.get("background_label") else "",
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/python.yml"
     shell:
@@ -101,7 +113,7 @@ rule calculate_odds:
         ${{CONDA_PREFIX}}/bin/python {SCRIPT_DIR}/calculate_odds.py {input} {output} --gamma-shape {params.gamma_shape} --gamma-scale {params.gamma_scale} {params.foreground_label} {params.background_label}
         for file in {input}
         do
-            ${{CONDA_PREFIX}}/bin/python {SCRIPT_DIR}/calculate_odds.py $file ${{file%.log}}-odds.csv --gamma-shape {params.gamma_shape} --gamma-scale {params.gamma_scale} {params.foreground_label} {params.background_label}
+            ${{CONDA_PREFIX}}/bin/python {SCRIPT_DIR}/calculate_odds.py $file ${{file%{LOG_EXT}}}-odds.csv --gamma-shape {params.gamma_shape} --gamma-scale {params.gamma_scale} {params.foreground_label} {params.background_label}
         done
         """
 
@@ -128,13 +140,16 @@ rule plot_partition_local_rate_posteriors:
     """
     input:
         lambda wildcards: [
-            CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}.log"
+            CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}{LOG_EXT}"
             for duplicate in duplicates
             if "flc" in wildcards.clock
         ],
     output:
         svg=CLOCK_DIR / "{clock}" / "{clock}-partition_local_rate_posteriors.svg",
         csv=CLOCK_DIR / "{clock}" / "{clock}-partition_local_rate_posteriors.csv",
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/python.yml"
     params:
@@ -157,13 +172,16 @@ rule plot_flc_substitution_model_rates:
     """
     input:
         lambda wildcards: [
-            CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}.log"
+            CLOCK_DIR / wildcards.clock / f"{wildcards.clock}_{duplicate}" / f"{wildcards.clock}_{duplicate}{LOG_EXT}"
             for duplicate in duplicates
             if "flc" in wildcards.clock
         ],
     output:
         svg=CLOCK_DIR / "{clock}" / "{clock}-substitution_model_rates.svg",
         csv=CLOCK_DIR / "{clock}" / "{clock}-substitution_model_rates.csv",
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/python.yml"
     shell:
@@ -173,3 +191,43 @@ rule plot_flc_substitution_model_rates:
           {output.svg} \
           {output.csv}
         """
+
+
+def postprocess_outputs(wildcards):
+    """
+    Lists the outputs of a clock's lightweight post-processing jobs.
+    """
+    clock = wildcards.clock
+    names = [f"{clock}_{duplicate}" for duplicate in duplicates]
+    outputs = [CLOCK_DIR / clock / f"{clock}-summary.csv"]
+    outputs += [CLOCK_DIR / clock / name / f"{name}_trace_plots" for name in names]
+    outputs += expand(
+        CLOCK_DIR / clock / "{name}" / "{name}.mcc.{heights}.{ext}",
+        name=names,
+        heights=config["mcc_tree"]["heights"],
+        ext=["nwk", "svg"],
+    )
+    if clock in flc_clocks:
+        outputs += [
+            CLOCK_DIR / clock / f"{clock}-violin.svg",
+            CLOCK_DIR / clock / f"{clock}-odds.csv",
+            CLOCK_DIR / clock / f"{clock}-substitution_model_rates.csv",
+        ]
+        if has_multiple_partitions:
+            outputs.append(CLOCK_DIR / clock / f"{clock}-partition_local_rate_posteriors.csv")
+    return outputs
+
+
+if POSTPROCESS_GROUP:
+    rule postprocess:
+        """
+        Marks a clock's post-processing as done. Depending on all of the clock's lightweight jobs
+        connects them, so they are submitted together as one group job.
+        """
+        input:
+            postprocess_outputs,
+        output:
+            touch(CLOCK_DIR / "{clock}" / "{clock}.postprocess.done"),
+        group: POSTPROCESS_GROUP
+        resources:
+            postprocess_threads=1,
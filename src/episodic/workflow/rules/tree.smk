@@ -1,52 +1,138 @@
+METADATA_INPUTS = {
+    key: config["metadata"][option]
+    for key, option in (("metadata", "path"), ("aliases", "aliases"))
+    if config.get("metadata", {}).get("path") and config["metadata"].get(option)
+}
+
 
 rule taxon_groups:
     """
-    Writes a table mapping taxa to configured groups.
+    Writes a table mapping taxa to configured groups, and the same mapping as an indexed taxon
+    registry for the Python consumers.
     """
     input:
-        alignment_paths[0],
+        alignment = ALIGNMENT_SIDECAR,
+        **METADATA_INPUTS,
     output:
-        OUT_DIR / "taxon_groups.tsv",
+        tsv = OUT_DIR / "taxon_groups.tsv",
+        registry = TAXON_REGISTRY,
     params:
         groups = " ".join(f"--group '{group}'" for group in config["group"]),
+        metadata = lambda wildcards, input: (
+            f"--metadata {input.metadata} "
+            f"--id-column '{config['metadata'].get('id_column')}' "
+            f"--group-column '{config['metadata'].get('group_column')}' "
+            f"--header-delimiter '{config.get('date_delimiter')}' "
+            f"--id-index {config['metadata'].get('id_index')}"
+            + (f" --lineage-aliases {input.aliases}" if "aliases" in input.keys() else "")
+        ) if "metadata" in input.keys() else "",
     conda:
         "../envs/python.yml"
     shell:
         """
-        python {SCRIPT_DIR}/write_taxon_groups.py {input} {output} {params.groups}
+        python {SCRIPT_DIR}/write_taxon_groups.py {input.alignment} {output.tsv} {params.groups} --registry {output.registry} {params.metadata}
         """
 
 
-rule max_clade_credibility_tree:
+rule tree_sample:
     """
-    Makes trace plots from the beast log file.
+    Converts the posterior trees into a binary tree sample read by the Python tree consumers.
     """
     input:
-        rules.beast.output.beast_trees_file,
+        BEAST_TREES,
     output:
-        CLOCK_DIR / "{clock}" / "{name}" / "{name}.mcc.{heights}.nexus",
-    params:
-        burnin = int(int(config['beast']['samples']) * 0.1),
+        CLOCK_DIR / "{clock}" / "{name}" / "{name}.trees.npz",
+    threads: 4
     conda:
-        "../envs/beast.yml"
+        "../envs/phylo.yml"
     shell:
         """
-        treeannotator -burninTrees {params.burnin} -heights {wildcards.heights} {input} {output}
+        python {SCRIPT_DIR}/tree_sample.py convert {input} {output} --jobs {threads}
+        """
+
+
+MCC_HEIGHTS = config["mcc_tree"]["heights"]
+MCC_TREE = CLOCK_DIR / "{clock}" / "{name}" / "{name}.mcc.{heights}.nexus"
+# the burn-in of fixed-length runs, which write beast.samples trees
+MCC_BURNIN_TREES = int(int(config['beast']['samples']) * 0.1)
+
+if config["mcc_tree"].get("builder", "treeannotator") == "episodic":
+    rule max_clade_credibility_tree:
+        """
+        Builds the MCC trees for every configured heights option in one pass over the tree sample.
+        """
+        input:
+            rules.tree_sample.output,
+        output:
+            expand(CLOCK_DIR / "{{clock}}" / "{{name}}" / "{{name}}.mcc.{heights}.nexus", heights=MCC_HEIGHTS),
+        params:
+            # adaptive runs stop at a variable number of trees, so discard 10% of the trees they wrote
+            burnin = "--burnin 0.1" if ADAPTIVE else f"--burnin-trees {MCC_BURNIN_TREES}",
+            outputs = lambda wildcards, output: " ".join(
+                f"--heights {heights} --output {path}" for heights, path in zip(MCC_HEIGHTS, output)
+            ),
+        threads: 4
+        conda:
+            "../envs/phylo.yml"
+        shell:
+            """
+            python {SCRIPT_DIR}/mcc_tree.py {input} {params.outputs} {params.burnin} --jobs {threads}
+            """
+else:
+    if COMPRESSION != "none":
+        rule decompress_trees:
+            """
+            Decompresses the trees file for treeannotator, which cannot read compressed input.
+            """
+            input:
+                BEAST_TREES,
+            output:
+                temp(CLOCK_DIR / "{clock}" / "{name}" / "{name}.uncompressed.trees"),
+            conda:
+                "../envs/python.yml"
+            shell:
+                """
+                python {SCRIPT_DIR}/compression.py decompress {input} {output}
+                """
+
+    rule max_clade_credibility_tree:
+        """
+        Makes trace plots from the beast log file.
         """
+        input:
+            rules.decompress_trees.output if COMPRESSION != "none" else BEAST_TREES,
+        output:
+            MCC_TREE,
+        params:
+            # adaptive runs stop at a variable number of trees, so discard 10% of the trees they wrote
+            burnin = lambda wildcards, input: (
+                f"$(( $(grep -c '^tree STATE_' {input}) / 10 ))" if ADAPTIVE else MCC_BURNIN_TREES
+            ),
+        conda:
+            "../envs/beast.yml"
+        shell:
+            """
+            treeannotator -burninTrees {params.burnin} -heights {wildcards.heights} {input} {output}
+            """
 
 
 rule max_clade_credibility_tree_newick:
     """
-    Makes trace plots from the beast log file.
+    Converts the MCC trees for every configured heights option to newick in one process.
     """
     input:
-        rules.max_clade_credibility_tree.output,
+        expand(CLOCK_DIR / "{{clock}}" / "{{name}}" / "{{name}}.mcc.{heights}.nexus", heights=MCC_HEIGHTS),
     output:
-        CLOCK_DIR / "{clock}" / "{name}" / "{name}.mcc.{heights}.nwk",
+        expand(CLOCK_DIR / "{{clock}}" / "{{name}}" / "{{name}}.mcc.{heights}.nwk", heights=MCC_HEIGHTS),
+    params:
+        pairs = lambda wildcards, input, output: " ".join(f"{source} {target}" for source, target in zip(input, output)),
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/phylo.yml"
     shell:
-        "${{CONDA_PREFIX}}/bin/python {SCRIPT_DIR}/tree_converter.py {input} {output} --node-label posterior"
+        "${{CONDA_PREFIX}}/bin/python {SCRIPT_DIR}/tree_converter.py {params.pairs} --node-label posterior"
 
 
 rule max_clade_credibility_tree_render:
@@ -54,8 +140,8 @@ rule max_clade_credibility_tree_render:
     Renders the MCC tree in SVG format.
     """
     input:
-        rules.max_clade_credibility_tree.output,
-        groups_file = rules.taxon_groups.output,
+        mcc_tree = MCC_TREE,
+        groups_file = rules.taxon_groups.output.tsv,
     output:
         CLOCK_DIR / "{clock}" / "{name}" / "{name}.mcc.{heights}.svg",
         CLOCK_DIR / "{clock}" / "{name}" / "{name}.mcc.{heights}.height_0.95_HPD.svg",
@@ -63,19 +149,23 @@ rule max_clade_credibility_tree_render:
     params:
         mrsd = most_recent_sampling_date,
         prefix = lambda wildcards: f"{CLOCK_DIR}/{wildcards.clock}/{wildcards.name}/{wildcards.name}.mcc.{wildcards.heights}",
+    group: POSTPROCESS_GROUP
+    resources:
+        postprocess_threads=1,
     conda:
         "../envs/ggtree.yml"
     shell:
-        "${{CONDA_PREFIX}}/bin/Rscript {SCRIPT_DIR}/plot_mcc_tree.R --input {input[0]} --groups-file {input.groups_file} --output-prefix {params.prefix} --mrsd {params.mrsd}"
+        "${{CONDA_PREFIX}}/bin/Rscript {SCRIPT_DIR}/plot_mcc_tree.R --input {input.mcc_tree} --groups-file {input.groups_file} --output-prefix {params.prefix} --mrsd {params.mrsd}"
 
 
 rule rate_quantile_analysis:
     input:
-        trees_file = rules.beast.output.beast_trees_file,
-        groups_file = rules.taxon_groups.output,
+        trees_file = rules.tree_sample.output,
+        groups_file = rules.taxon_groups.output.registry,
     output:
         csv = CLOCK_DIR / "{clock}" / "{name}" / "{name}.stem.rate_quantiles.csv",
         svg = CLOCK_DIR / "{clock}" / "{name}" / "{name}.stem.rate_quantiles.svg",
+    threads: 4
     conda:
         "../envs/phylo.yml"
     shell:
@@ -84,6 +174,7 @@ rule rate_quantile_analysis:
                     {input.trees_file} \
           --groups-file {input.groups_file} \
           --output-csv {output.csv} \
-          --output-plot {output.svg}
+          --output-plot {output.svg} \
+          --jobs {threads}
         """
 
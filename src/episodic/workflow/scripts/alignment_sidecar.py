@@ -0,0 +1,254 @@
+import json
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.populate_beast_template import (
+        match_partition_taxa,
+        read_alignment,
+        scan_header_dates,
+    )
+except ModuleNotFoundError:
+    from populate_beast_template import match_partition_taxa, read_alignment, scan_header_dates
+
+
+class AlignmentSidecar(NamedTuple):
+    """
+    All alignment partitions of an analysis, parsed and validated once and stored as arrays.
+
+    The partitions share the taxa of the first alignment, in its order, and their sequences are
+    concatenated site-wise, so the sites of partition `i` are `site_offsets[i]:site_offsets[i + 1]`.
+
+    Attributes:
+      taxa (List[str]): The taxon ids (fasta headers).
+      dates (np.ndarray): The decimal sampling date of each taxon.
+      uncertainties (np.ndarray): The sampling date uncertainty of each taxon.
+      paths (List[str]): The alignment file of each partition.
+      site_offsets (np.ndarray): The first site of each partition, plus the total number of sites.
+      sequences (np.ndarray): The (taxa x sites) uint8 sequence characters.
+      date_delimiter (str): The delimiter the dates were parsed with.
+      date_index (int): The header field the dates were parsed from.
+    """
+
+    taxa: List[str]
+    dates: np.ndarray
+    uncertainties: np.ndarray
+    paths: List[str]
+    site_offsets: np.ndarray
+    sequences: np.ndarray
+    date_delimiter: str
+    date_index: int
+
+    def partition_sequences(self, partition_index: int) -> np.ndarray:
+        """Return the (taxa x sites) sequences of a single partition."""
+        return self.sequences[:, int(self.site_offsets[partition_index]) : int(self.site_offsets[partition_index + 1])]
+
+
+NUCLEOTIDES = b"ACGT"
+
+
+def unique_site_patterns(sequences: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the unique site patterns (alignment columns) of a (taxa x sites) uint8 alignment.
+
+    Returns:
+      Tuple[np.ndarray, np.ndarray, np.ndarray]: The (patterns x taxa) unique patterns, the number
+        of sites with each pattern, and the pattern index of every site.
+
+    Examples:
+      >>> patterns, weights, site_patterns = unique_site_patterns(np.frombuffer(b"AACAAC", np.uint8).reshape(2, 3))
+      >>> patterns.tobytes(), weights.tolist(), site_patterns.tolist()
+      (b'AACC', [2, 1], [0, 0, 1])
+    """
+    patterns, site_patterns, weights = np.unique(
+        np.ascontiguousarray(sequences.T), axis=0, return_inverse=True, return_counts=True
+    )
+    return patterns, weights, site_patterns.reshape(-1)
+
+
+def compress_site_patterns(sequences: np.ndarray) -> Tuple[np.ndarray, Optional[List[int]]]:
+    """
+    Removes the constant A, C, G and T sites from an alignment and counts them instead.
+
+    Constant sites only contribute their count to the likelihood, so BEAST can be given the
+    remaining sites plus the number of constant sites of each nucleotide (`constantPatterns`).
+    Sites that are constant in a gap or ambiguity code are kept.
+
+    Args:
+      sequences (np.ndarray): The (taxa x sites) uint8 alignment.
+
+    Returns:
+      Tuple[np.ndarray, Optional[List[int]]]: The (taxa x variable sites) alignment and the constant
+        site counts in A, C, G, T order, or the alignment unchanged and None if no site is constant
+        or every site is.
+
+    Examples:
+      >>> sequences, counts = compress_site_patterns(np.frombuffer(b"AACTAGCT", np.uint8).reshape(2, 4))
+      >>> sequences.tobytes(), counts
+      (b'AG', [1, 1, 0, 1])
+    """
+    patterns, weights, site_patterns = unique_site_patterns(sequences)
+    nucleotides = np.frombuffer(NUCLEOTIDES, dtype=np.uint8)
+    upper = np.where((patterns >= ord("a")) & (patterns <= ord("z")), patterns - 32, patterns)
+    constant = (upper == upper[:, :1]).all(axis=1) & np.isin(upper[:, 0], nucleotides)
+    if not constant.any() or constant.all():
+        return sequences, None
+    counts = [int(weights[constant & (upper[:, 0] == base)].sum()) for base in nucleotides]
+    return sequences[:, ~constant[site_patterns]], counts
+
+
+def build_alignment_sidecar(alignment_paths: List[Path], date_delimiter="|", date_index=-1) -> AlignmentSidecar:
+    """
+    Parses and validates alignment partitions into a sidecar.
+
+    Args:
+      alignment_paths (List[Path]): The alignment partitions.
+      date_delimiter (str): The delimiter for the date in the fasta header.
+      date_index (int): The index of the date in the fasta header.
+
+    Returns:
+      AlignmentSidecar: The parsed partitions.
+
+    Raises:
+      ValueError: If no alignments are given or the partitions do not share taxa and dates.
+    """
+    if not alignment_paths:
+        msg = "At least one alignment partition must be provided."
+        raise ValueError(msg)
+
+    reference = None
+    blocks = []
+    for alignment_path in alignment_paths:
+        table, block = read_alignment(alignment_path, date_delimiter=date_delimiter, date_index=date_index)
+        if reference is None:
+            reference = table
+        else:
+            block = block[match_partition_taxa(reference, table, alignment_path)]
+        blocks.append(block)
+
+    return AlignmentSidecar(
+        taxa=reference.ids,
+        dates=reference.dates,
+        uncertainties=reference.uncertainties,
+        paths=[str(path) for path in alignment_paths],
+        site_offsets=np.concatenate([[0], np.cumsum([block.shape[1] for block in blocks])]).astype(np.int64),
+        sequences=np.concatenate(blocks, axis=1),
+        date_delimiter=date_delimiter,
+        date_index=date_index,
+    )
+
+
+def write_alignment_sidecar(sidecar: AlignmentSidecar, output: Path) -> None:
+    """Write an alignment sidecar to a compressed NumPy `.npz` file."""
+    with open(output, "wb") as handle:
+        np.savez_compressed(
+            handle,
+            taxa=np.array(sidecar.taxa, dtype=str),
+            dates=sidecar.dates,
+            uncertainties=sidecar.uncertainties,
+            paths=np.array(sidecar.paths, dtype=str),
+            site_offsets=sidecar.site_offsets,
+            sequences=sidecar.sequences,
+            date_delimiter=np.array(sidecar.date_delimiter),
+            date_index=np.array(sidecar.date_index),
+        )
+
+
+def read_alignment_sidecar(path: Path) -> AlignmentSidecar:
+    """Read an alignment sidecar written by `write_alignment_sidecar`."""
+    with np.load(path) as data:
+        return AlignmentSidecar(
+            taxa=data["taxa"].tolist(),
+            dates=data["dates"],
+            uncertainties=data["uncertainties"],
+            paths=data["paths"].tolist(),
+            site_offsets=data["site_offsets"],
+            sequences=data["sequences"],
+            date_delimiter=str(data["date_delimiter"]),
+            date_index=int(data["date_index"]),
+        )
+
+
+class AlignmentSummary(NamedTuple):
+    """
+    The taxon count and sampling date range of an alignment, all the Snakefile needs to build the DAG.
+
+    Attributes:
+      taxa (int): The number of taxa.
+      min_date (float): The earliest decimal sampling date.
+      max_date (float): The most recent decimal sampling date.
+    """
+
+    taxa: int
+    min_date: float
+    max_date: float
+
+
+def file_fingerprint(path: Path) -> List:
+    """Return the path, size and modification time of a file, which change whenever the file does."""
+    stat = Path(path).stat()
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def load_alignment_summary(
+    cache_path: Path, alignment_path: Path, date_delimiter="|", date_index=-1
+) -> AlignmentSummary:
+    """
+    Summarises an alignment from its headers alone, reusing a cached summary while the alignment is unchanged.
+
+    The summary is cached as JSON with the file fingerprint and date settings it was computed
+    from. When these no longer match, the headers are re-scanned (see
+    `populate_beast_template.scan_fasta_headers`) and the cache is rewritten; the cache is skipped
+    if it cannot be written.
+
+    Args:
+      cache_path (Path): The cached summary (.json).
+      alignment_path (Path): The alignment to summarise.
+      date_delimiter (str): The delimiter for the date in the fasta header.
+      date_index (int): The index of the date in the fasta header.
+
+    Returns:
+      AlignmentSummary: The taxon count and date range.
+    """
+    cache_path = Path(cache_path)
+    key = {"fingerprint": file_fingerprint(alignment_path), "date_delimiter": date_delimiter, "date_index": date_index}
+    try:
+        cached = json.loads(cache_path.read_text())
+        if {name: cached.get(name) for name in key} == key:
+            return AlignmentSummary(**cached["summary"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    dates = scan_header_dates(alignment_path, date_delimiter=date_delimiter, date_index=date_index)
+    summary = AlignmentSummary(taxa=len(dates), min_date=float(dates.min()), max_date=float(dates.max()))
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps({**key, "summary": summary._asdict()}, indent=2))
+    except OSError:
+        pass
+    return summary
+
+
+def main(
+    output: Path = typer.Argument(..., help="Output alignment sidecar (.npz)"),
+    alignment_paths: List[Path] = typer.Argument(..., help="Alignment partitions"),
+    date_delimiter: str = typer.Option("|", help="Delimiter for the date in the fasta header"),
+    date_index: int = typer.Option(-1, help="Index of the date in the fasta header"),
+):
+    """
+    Parses and validates the alignment partitions once for the rest of the workflow.
+
+    Examples:
+      >>> main(Path('alignment.npz'), [Path('HA1.fasta'), Path('HA2.fasta')], date_delimiter='|', date_index=-1)
+    """
+    sidecar = build_alignment_sidecar(alignment_paths, date_delimiter=date_delimiter, date_index=date_index)
+    write_alignment_sidecar(sidecar, output)
+    partitions = f"{len(sidecar.paths)} partition{'s' if len(sidecar.paths) != 1 else ''}"
+    typer.echo(f"Wrote {len(sidecar.taxa)} taxa and {partitions} to {output}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
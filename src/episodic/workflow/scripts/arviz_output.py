@@ -17,6 +17,11 @@ from bokeh.io.showing import _show_file_with_state
 from bokeh.plotting import figure, output_file, save
 from bokeh.resources import CDN
 
+try:
+    from episodic.workflow.scripts.compression import open_text
+except ModuleNotFoundError:
+    from compression import open_text
+
 app = typer.Typer()
 
 
@@ -81,7 +86,8 @@ def load_log_files(logs: List[Path], burnin: float = 0.1) -> pd.DataFrame:
         chain_count = 0
         for trace_log in paths:
             print(trace_log)
-            duplicate_df = pd.read_csv(trace_log, sep="\t", comment="#").rename(columns={"state": "draw"})
+            with open_text(trace_log) as handle:
+                duplicate_df = pd.read_csv(handle, sep="\t", comment="#").rename(columns={"state": "draw"})
             posterior_df = duplicate_df.truncate(before=burnin * len(duplicate_df))
             posterior_df["chain"] = chain_count
             model_df = pd.concat([model_df, posterior_df])
@@ -0,0 +1,105 @@
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+try:
+    from episodic.workflow.scripts.beast_supervisor import log_state, tree_state, truncate_to_state
+except ModuleNotFoundError:
+    from beast_supervisor import log_state, tree_state, truncate_to_state
+
+
+def checkpoint_state(path: Path) -> Optional[int]:
+    """
+    Reads the MCMC state a BEAST checkpoint was saved at.
+
+    BEAST checkpoints (`-save_state`) start with a `state<TAB>n` line.
+
+    Returns:
+      Optional[int]: The state, or None if the file is missing or not a complete checkpoint.
+    """
+    try:
+        with open(path) as handle:
+            fields = handle.readline().split()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if len(fields) != 2 or fields[0] != "state" or not fields[1].isdigit():
+        return None
+    return int(fields[1])
+
+
+def rewind_outputs(outputs: List[Path], state: int) -> bool:
+    """
+    Cuts the log and trees files of an interrupted run back to the samples before a checkpoint.
+
+    A run resumed from a checkpoint at `state` logs that state again and then appends every
+    later sample, so the samples the interrupted run wrote from `state` onwards are removed.
+    Trees files are recognised by their `.trees` suffix, any other file is a log.
+
+    Returns:
+      bool: Whether every existing output has a sample before `state` to resume after.
+    """
+    for output in outputs:
+        if not Path(output).exists():
+            continue
+        parse = tree_state if Path(output).suffix == ".trees" else log_state
+        if not truncate_to_state(output, parse, state - 1):
+            return False
+    return True
+
+
+def beast_checkpoint_args(checkpoint: Path, xml: Path, outputs: List[Path], save_every: int) -> List[str]:
+    """
+    Returns the BEAST arguments to checkpoint a run and resume it from an earlier checkpoint.
+
+    A checkpoint is resumed (`-load_state`) if it is complete and newer than the XML, and the
+    outputs are cut back to the checkpointed state so BEAST can append to them. Otherwise the
+    run starts from state 0 and overwrites any previous outputs.
+
+    Args:
+      checkpoint (Path): The checkpoint file the run saves to and resumes from.
+      xml (Path): The BEAST XML of the run.
+      outputs (List[Path]): The log and trees files of the run.
+      save_every (int): Save a checkpoint every this many states.
+
+    Returns:
+      List[str]: The BEAST arguments.
+
+    Examples:
+      >>> beast_checkpoint_args(Path('run.checkpoint'), Path('run/run.xml'), [Path('run/beast.log')], 1000000)
+      ['-overwrite', '-save_every', '1000000', '-save_state', 'run.checkpoint']
+    """
+    checkpoint = Path(checkpoint)
+    save_args = ["-save_every", str(save_every), "-save_state", str(checkpoint)]
+    state = checkpoint_state(checkpoint)
+    if (
+        state is not None
+        and state > 0
+        and checkpoint.stat().st_mtime_ns >= Path(xml).stat().st_mtime_ns
+        and rewind_outputs(outputs, state)
+    ):
+        return ["-load_state", str(checkpoint), *save_args]
+    checkpoint.unlink(missing_ok=True)
+    return ["-overwrite", *save_args]
+
+
+def main(
+    checkpoint: Path = typer.Argument(..., help="Checkpoint file the run saves to and resumes from"),
+    xml: Path = typer.Argument(..., help="BEAST XML of the run"),
+    outputs: List[Path] = typer.Argument(..., help="Log and trees files of the run"),
+    save_every: int = typer.Option(1000000, min=1, help="Save a checkpoint every N states"),
+):
+    """
+    Prints the BEAST checkpoint arguments of a run, resuming it from its last checkpoint if there is one.
+
+    Examples:
+      >>> main(Path('run.checkpoint'), Path('run/run.xml'), [Path('run/beast.log'), Path('run/beast.trees')], 1000000)
+    """
+    args = beast_checkpoint_args(checkpoint, xml, outputs, save_every)
+    if "-load_state" in args:
+        typer.echo(f"Resuming from state {checkpoint_state(checkpoint)} of {checkpoint}", err=True)
+    typer.echo(" ".join(args))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,385 @@
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.compression import SUFFIXES, open_text
+except ModuleNotFoundError:
+    from compression import SUFFIXES, open_text
+
+MIN_SAMPLES = 100
+REVERSE_BLOCK_BYTES = 1024 * 1024
+
+
+class TraceLog:
+    """
+    Incrementally reads a BEAST trace log that is still being written.
+
+    Each `update` only parses the complete lines appended since the previous one, so a log can
+    be polled for the whole length of a run at the cost of reading it once.
+
+    Attributes:
+      path (Path): The trace log.
+      columns (List[str]): The column names, once the header has been written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.columns: List[str] = []
+        self._offset = 0
+        self._rows: List[np.ndarray] = []
+
+    def update(self) -> int:
+        """Read the lines appended since the last update and return the number of new samples."""
+        if not self.path.exists():
+            return 0
+        with open(self.path, "rb") as handle:
+            handle.seek(self._offset)
+            data = handle.read()
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        rows = []
+        for line in data[:end].decode().splitlines():
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if not self.columns:
+                self.columns = fields
+                continue
+            # a run resumed from a checkpoint may write the header again
+            if fields != self.columns:
+                rows.append(fields)
+        if rows:
+            self._rows.append(np.array(rows, dtype=np.float64))
+        return len(rows)
+
+    @property
+    def values(self) -> np.ndarray:
+        """The (samples x columns) values read so far."""
+        if len(self._rows) > 1:
+            self._rows = [np.concatenate(self._rows)]
+        return self._rows[0] if self._rows else np.empty((0, len(self.columns)))
+
+
+def read_trace_log(path: Path) -> TraceLog:
+    """Read a complete, optionally gzip or zstd compressed, trace log."""
+    trace = TraceLog(path)
+    with open_text(path) as handle:
+        rows = []
+        for line in handle:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if not trace.columns:
+                trace.columns = fields
+            elif fields != trace.columns:
+                rows.append(fields)
+    if rows:
+        trace._rows.append(np.array(rows, dtype=np.float64))
+    return trace
+
+
+def convergence_columns(columns: List[str]) -> List[str]:
+    """
+    Return the columns convergence is assessed on: the posterior, the likelihood and the clock rates.
+
+    Examples:
+      >>> columns = ["state", "posterior", "prior", "likelihood", "BA.2.86.stem.rate", "background.ucgd.mean"]
+      >>> convergence_columns(columns)
+      ['posterior', 'likelihood', 'BA.2.86.stem.rate', 'background.ucgd.mean']
+    """
+    return [
+        column
+        for column in columns
+        if column in ("posterior", "likelihood") or column.endswith(".rate") or column.endswith(".ucgd.mean")
+    ]
+
+
+def effective_sample_size(values: np.ndarray) -> np.ndarray:
+    """
+    Estimates the effective sample size of each column of a (samples x parameters) chain.
+
+    The autocorrelations of all columns are computed at once with an FFT and summed using
+    Geyer's initial positive sequence. Constant columns have an effective sample size equal to the
+    number of samples.
+
+    Examples:
+      >>> rng = np.random.default_rng(1)
+      >>> bool(effective_sample_size(rng.normal(size=(4000, 1)))[0] > 3000)
+      True
+    """
+    n_samples = values.shape[0]
+    if n_samples < 4:
+        return np.zeros(values.shape[1])
+    centered = values - values.mean(axis=0)
+    size = 1 << (2 * n_samples - 1).bit_length()
+    spectrum = np.fft.rfft(centered, n=size, axis=0)
+    autocovariance = np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=0)[:n_samples]
+    variance = autocovariance[0]
+    constant = variance <= 0
+    autocorrelation = autocovariance / np.where(constant, 1.0, variance)
+
+    n_pairs = n_samples // 2
+    pairs = autocorrelation[: 2 * n_pairs].reshape(n_pairs, 2, -1).sum(axis=1)
+    # sum the pairs up to the first non-positive one
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    autocorrelation_time = -1.0 + 2.0 * np.where(positive, pairs, 0.0).sum(axis=0)
+    ess = n_samples / np.maximum(autocorrelation_time, 1.0 / n_samples)
+    return np.where(constant, float(n_samples), np.minimum(ess, n_samples * np.log10(n_samples)))
+
+
+def split_rhat(chains: List[np.ndarray]) -> np.ndarray:
+    """
+    Computes the split-R̂ of each column across (samples x parameters) chains.
+
+    The chains are cut to the length of the shortest one and each is split in half, so a single
+    chain is also checked for drift between its first and second half.
+
+    Examples:
+      >>> rng = np.random.default_rng(1)
+      >>> bool(split_rhat([rng.normal(size=(1000, 2)), rng.normal(size=(1000, 2))]).max() < 1.01)
+      True
+    """
+    n_samples = min(len(chain) for chain in chains) // 2
+    if n_samples < 2:
+        return np.full(chains[0].shape[1], np.inf)
+    halves = np.stack(
+        [half for chain in chains for half in (chain[-2 * n_samples : -n_samples], chain[-n_samples:])]
+    )
+    within = halves.var(axis=1, ddof=1).mean(axis=0)
+    between = n_samples * halves.mean(axis=1).var(axis=0, ddof=1)
+    pooled = (n_samples - 1) / n_samples * within + between / n_samples
+    constant = within <= 0
+    return np.where(constant, 1.0, np.sqrt(pooled / np.where(constant, 1.0, within)))
+
+
+class Convergence(NamedTuple):
+    """
+    The convergence diagnostics of a run.
+
+    Attributes:
+      samples (int): The number of samples after burn-in.
+      min_ess (float): The lowest effective sample size of the assessed columns.
+      max_rhat (float): The highest split-R̂ of the assessed columns across the available chains.
+      chains (int): The number of chains R̂ was computed over.
+      converged (bool): Whether the thresholds are met.
+    """
+
+    samples: int
+    min_ess: float
+    max_rhat: float
+    chains: int
+    converged: bool
+
+
+def assess_convergence(
+    trace: TraceLog, others: List[TraceLog], burnin: float = 0.1, min_ess: float = 200, max_rhat: float = 1.05
+) -> Convergence:
+    """
+    Checks whether a run has converged.
+
+    The ESS of the posterior, likelihood and rate columns of the run must reach `min_ess`, and
+    their split-R̂ across the run and the other duplicates with enough samples must not exceed
+    `max_rhat`. Burn-in is removed from every chain first.
+    """
+    columns = convergence_columns(trace.columns)
+    values = trace.values
+    chain = values[int(len(values) * burnin) :][:, [trace.columns.index(column) for column in columns]]
+    if len(chain) < MIN_SAMPLES or not columns:
+        return Convergence(len(chain), 0.0, np.inf, 1, False)
+
+    chains = [chain]
+    for other in others:
+        if other.columns and all(column in other.columns for column in columns):
+            other_values = other.values
+            other_chain = other_values[int(len(other_values) * burnin) :]
+            if len(other_chain) >= MIN_SAMPLES:
+                chains.append(other_chain[:, [other.columns.index(column) for column in columns]])
+
+    ess = float(effective_sample_size(chain).min())
+    rhat = float(split_rhat(chains).max())
+    return Convergence(len(chain), ess, rhat, len(chains), ess >= min_ess and rhat <= max_rhat)
+
+
+def run_trace_log(run_dir: Path) -> Optional[Path]:
+    """
+    Return the trace log of a run directory.
+
+    This is the log BEAST is writing, or the renamed (and compressed) log of a finished run.
+    """
+    run_dir = Path(run_dir)
+    for candidate in [run_dir / "beast.log", run_dir / f"{run_dir.name}.log"] + [
+        run_dir / f"{run_dir.name}.log{suffix}" for suffix in SUFFIXES.values()
+    ]:
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def update_chains(chains: Dict[Path, Optional[TraceLog]]) -> List[TraceLog]:
+    """
+    Updates the trace logs of other duplicates and returns those found so far.
+
+    Duplicates that have not started yet are picked up once their log appears, and the log of a
+    duplicate that has finished, and been renamed or compressed, is re-read from its final file.
+    """
+    for run_dir, trace in chains.items():
+        if trace is not None and trace.path.exists():
+            trace.update()
+            continue
+        path = run_trace_log(run_dir)
+        if path is not None:
+            chains[run_dir] = read_trace_log(path) if path.name != "beast.log" else TraceLog(path)
+            chains[run_dir].update()
+    return [trace for trace in chains.values() if trace is not None]
+
+
+def iter_lines_reversed(path: Path, block_size: int = REVERSE_BLOCK_BYTES) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yields the lines of a file from last to first, with the byte offset each line starts at.
+
+    The file is read backwards in blocks, so only the end of a large file is read when the
+    caller stops early.
+    """
+    with open(path, "rb") as handle:
+        position = handle.seek(0, 2)
+        buffer = b""
+        while True:
+            newline = buffer.rfind(b"\n", 0, max(len(buffer) - 1, 0))
+            if newline >= 0:
+                yield position + newline + 1, buffer[newline + 1 :]
+                buffer = buffer[: newline + 1]
+            elif position > 0:
+                read = min(block_size, position)
+                position -= read
+                handle.seek(position)
+                buffer = handle.read(read) + buffer
+            else:
+                if buffer:
+                    yield 0, buffer
+                return
+
+
+def log_state(line: bytes) -> Optional[int]:
+    """Return the state of a trace log row, or None for other lines."""
+    state = line.split(b"\t", 1)[0].strip()
+    return int(state) if state.isdigit() else None
+
+
+def tree_state(line: bytes) -> Optional[int]:
+    """Return the state of a `tree STATE_n = ...` line, or None for other lines."""
+    line = line.strip()
+    if not line.startswith(b"tree STATE_"):
+        return None
+    return int(line[len(b"tree STATE_") :].split(None, 1)[0])
+
+
+def last_state(path: Path, parse: Callable[[bytes], Optional[int]]) -> Optional[int]:
+    """Return the state of the last complete sample of a log or trees file."""
+    for _, line in iter_lines_reversed(path):
+        if not line.endswith(b"\n"):
+            continue
+        state = parse(line)
+        if state is not None:
+            return state
+    return None
+
+
+def truncate_to_state(path: Path, parse: Callable[[bytes], Optional[int]], state: int) -> bool:
+    """
+    Truncate a log or trees file after its last complete sample at or before `state`.
+
+    Returns:
+      bool: Whether the file has such a sample. Files without one are left unchanged.
+    """
+    for offset, line in iter_lines_reversed(path):
+        line_state = parse(line)
+        if line.endswith(b"\n") and line_state is not None and line_state <= state:
+            with open(path, "r+b") as handle:
+                handle.truncate(offset + len(line))
+            return True
+    return False
+
+
+def finalize_outputs(log_path: Path, trees_path: Optional[Path] = None) -> Optional[int]:
+    """
+    Cuts the outputs of a stopped run back to their last common sample and closes the trees block.
+
+    BEAST writes the log and the trees at the same states, but a stopped run can leave a partial
+    line in either file or one more sample in one of them.
+
+    Returns:
+      Optional[int]: The state of the last sample kept.
+    """
+    states = [last_state(log_path, log_state)]
+    if trees_path is not None and Path(trees_path).exists():
+        states.append(last_state(trees_path, tree_state))
+    if any(state is None for state in states):
+        return None
+    final_state = min(states)
+    truncate_to_state(log_path, log_state, final_state)
+    if len(states) > 1:
+        truncate_to_state(trees_path, tree_state, final_state)
+        with open(trees_path, "ab") as handle:
+            handle.write(b"End;\n")
+    return final_state
+
+
+def main(
+    command: List[str] = typer.Argument(..., help="The BEAST command to run, after '--'."),
+    log_path: Path = typer.Option(..., "--log", help="The trace log the BEAST run writes."),
+    trees_path: Optional[Path] = typer.Option(None, "--trees", help="The trees file the BEAST run writes."),
+    chains: Optional[List[Path]] = typer.Option(
+        None, "--chain", help="Run directory of another duplicate to compute R-hat across. Can specify multiple."
+    ),
+    min_ess: float = typer.Option(200, help="Minimum ESS of the posterior, likelihood and rate columns."),
+    max_rhat: float = typer.Option(1.05, help="Maximum split R-hat across the duplicates."),
+    burnin: float = typer.Option(0.1, help="Fraction of each chain discarded as burn-in."),
+    check_every: float = typer.Option(600, help="Seconds between convergence checks."),
+):
+    """
+    Runs BEAST and stops it once the chain has converged.
+
+    The trace log is re-read incrementally every `check_every` seconds. Once the ESS and R-hat
+    thresholds are met BEAST is stopped and its log and trees files are cut back to their last
+    common sample, so they are complete outputs of a shorter chain. Runs that do not converge
+    continue up to the chain length in the XML.
+
+    Examples:
+      >>> command = ['beast', '-seed', '1', 'run.xml']
+      >>> main(command, Path('run/beast.log'), Path('run/beast.trees'), [Path('run_2')], 200, 1.05, 0.1, 600)
+    """
+    trace = TraceLog(log_path)
+    other_chains: Dict[Path, Optional[TraceLog]] = dict.fromkeys(chains or [])
+    process = subprocess.Popen(command)
+    while True:
+        try:
+            returncode = process.wait(timeout=check_every)
+        except subprocess.TimeoutExpired:
+            pass
+        else:
+            raise typer.Exit(returncode)
+
+        trace.update()
+        convergence = assess_convergence(
+            trace, update_chains(other_chains), burnin=burnin, min_ess=min_ess, max_rhat=max_rhat
+        )
+        chains = f"{convergence.chains} chain{'s' if convergence.chains != 1 else ''}"
+        typer.echo(
+            f"{convergence.samples} samples: min ESS {convergence.min_ess:.0f}, "
+            f"max R-hat {convergence.max_rhat:.3f} over {chains}",
+            err=True,
+        )
+        if convergence.converged:
+            process.terminate()
+            process.wait()
+            final_state = finalize_outputs(log_path, trees_path)
+            typer.echo(f"Converged, stopped BEAST at state {final_state}", err=True)
+            raise typer.Exit(0)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,594 @@
+import io
+import os
+import re
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import dendropy
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.compression import is_compressed, open_binary
+except ModuleNotFoundError:
+    from compression import is_compressed, open_binary
+
+TREE_PREFIX = b"tree STATE_"
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+app = typer.Typer()
+
+NEWICK_TOKEN = re.compile(r"\[&[^\]]*\]|'(?:[^']|'')*'|[(),;:]|[^(),;:\[\]\s]+")
+ANNOTATION = re.compile(r"([^=,{}]+)=(\{[^}]*\}|[^,]*)")
+TRANSLATE_BLOCK = re.compile(r"\bTranslate\b(.*?);", re.IGNORECASE | re.DOTALL)
+TRANSLATE_ENTRY = re.compile(r"([^,\s']+)\s+('(?:[^']|'')*'|[^,\s']+)")
+
+
+class TreeChunk(NamedTuple):
+    """
+    A byte range of a BEAST trees file holding whole `tree STATE_` lines.
+
+    Byte offsets are positions in the decompressed stream for gzip and zstd files.
+
+    Attributes:
+      first_tree (int): Index of the first tree in the chunk (0-based, over the whole file).
+      start (int): Byte offset of the first tree line.
+      end (int): Byte offset just past the last tree line.
+      body (bytes, optional): The chunk's bytes, when already read by the caller, see `map_chunks`.
+    """
+
+    first_tree: int
+    start: int
+    end: int
+    body: Optional[bytes] = None
+
+
+class TreeIndex(NamedTuple):
+    """
+    A byte-offset index of a BEAST trees file, stored as a sidecar next to the file.
+
+    Attributes:
+      header_length (int): The number of bytes before the first tree (the NEXUS taxa block and translate table).
+      translate_offset (int): Byte offset of the `Translate` line.
+      translate_length (int): Length in bytes of the `Translate` block, up to and including its closing `;`.
+      states (np.ndarray): The MCMC state of each tree.
+      offsets (np.ndarray): The byte offset of each `tree STATE_` line.
+      lengths (np.ndarray): The length in bytes of each tree line, including the newline.
+      file_size (int): The size of the indexed file, used to detect a stale index.
+      mtime_ns (int): The modification time of the indexed file, used to detect a stale index.
+    """
+
+    header_length: int
+    translate_offset: int
+    translate_length: int
+    states: np.ndarray
+    offsets: np.ndarray
+    lengths: np.ndarray
+    file_size: int
+    mtime_ns: int
+
+    @property
+    def trees_end(self) -> int:
+        """The byte offset just past the last tree line."""
+        return int(self.offsets[-1] + self.lengths[-1])
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+def tree_index_path(trees_path: Path) -> Path:
+    """Return the path of the sidecar index of a trees file, e.g. `run.trees.idx.npz`."""
+    trees_path = Path(trees_path)
+    return trees_path.with_name(f"{trees_path.name}.idx.npz")
+
+
+def build_tree_index(trees_path: Path) -> TreeIndex:
+    """
+    Indexes every `tree STATE_` line of a BEAST trees file with a single line scan.
+
+    Gzip and zstd files are indexed by their decompressed byte offsets.
+
+    Args:
+      trees_path (Path): The path to the BEAST trees file.
+
+    Returns:
+      TreeIndex: The index of the file.
+
+    Raises:
+      ValueError: If the file does not contain any trees.
+    """
+    stat = Path(trees_path).stat()
+    states: List[int] = []
+    offsets: List[int] = []
+    lengths: List[int] = []
+    translate_offset = translate_end = -1
+    position = 0
+    with open_binary(trees_path) as handle:
+        for line in handle:
+            if line.startswith(TREE_PREFIX):
+                states.append(int(line[len(TREE_PREFIX) : line.index(b" ", len(TREE_PREFIX))]))
+                offsets.append(position)
+                lengths.append(len(line))
+            elif not offsets:
+                if translate_offset < 0 and line.strip().lower().startswith(b"translate"):
+                    translate_offset = position
+                if translate_offset >= 0 and translate_end < 0 and b";" in line:
+                    translate_end = position + line.index(b";") + 1
+            position += len(line)
+    if not offsets:
+        msg = f"No trees found in '{trees_path}'."
+        raise ValueError(msg)
+    if translate_offset < 0:
+        translate_offset = translate_end = offsets[0]
+    return TreeIndex(
+        header_length=offsets[0],
+        translate_offset=translate_offset,
+        translate_length=translate_end - translate_offset,
+        states=np.array(states, dtype=np.int64),
+        offsets=np.array(offsets, dtype=np.int64),
+        lengths=np.array(lengths, dtype=np.int64),
+        file_size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+    )
+
+
+def write_tree_index(index: TreeIndex, index_path: Path) -> None:
+    """
+    Write a tree index to a NumPy `.npz` file.
+
+    The index is written to a temporary file next to `index_path` and moved into place, so a
+    concurrent reader sees either the previous index or the complete new one.
+    """
+    meta = [
+        index.header_length,
+        index.translate_offset,
+        index.translate_length,
+        index.file_size,
+        index.mtime_ns,
+    ]
+    index_path = Path(index_path)
+    handle, temporary = tempfile.mkstemp(dir=index_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as handle:
+            np.savez(
+                handle,
+                meta=np.array(meta, dtype=np.int64),
+                states=index.states,
+                offsets=index.offsets,
+                lengths=index.lengths,
+            )
+        os.replace(temporary, index_path)
+    except BaseException:
+        Path(temporary).unlink(missing_ok=True)
+        raise
+
+
+def read_tree_index(index_path: Path) -> TreeIndex:
+    """Read a tree index written by `write_tree_index`."""
+    with np.load(index_path) as data:
+        header_length, translate_offset, translate_length, file_size, mtime_ns = data["meta"].tolist()
+        return TreeIndex(
+            header_length=header_length,
+            translate_offset=translate_offset,
+            translate_length=translate_length,
+            states=data["states"],
+            offsets=data["offsets"],
+            lengths=data["lengths"],
+            file_size=file_size,
+            mtime_ns=mtime_ns,
+        )
+
+
+def load_tree_index(trees_path: Path) -> TreeIndex:
+    """
+    Loads the sidecar index of a trees file, building and saving it first if it is missing or stale.
+
+    The index is stale when the size or modification time of the trees file no longer matches,
+    e.g. because BEAST appended more trees. If the sidecar cannot be written (read-only directory),
+    the freshly built index is returned without saving it.
+
+    Args:
+      trees_path (Path): The path to the BEAST trees file.
+
+    Returns:
+      TreeIndex: The index of the file.
+    """
+    index_path = tree_index_path(trees_path)
+    stat = Path(trees_path).stat()
+    if index_path.exists():
+        try:
+            index = read_tree_index(index_path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            index = None
+        if index is not None and (index.file_size, index.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return index
+    index = build_tree_index(trees_path)
+    try:
+        write_tree_index(index, index_path)
+    except OSError:
+        pass
+    return index
+
+
+def select_trees(n_trees: int, burnin: int = 0, every: int = 1, max_trees: Optional[int] = None) -> np.ndarray:
+    """
+    Chooses which trees to read after discarding burn-in and thinning.
+
+    Args:
+      n_trees (int): The number of trees in the file.
+      burnin (int): The number of leading trees to discard.
+      every (int): Keep every `every`-th tree after the burn-in.
+      max_trees (int, optional): Thin further, evenly across the kept trees, so at most this many remain.
+
+    Returns:
+      np.ndarray: The indices of the selected trees, in file order.
+
+    Examples:
+      >>> select_trees(10, burnin=2, every=3).tolist()
+      [2, 5, 8]
+      >>> select_trees(10, max_trees=4).tolist()
+      [0, 3, 6, 9]
+    """
+    selection = np.arange(burnin, n_trees, max(every, 1))
+    if max_trees is not None and len(selection) > max_trees:
+        keep = np.unique(np.linspace(0, len(selection) - 1, max(max_trees, 1)).round().astype(int))
+        selection = selection[keep]
+    return selection
+
+
+def read_translate(trees_path: Path, index: TreeIndex) -> str:
+    """Read only the `Translate` block of a trees file, see `parse_translate`."""
+    with open_binary(trees_path) as handle:
+        handle.seek(index.translate_offset)
+        return handle.read(index.translate_length).decode()
+
+
+def read_tree_lines(trees_path: Path, index: TreeIndex, selection: Iterable[int]) -> Iterator[str]:
+    """
+    Reads selected tree lines by seeking straight to their byte offsets.
+
+    Runs of consecutive trees are read with a single call, so the amount read is proportional
+    to the number of selected trees rather than the size of the file.
+
+    Args:
+      trees_path (Path): The path to the BEAST trees file.
+      index (TreeIndex): The index of the file, see `load_tree_index`.
+      selection (Iterable[int]): The indices of the trees to read, in file order.
+
+    Returns:
+      Iterator[str]: The selected `tree STATE_` lines without their newline.
+    """
+    selection = list(selection)
+    with open_binary(trees_path) as handle:
+        run_start = 0
+        while run_start < len(selection):
+            run_end = run_start + 1
+            while run_end < len(selection) and selection[run_end] == selection[run_end - 1] + 1:
+                run_end += 1
+            first, last = selection[run_start], selection[run_end - 1]
+            start = int(index.offsets[first])
+            handle.seek(start)
+            body = handle.read(int(index.offsets[last] + index.lengths[last]) - start).decode()
+            yield from body.splitlines()
+            run_start = run_end
+
+
+def write_trees_subset(trees_path: Path, index: TreeIndex, selection: Iterable[int], output: Path) -> int:
+    """
+    Writes the header and the selected trees of a trees file as a new NEXUS trees file.
+
+    Returns:
+      int: The number of trees written.
+    """
+    with open_binary(trees_path) as handle:
+        header = handle.read(index.header_length).decode()
+    count = 0
+    with open(output, "w") as out:
+        out.write(header)
+        for line in read_tree_lines(trees_path, index, selection):
+            out.write(f"{line}\n")
+            count += 1
+        out.write("End;\n")
+    return count
+
+
+def split_tree_offsets(
+    offsets: List[int], trees_end: int, n_chunks: int, first_tree: int = 0
+) -> List[TreeChunk]:
+    """
+    Splits a list of tree offsets into contiguous chunks of roughly equal tree counts.
+
+    Args:
+      offsets (List[int]): Byte offsets of the trees to split.
+      trees_end (int): The byte offset just past the last tree in `offsets`.
+      n_chunks (int): The maximum number of chunks to create.
+      first_tree (int): The index of the first tree in `offsets` within the file.
+
+    Returns:
+      List[TreeChunk]: The chunks in file order.
+
+    Examples:
+      >>> split_tree_offsets([10, 20, 30], 40, 2)
+      [TreeChunk(first_tree=0, start=10, end=30, body=None), TreeChunk(first_tree=2, start=30, end=40, body=None)]
+    """
+    if len(offsets) == 0:
+        return []
+    offsets = [int(offset) for offset in offsets]
+    n_chunks = max(1, min(n_chunks, len(offsets)))
+    bounds = [round(i * len(offsets) / n_chunks) for i in range(n_chunks + 1)]
+    chunks = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        end = offsets[upper] if upper < len(offsets) else trees_end
+        chunks.append(TreeChunk(first_tree=first_tree + lower, start=offsets[lower], end=end))
+    return chunks
+
+
+def chunk_count(n_bytes: int, jobs: int, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> int:
+    """Return how many chunks to split `n_bytes` of trees into so every worker stays busy and chunks stay small."""
+    return max(jobs, -(-n_bytes // chunk_bytes))
+
+
+def read_header(trees_path: Path, header_end: int) -> str:
+    """Read the NEXUS header (taxa block and translate table) that precedes the first tree."""
+    with open_binary(trees_path) as handle:
+        return handle.read(header_end).decode()
+
+
+def read_chunk(trees_path: Path, chunk: TreeChunk) -> str:
+    """Return the text of a chunk, seeking to it unless the caller already attached its `body`."""
+    if chunk.body is not None:
+        return chunk.body.decode()
+    with open_binary(trees_path) as handle:
+        handle.seek(chunk.start)
+        return handle.read(chunk.end - chunk.start).decode()
+
+
+def map_chunks(pool, func: Callable, trees_path: Path, chunks: List[TreeChunk], jobs: int) -> Iterator:
+    """
+    Applies `func` to every chunk in a worker pool and yields the results in chunk order.
+
+    Workers read plain files by seeking to their own chunk. A compressed file cannot be seeked
+    cheaply, so it is decompressed once as a stream here and the chunks are handed to the workers
+    with their `body` attached, `jobs` chunks at a time to bound memory use.
+
+    Args:
+      pool (multiprocessing.pool.Pool): The worker pool.
+      func (Callable): The function to apply to each chunk.
+      trees_path (Path): The path to the BEAST trees file.
+      chunks (List[TreeChunk]): The chunks, in file order.
+      jobs (int): The number of workers in the pool.
+
+    Returns:
+      Iterator: The result of `func` for each chunk.
+    """
+    if not is_compressed(trees_path):
+        yield from pool.imap(func, chunks)
+        return
+    with open_binary(trees_path) as handle:
+        for lower in range(0, len(chunks), jobs):
+            window = []
+            for chunk in chunks[lower : lower + jobs]:
+                handle.seek(chunk.start)
+                window.append(chunk._replace(body=handle.read(chunk.end - chunk.start)))
+            yield from pool.map(func, window)
+
+
+def yield_chunk_trees(trees_path: Path, header: str, chunk: TreeChunk) -> Iterator[dendropy.Tree]:
+    """
+    Parses the trees in a chunk of a BEAST trees file.
+
+    Args:
+      trees_path (Path): The path to the BEAST trees file.
+      header (str): The NEXUS header of the file, see `read_header`.
+      chunk (TreeChunk): The byte range to parse.
+
+    Returns:
+      Iterator[dendropy.Tree]: The trees in the chunk, in file order.
+    """
+    body = read_chunk(trees_path, chunk)
+    stream = io.StringIO(f"{header}{body}End;\n")
+    yield from dendropy.Tree.yield_from_files(files=[stream], schema="nexus", preserve_underscores=True)
+
+
+class TreeArrays(NamedTuple):
+    """
+    A tree stored as flat arrays with nodes in post-order (children before their parent, root last).
+
+    Attributes:
+      parent (np.ndarray): The index of each node's parent, -1 for the root.
+      length (np.ndarray): The branch length above each node, NaN for the root.
+      taxon (np.ndarray): The index of each tip into the taxon table, -1 for internal nodes.
+      annotations (Dict[str, np.ndarray]): Numeric node annotations such as `rate`, NaN where missing.
+    """
+
+    parent: np.ndarray
+    length: np.ndarray
+    taxon: np.ndarray
+    annotations: Dict[str, np.ndarray]
+
+
+def unquote(label: str) -> str:
+    """Remove NEXUS single quotes from a label."""
+    if len(label) > 1 and label[0] == label[-1] == "'":
+        return label[1:-1].replace("''", "'")
+    return label
+
+
+def quote(label: str) -> str:
+    """Quote a label for NEXUS output when it contains characters other than letters, digits and underscores."""
+    if re.fullmatch(r"\w+", label):
+        return label
+    escaped = label.replace("'", "''")
+    return f"'{escaped}'"
+
+
+def parse_translate(header: str) -> Dict[str, int]:
+    """
+    Parses the `Translate` block of a NEXUS trees header.
+
+    Args:
+      header (str): The NEXUS header, see `read_header`.
+
+    Returns:
+      Dict[str, int]: The index into the taxon table of each translate key.
+    """
+    return {key: index for index, (key, _) in enumerate(translate_entries(header))}
+
+
+def translate_entries(header: str) -> List[Tuple[str, str]]:
+    """Return the (key, taxon label) pairs of the `Translate` block in file order."""
+    match = TRANSLATE_BLOCK.search(header)
+    if match is None:
+        msg = "Trees header does not contain a Translate block."
+        raise ValueError(msg)
+    return [(key, unquote(label)) for key, label in TRANSLATE_ENTRY.findall(match.group(1))]
+
+
+def parse_annotation(comment: str) -> Dict[str, float]:
+    """
+    Parses the numeric values of a BEAST `[&key=value,...]` comment.
+
+    Examples:
+      >>> parse_annotation("[&rate=0.5,height_95%_HPD={1,2}]")
+      {'rate': 0.5}
+    """
+    values = {}
+    for key, value in ANNOTATION.findall(comment[2:-1]):
+        try:
+            values[key.strip()] = float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def parse_newick(newick: str, translate: Dict[str, int]) -> TreeArrays:
+    """
+    Parses a BEAST newick string into post-order arrays.
+
+    Args:
+      newick (str): The newick string, optionally prefixed with a `[&R]` comment.
+      translate (Dict[str, int]): The taxon index of each tip label, see `parse_translate`.
+
+    Returns:
+      TreeArrays: The parsed tree.
+    """
+    parent: List[int] = []
+    length: List[float] = []
+    taxon: List[int] = []
+    node_annotations: List[Dict[str, float]] = []
+    children: List[List[int]] = [[]]
+    last = -1
+    expect_length = False
+
+    for token in NEWICK_TOKEN.findall(newick):
+        if token == "(":
+            children.append([])
+        elif token == ")" or (token not in ",;:" and token[0] != "[" and not expect_length):
+            last = len(parent)
+            parent.append(-1)
+            length.append(np.nan)
+            node_annotations.append({})
+            if token == ")":
+                for child in children.pop():
+                    parent[child] = last
+                taxon.append(-1)
+            else:
+                taxon.append(translate.get(token, translate.get(unquote(token), -1)))
+            children[-1].append(last)
+        elif token == ":":
+            expect_length = True
+        elif expect_length:
+            length[last] = float(token)
+            expect_length = False
+        elif token[0] == "[":
+            if last >= 0:
+                node_annotations[last].update(parse_annotation(token))
+
+    keys = sorted({key for values in node_annotations for key in values})
+    annotations = {key: np.array([values.get(key, np.nan) for values in node_annotations]) for key in keys}
+    return TreeArrays(
+        parent=np.array(parent, dtype=np.intp),
+        length=np.array(length, dtype=float),
+        taxon=np.array(taxon, dtype=np.intp),
+        annotations=annotations,
+    )
+
+
+def tree_line_newick(line: str) -> str:
+    """Return the newick part of a `tree STATE_... = [&R] (...);` line."""
+    return line[line.index(" = ") + 3 :].strip()
+
+
+def yield_chunk_arrays(trees_path: Path, translate: Dict[str, int], chunk: TreeChunk) -> Iterator[TreeArrays]:
+    """
+    Parses the trees in a chunk of a BEAST trees file into arrays, without dendropy.
+
+    Args:
+      trees_path (Path): The path to the BEAST trees file.
+      translate (Dict[str, int]): The taxon index of each tip label, see `parse_translate`.
+      chunk (TreeChunk): The byte range to parse.
+
+    Returns:
+      Iterator[TreeArrays]: The trees in the chunk, in file order.
+    """
+    for line in read_chunk(trees_path, chunk).splitlines():
+        if line.startswith("tree STATE_"):
+            yield parse_newick(tree_line_newick(line), translate)
+
+
+def node_heights(tree: TreeArrays) -> np.ndarray:
+    """Return the height of every node above the most recent tip."""
+    parents = tree.parent.tolist()
+    lengths = np.nan_to_num(tree.length).tolist()
+    depth = [0.0] * len(parents)
+    for node in range(len(parents) - 2, -1, -1):
+        depth[node] = depth[parents[node]] + lengths[node]
+    depth = np.array(depth)
+    return depth.max() - depth
+
+
+def clade_bitsets(tree: TreeArrays) -> List[int]:
+    """Return the set of taxon indices below every node as an integer bitset."""
+    masks = [1 << taxon if taxon >= 0 else 0 for taxon in tree.taxon.tolist()]
+    for node, parent in enumerate(tree.parent[:-1].tolist()):
+        masks[parent] |= masks[node]
+    return masks
+
+
+@app.command()
+def index(trees_path: Path = typer.Argument(..., help="BEAST trees file to index")):
+    """
+    Builds the sidecar byte-offset index of a trees file.
+
+    Examples:
+      >>> index(Path('run.trees'))
+    """
+    tree_index = build_tree_index(trees_path)
+    write_tree_index(tree_index, tree_index_path(trees_path))
+    typer.echo(f"Indexed {len(tree_index)} trees in {trees_path}")
+
+
+@app.command()
+def thin(
+    trees_path: Path = typer.Argument(..., help="BEAST trees file to thin"),
+    output: Path = typer.Argument(..., help="Output NEXUS trees file"),
+    burnin: float = typer.Option(0.1, help="Fraction of trees to discard as burn-in"),
+    every: int = typer.Option(1, min=1, help="Keep every k-th tree after the burn-in"),
+    max_trees: Optional[int] = typer.Option(None, min=1, help="Thin evenly so at most this many trees remain"),
+):
+    """
+    Writes a burn-in discarded, thinned copy of a trees file, reading only the selected trees.
+
+    Examples:
+      >>> thin(Path('run.trees'), Path('run.thinned.trees'), burnin=0.1, every=1, max_trees=1000)
+    """
+    tree_index = load_tree_index(trees_path)
+    selection = select_trees(len(tree_index), int(len(tree_index) * burnin), every, max_trees)
+    count = write_trees_subset(trees_path, tree_index, selection, output)
+    typer.echo(f"Wrote {count} of {len(tree_index)} trees to {output}")
+
+
+if __name__ == "__main__":
+    app()
@@ -6,6 +6,11 @@ import numpy as np
 import pandas as pd
 import typer
 
+try:
+    from episodic.workflow.scripts.compression import open_text
+except ModuleNotFoundError:
+    from compression import open_text
+
 
 def safe_log(x):
     """Returns the logarithm of x if x is positive, otherwise returns None."""
@@ -105,7 +110,8 @@ def calculate_odds(
     # Read the CSV file into a DataFrame df
     dfs = []
     for log_path in logs:
-        duplicate = pd.read_csv(log_path, sep="\t", comment="#")
+        with open_text(log_path) as handle:
+            duplicate = pd.read_csv(handle, sep="\t", comment="#")
         # discard burn-in
         dfs.append(duplicate[int(burnin * len(duplicate)) :])
 
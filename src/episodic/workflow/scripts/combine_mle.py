@@ -0,0 +1,121 @@
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.beast_supervisor import read_trace_log
+except ModuleNotFoundError:
+    from beast_supervisor import read_trace_log
+
+THETA_COLUMN = "pathLikelihood.theta"
+DELTA_COLUMN = "pathLikelihood.delta"
+
+
+class MarginalLikelihood(NamedTuple):
+    """
+    Log marginal likelihood estimates from a set of power posteriors.
+
+    Attributes:
+      path_sampling (float): The path sampling (thermodynamic integration) estimate.
+      stepping_stone (float): The stepping-stone sampling estimate.
+      powers (int): The number of distinct powers sampled.
+      samples (int): The number of samples.
+    """
+
+    path_sampling: float
+    stepping_stone: float
+    powers: int
+    samples: int
+
+
+def read_path_samples(paths: List[Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads and concatenates the power posterior samples of MLE logs.
+
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: The power (`pathLikelihood.theta`) and log likelihood
+        (`pathLikelihood.delta`) of every sample.
+    """
+    thetas, deltas = [], []
+    for path in paths:
+        trace = read_trace_log(path)
+        if THETA_COLUMN not in trace.columns or DELTA_COLUMN not in trace.columns:
+            msg = f"{path} has no {THETA_COLUMN} and {DELTA_COLUMN} columns"
+            raise ValueError(msg)
+        thetas.append(trace.values[:, trace.columns.index(THETA_COLUMN)])
+        deltas.append(trace.values[:, trace.columns.index(DELTA_COLUMN)])
+    return np.concatenate(thetas), np.concatenate(deltas)
+
+
+def marginal_likelihood(theta: np.ndarray, delta: np.ndarray) -> MarginalLikelihood:
+    """
+    Estimates the log marginal likelihood from samples of power posteriors.
+
+    Samples are pooled by power, so the logs of chains that sampled the same powers can simply
+    be concatenated. As in BEAST's `pathSamplingAnalysis`, path sampling integrates the mean log
+    likelihood of each power with the trapezoidal rule. As in `steppingStoneSamplingAnalysis`,
+    each stepping-stone ratio is the mean of `exp((theta[i + 1] - theta[i]) * delta)` over the
+    samples of power `theta[i]`, computed for all powers at once with a log-sum-exp.
+
+    Args:
+      theta (np.ndarray): The power of each sample.
+      delta (np.ndarray): The log likelihood of each sample.
+
+    Returns:
+      MarginalLikelihood: The estimates.
+
+    Examples:
+      >>> theta = np.repeat([0.0, 0.5, 1.0], 2)
+      >>> delta = np.array([-12.0, -10.0, -9.0, -7.0, -6.0, -4.0])
+      >>> marginal_likelihood(theta, delta)
+      MarginalLikelihood(path_sampling=-8.0, stepping_stone=-9.259770986083446, powers=3, samples=6)
+    """
+    theta = np.asarray(theta, dtype=np.float64)
+    delta = np.asarray(delta, dtype=np.float64)
+    powers, index = np.unique(theta, return_inverse=True)
+    if len(powers) < 2:
+        msg = "At least two powers are needed to estimate the marginal likelihood"
+        raise ValueError(msg)
+    counts = np.bincount(index, minlength=len(powers))
+    means = np.bincount(index, weights=delta, minlength=len(powers)) / counts
+    path_sampling = np.sum(np.diff(powers) * (means[1:] + means[:-1]) / 2)
+
+    # the samples of the highest power do not start a step
+    widths = np.append(np.diff(powers), 0.0)
+    steps = widths[index] * delta
+    maxima = np.full(len(powers), -np.inf)
+    np.maximum.at(maxima, index, steps)
+    sums = np.bincount(index, weights=np.exp(steps - maxima[index]), minlength=len(powers))
+    log_ratios = maxima + np.log(sums) - np.log(counts)
+    stepping_stone = np.sum(log_ratios[:-1])
+    return MarginalLikelihood(float(path_sampling), float(stepping_stone), len(powers), len(theta))
+
+
+def main(
+    logs: List[Path] = typer.Argument(..., help="MLE logs (.mle.log) of the chunks of a marginal likelihood run"),
+    output: Path = typer.Option(
+        ..., "--output", "-o", help="File to write the estimates to, in the format of the BEAST output"
+    ),
+):
+    """
+    Combines the MLE logs of the chunks of a marginal likelihood run into path sampling and
+    stepping-stone estimates of the log marginal likelihood.
+
+    Examples:
+      >>> logs = [Path('flc-stem_mle_1_chunk_1.mle.log'), Path('flc-stem_mle_1_chunk_2.mle.log')]
+      >>> main(logs, Path('flc-stem_mle_1.stdout'))
+    """
+    estimate = marginal_likelihood(*read_path_samples(logs))
+    lines = [
+        f"Combined {estimate.samples} samples of {estimate.powers} powers from {len(logs)} chunks",
+        f"log marginal likelihood (using path sampling) from {DELTA_COLUMN} = {estimate.path_sampling}",
+        f"log marginal likelihood (using stepping stone sampling) from {DELTA_COLUMN} = {estimate.stepping_stone}",
+    ]
+    output.write_text("\n".join(lines) + "\n")
+    typer.echo("\n".join(lines[1:]))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,180 @@
+import gzip
+import io
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional, TextIO
+
+import typer
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is only needed for .zst files
+    zstandard = None
+
+app = typer.Typer()
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+def detect_compression(path: Path) -> Optional[str]:
+    """
+    Detects whether a file is gzip or zstd compressed from its magic bytes.
+
+    Args:
+      path (Path): The file to inspect.
+
+    Returns:
+      Optional[str]: 'gzip', 'zstd' or None for uncompressed files.
+    """
+    with open(path, "rb") as handle:
+        magic = handle.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def is_compressed(path: Path) -> bool:
+    """Return whether a file is gzip or zstd compressed."""
+    return detect_compression(path) is not None
+
+
+class ForwardSeekReader(io.BufferedReader):
+    """A buffered reader over a non-seekable decompression stream that can seek forwards by reading ahead."""
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        position = self.tell()
+        target = position + offset if whence == io.SEEK_CUR else offset
+        if whence == io.SEEK_END or target < position:
+            msg = "Compressed streams can only seek forwards."
+            raise io.UnsupportedOperation(msg)
+        while position < target:
+            skipped = len(self.read(min(target - position, COPY_BUFFER_BYTES)))
+            if not skipped:
+                break
+            position += skipped
+        return position
+
+
+def _require_zstandard():
+    if zstandard is None:
+        msg = "Reading or writing .zst files requires the 'zstandard' package (pip install zstandard)."
+        raise ModuleNotFoundError(msg)
+    return zstandard
+
+
+def open_binary(path: Path) -> BinaryIO:
+    """
+    Opens a file for binary reading, decompressing gzip and zstd files as a stream.
+
+    The returned handle supports `readline`, iteration and forward `seek`, so readers can use it
+    in place of `open(path, "rb")`. Compressed data is never inflated in memory all at once.
+
+    Args:
+      path (Path): The file to open.
+
+    Returns:
+      BinaryIO: The (decompressed) binary stream.
+    """
+    compression = detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        reader = _require_zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        return ForwardSeekReader(reader, buffer_size=COPY_BUFFER_BYTES)
+    return open(path, "rb")
+
+
+def open_text(path: Path, encoding: str = "utf-8") -> TextIO:
+    """Opens a file for text reading, decompressing gzip and zstd files as a stream, see `open_binary`."""
+    return io.TextIOWrapper(open_binary(path), encoding=encoding)
+
+
+def strip_compression_suffix(path: Path) -> Path:
+    """
+    Removes a `.gz` or `.zst` suffix from a path.
+
+    Examples:
+      >>> strip_compression_suffix(Path('run.trees.gz'))
+      PosixPath('run.trees')
+    """
+    path = Path(path)
+    if path.suffix in SUFFIXES.values():
+        return path.with_suffix("")
+    return path
+
+
+def compress_file(source: Path, destination: Path, method: str = "gzip", level: Optional[int] = None) -> None:
+    """
+    Compresses a file as a stream.
+
+    Args:
+      source (Path): The uncompressed file.
+      destination (Path): The compressed file to write.
+      method (str): 'gzip' or 'zstd'.
+      level (int, optional): The compression level. Defaults to 6 for gzip and 3 for zstd.
+
+    Raises:
+      ValueError: If the method is not supported.
+    """
+    if method not in SUFFIXES:
+        msg = f"Unsupported compression '{method}'. Choose from {', '.join(SUFFIXES)}."
+        raise ValueError(msg)
+    with open(source, "rb") as src:
+        if method == "gzip":
+            with gzip.open(destination, "wb", compresslevel=6 if level is None else level) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_BYTES)
+        else:
+            compressor = _require_zstandard().ZstdCompressor(level=3 if level is None else level)
+            with open(destination, "wb") as dst:
+                compressor.copy_stream(src, dst, read_size=COPY_BUFFER_BYTES, write_size=COPY_BUFFER_BYTES)
+
+
+def decompress_file(source: Path, destination: Path) -> None:
+    """Decompresses a gzip or zstd file as a stream."""
+    with open_binary(source) as src, open(destination, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_BYTES)
+
+
+@app.command()
+def compress(
+    source: Path = typer.Argument(..., help="File to compress"),
+    destination: Path = typer.Argument(..., help="Compressed output file"),
+    method: str = typer.Option("gzip", help="Compression method: 'gzip' or 'zstd'"),
+    level: Optional[int] = typer.Option(None, help="Compression level"),
+    remove_source: bool = typer.Option(False, "--remove-source", help="Delete the source once it is compressed"),
+):
+    """
+    Compresses a BEAST output file.
+
+    Examples:
+      >>> compress(Path('run.trees'), Path('run.trees.gz'), method='gzip', level=None, remove_source=True)
+    """
+    compress_file(source, destination, method, level)
+    if remove_source:
+        source.unlink()
+
+
+@app.command()
+def decompress(
+    source: Path = typer.Argument(..., help="Compressed file"),
+    destination: Path = typer.Argument(..., help="Decompressed output file"),
+):
+    """
+    Decompresses a gzip or zstd file, e.g. for tools that cannot read compressed input.
+
+    Examples:
+      >>> decompress(Path('run.trees.gz'), Path('run.trees'))
+    """
+    decompress_file(source, destination)
+
+
+if __name__ == "__main__":
+    app()
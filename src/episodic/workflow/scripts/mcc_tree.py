@@ -0,0 +1,366 @@
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.beast_trees import (
+        TreeArrays,
+        TreeChunk,
+        chunk_count,
+        clade_bitsets,
+        load_tree_index,
+        map_chunks,
+        node_heights,
+        parse_translate,
+        quote,
+        read_translate,
+        split_tree_offsets,
+        translate_entries,
+        yield_chunk_arrays,
+    )
+    from episodic.workflow.scripts.tree_sample import (
+        is_tree_sample,
+        read_tree_sample,
+        read_tree_sample_taxa,
+        split_tree_sample,
+    )
+except ModuleNotFoundError:
+    from beast_trees import (
+        TreeArrays,
+        TreeChunk,
+        chunk_count,
+        clade_bitsets,
+        load_tree_index,
+        map_chunks,
+        node_heights,
+        parse_translate,
+        quote,
+        read_translate,
+        split_tree_offsets,
+        translate_entries,
+        yield_chunk_arrays,
+    )
+    from tree_sample import is_tree_sample, read_tree_sample, read_tree_sample_taxa, split_tree_sample
+
+HEIGHTS = ("mean", "median", "keep")
+HPD_LEVEL = 0.95
+
+
+class CladeSample(NamedTuple):
+    """
+    The clades and node values of a sample of trees, flattened over all nodes of all trees.
+
+    Attributes:
+      clades (List[int]): The distinct clade bitsets; `clade_ids` index into this list.
+      tree_sizes (np.ndarray): The number of nodes of each tree.
+      clade_ids (np.ndarray): The clade of every node.
+      values (Dict[str, np.ndarray]): Per-node `height`, `length` and numeric annotations, NaN where missing.
+      parent (np.ndarray): The parent of every node within its own tree, so the MCC topology can be rebuilt.
+      taxon (np.ndarray): The taxon index of every tip, -1 for internal nodes.
+    """
+
+    clades: List[int]
+    tree_sizes: np.ndarray
+    clade_ids: np.ndarray
+    values: Dict[str, np.ndarray]
+    parent: np.ndarray
+    taxon: np.ndarray
+
+    def tree_slice(self, tree_index: int) -> slice:
+        """Return the slice of the node arrays that holds a tree."""
+        start = int(self.tree_sizes[:tree_index].sum())
+        return slice(start, start + int(self.tree_sizes[tree_index]))
+
+
+def tree_values(tree: TreeArrays) -> Dict[str, np.ndarray]:
+    """Return the per-node values of a tree that are summarised on the MCC tree."""
+    return {"height": node_heights(tree), "length": tree.length, **tree.annotations}
+
+
+def collect_clades(trees: Iterable[TreeArrays]) -> CladeSample:
+    """
+    Collects the clades and node values of a sequence of trees.
+
+    Args:
+      trees (Iterable[TreeArrays]): The trees to collect.
+
+    Returns:
+      CladeSample: The clades, keyed by leaf bitset, and the values of every node.
+    """
+    clade_index: Dict[int, int] = {}
+    clade_ids = []
+    tree_sizes = []
+    parents = []
+    taxa = []
+    values: List[Dict[str, np.ndarray]] = []
+    for tree in trees:
+        clade_ids.append([clade_index.setdefault(mask, len(clade_index)) for mask in clade_bitsets(tree)])
+        tree_sizes.append(len(tree.parent))
+        parents.append(tree.parent.astype(np.int32))
+        taxa.append(tree.taxon.astype(np.int32))
+        values.append(tree_values(tree))
+    return CladeSample(
+        clades=list(clade_index),
+        tree_sizes=np.array(tree_sizes, dtype=np.intp),
+        clade_ids=np.concatenate(clade_ids).astype(np.intp),
+        values=_concatenate_values(values, tree_sizes),
+        parent=np.concatenate(parents),
+        taxon=np.concatenate(taxa),
+    )
+
+
+def _concatenate_values(values: List[Dict[str, np.ndarray]], sizes: List[int]) -> Dict[str, np.ndarray]:
+    keys = sorted({key for node_values in values for key in node_values})
+    return {
+        key: np.concatenate([node_values.get(key, np.full(size, np.nan)) for node_values, size in zip(values, sizes)])
+        for key in keys
+    }
+
+
+def merge_samples(samples: List[CladeSample]) -> CladeSample:
+    """Merge clade samples from consecutive chunks, in order, into one sample with a shared clade table."""
+    clade_index: Dict[int, int] = {}
+    clade_ids = []
+    for sample in samples:
+        remap = np.array([clade_index.setdefault(mask, len(clade_index)) for mask in sample.clades], dtype=np.intp)
+        clade_ids.append(remap[sample.clade_ids])
+    return CladeSample(
+        clades=list(clade_index),
+        tree_sizes=np.concatenate([sample.tree_sizes for sample in samples]),
+        clade_ids=np.concatenate(clade_ids),
+        values=_concatenate_values(
+            [sample.values for sample in samples], [len(sample.clade_ids) for sample in samples]
+        ),
+        parent=np.concatenate([sample.parent for sample in samples]),
+        taxon=np.concatenate([sample.taxon for sample in samples]),
+    )
+
+
+def choose_mcc_tree(sample: CladeSample) -> int:
+    """
+    Chooses the maximum clade credibility tree of a sample.
+
+    The credibility of a tree is the sum of the log frequencies of its clades. Tips occur in
+    every tree, so they add zero and need no special handling.
+
+    Returns:
+      int: The index of the first tree with the highest credibility.
+    """
+    n_trees = len(sample.tree_sizes)
+    log_frequency = np.log(np.bincount(sample.clade_ids, minlength=len(sample.clades)) / n_trees)
+    starts = np.concatenate([[0], np.cumsum(sample.tree_sizes)[:-1]])
+    credibility = np.add.reduceat(log_frequency[sample.clade_ids], starts)
+    return int(np.argmax(credibility))
+
+
+def hpd_interval(values: np.ndarray, level: float = HPD_LEVEL) -> np.ndarray:
+    """
+    Returns the shortest interval containing `level` of the values.
+
+    Examples:
+      >>> hpd_interval(np.array([1.0, 2.0, 3.0, 4.0, 100.0]), 0.8)
+      array([1., 4.])
+    """
+    sorted_values = np.sort(values)
+    n_values = len(sorted_values)
+    width = min(n_values, max(1, round(level * n_values)))
+    spans = sorted_values[width - 1 :] - sorted_values[: n_values - width + 1]
+    lower = int(np.argmin(spans))
+    return np.array([sorted_values[lower], sorted_values[lower + width - 1]])
+
+
+def summarize_clades(sample: CladeSample, tree_index: int) -> Dict[str, List]:
+    """
+    Summarises the node values of every clade of a tree over the whole sample.
+
+    Args:
+      sample (CladeSample): The tree sample.
+      tree_index (int): The tree whose clades are summarised, usually the MCC tree.
+
+    Returns:
+      Dict[str, List]: For every value `x`, the per-node `x` (mean), `x_median`, `x_95%_HPD` and
+        `x_range`, plus the clade `posterior`. Entries are None where a clade has no values.
+    """
+    tree_clades = sample.clade_ids[sample.tree_slice(tree_index)]
+
+    node_of_clade = np.full(len(sample.clades), -1, dtype=np.intp)
+    node_of_clade[tree_clades] = np.arange(len(tree_clades))
+    nodes = node_of_clade[sample.clade_ids]
+    in_tree = np.flatnonzero(nodes >= 0)
+    order = in_tree[np.argsort(nodes[in_tree], kind="stable")]
+    bounds = np.searchsorted(nodes[order], np.arange(len(tree_clades) + 1))
+
+    n_trees = len(sample.tree_sizes)
+    summary: Dict[str, List] = {"posterior": list(np.diff(bounds) / n_trees)}
+    for key, all_values in sample.values.items():
+        label = f"{key}_{int(HPD_LEVEL * 100)}%_HPD"
+        summary.update({key: [], f"{key}_median": [], label: [], f"{key}_range": []})
+        for node in range(len(tree_clades)):
+            values = all_values[order[bounds[node] : bounds[node + 1]]]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                for column in (key, f"{key}_median", label, f"{key}_range"):
+                    summary[column].append(None)
+                continue
+            summary[key].append(float(values.mean()))
+            summary[f"{key}_median"].append(float(np.median(values)))
+            summary[label].append(hpd_interval(values))
+            summary[f"{key}_range"].append(np.array([values.min(), values.max()]))
+    return summary
+
+
+def format_annotation(summary: Dict[str, List], node: int, *, tip: bool) -> str:
+    """Format the summary of a node as a BEAST `[&key=value,...]` comment."""
+    items = []
+    for key, node_values in summary.items():
+        value = node_values[node]
+        if value is None or (tip and key == "posterior"):
+            continue
+        if isinstance(value, np.ndarray):
+            items.append(f"{key}={{{float(value[0])!r},{float(value[1])!r}}}")
+        else:
+            items.append(f"{key}={float(value)!r}")
+    return f"[&{','.join(items)}]"
+
+
+def format_mcc_newick(parent: np.ndarray, taxon: np.ndarray, heights: np.ndarray, summary: Dict[str, List]) -> str:
+    """
+    Formats a post-order tree as a translated newick string with node heights and clade summaries.
+
+    Tips are written as their 1-based translate keys, as in BEAST trees files.
+    """
+    parents = parent.tolist()
+    children: List[List[int]] = [[] for _ in parents]
+    for node, parent_node in enumerate(parents[:-1]):
+        children[parent_node].append(node)
+
+    strings: List[Optional[str]] = [None] * len(parents)
+    for node, tip in enumerate(taxon.tolist()):
+        if tip >= 0:
+            text = str(tip + 1)
+        else:
+            text = "(" + ",".join(strings[child] for child in children[node]) + ")"
+            for child in children[node]:
+                strings[child] = None
+        text += format_annotation(summary, node, tip=tip >= 0)
+        if parents[node] >= 0:
+            text += f":{float(heights[parents[node]] - heights[node])!r}"
+        strings[node] = text
+    return f"{strings[-1]};"
+
+
+def write_nexus_tree(output: Path, taxa: List[str], newick: str, tree_name: str = "TREE1") -> None:
+    """Write a single tree with a taxa block and translate table, as written by treeannotator."""
+    lines = ["#NEXUS", "", "Begin taxa;", f"\tDimensions ntax={len(taxa)};", "\tTaxlabels"]
+    lines += [f"\t\t{quote(taxon)}" for taxon in taxa]
+    lines += ["\t\t;", "End;", "", "Begin trees;", "\tTranslate"]
+    lines += [f"\t\t{index} {quote(taxon)}," for index, taxon in enumerate(taxa, start=1)]
+    lines[-1] = lines[-1].rstrip(",")
+    lines += ["\t\t;", f"tree {tree_name} = [&R] {newick}", "End;", ""]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text("\n".join(lines))
+
+
+_worker_state = {}
+
+
+def _init_worker(trees_path, translate):
+    _worker_state.update(trees_path=trees_path, translate=translate)
+    if is_tree_sample(trees_path):
+        _worker_state["sample"] = read_tree_sample(trees_path)
+
+
+def collect_chunk(chunk: TreeChunk) -> CladeSample:
+    """Collect the clades of the trees in a chunk. Runs in a worker process initialised with `_init_worker`."""
+    if "sample" in _worker_state:
+        return collect_clades(_worker_state["sample"].yield_trees(range(chunk.start, chunk.end)))
+    return collect_clades(yield_chunk_arrays(_worker_state["trees_path"], _worker_state["translate"], chunk))
+
+
+def mcc_tree(
+    trees_path: Path = typer.Argument(..., help="Path to the BEAST trees file or binary tree sample (.npz)."),
+    heights: List[str] = typer.Option(
+        ["mean"], "--heights", help="Node heights: 'mean', 'median' or 'keep'. Repeat for several."
+    ),
+    outputs: List[Path] = typer.Option(
+        ..., "--output", help="Output NEXUS path for each --heights value, in the same order."
+    ),
+    burnin_trees: int = typer.Option(0, "--burnin-trees", min=0, help="Number of trees to discard as burn-in."),
+    burnin: Optional[float] = typer.Option(
+        None, "--burnin", min=0, max=1, help="Fraction of the trees to discard as burn-in, instead of --burnin-trees."
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="Number of worker processes used to count clades."),
+):
+    """
+    Builds maximum clade credibility trees from a BEAST trees file in a single pass.
+
+    Clades are counted by their leaf bitsets, the tree with the highest product of clade
+    frequencies is chosen and its nodes are annotated with the mean, median, 95% HPD and range
+    of every node value across the sample. One NEXUS file is written per heights mode, so several
+    modes cost one read of the trees file.
+
+    Args:
+      trees_path (Path): Path to the BEAST trees file, or a binary tree sample written by `tree_sample.py convert`.
+      heights (List[str]): Node heights: 'mean', 'median' or 'keep'. 'ca' heights need treeannotator.
+      outputs (List[Path]): Output NEXUS path for each heights value, in the same order.
+      burnin_trees (int): Number of trees to discard as burn-in.
+      burnin (float): Fraction of the trees to discard as burn-in, instead of `burnin_trees`. For
+        runs of unknown length, e.g. adaptive runs that stop once converged.
+      jobs (int): Number of worker processes used to count clades.
+
+    Returns:
+      None
+
+    Examples:
+      >>> outputs = [Path('run.mcc.mean.nexus'), Path('run.mcc.median.nexus')]
+      >>> mcc_tree(Path('run.trees'), ['mean', 'median'], outputs, 1000)
+    """
+    if len(heights) != len(outputs):
+        msg = "Provide one --output for every --heights value."
+        raise typer.BadParameter(msg)
+    unknown = [mode for mode in heights if mode not in HEIGHTS]
+    if unknown:
+        msg = f"Unsupported heights {', '.join(unknown)}. Choose from {', '.join(HEIGHTS)}."
+        raise typer.BadParameter(msg)
+
+    if is_tree_sample(trees_path):
+        taxa, n_trees = read_tree_sample_taxa(trees_path)
+        translate = None
+        if burnin is not None:
+            burnin_trees = int(n_trees * burnin)
+        chunks = split_tree_sample(n_trees, jobs, first_tree=burnin_trees)
+    else:
+        index = load_tree_index(trees_path)
+        if burnin is not None:
+            burnin_trees = int(len(index) * burnin)
+        offsets = index.offsets[burnin_trees:]
+        header = read_translate(trees_path, index)
+        taxa = [label for _, label in translate_entries(header)]
+        translate = parse_translate(header)
+        n_chunks = chunk_count(index.trees_end - int(offsets[0]), jobs) if len(offsets) else 0
+        chunks = split_tree_offsets(offsets, index.trees_end, n_chunks, first_tree=burnin_trees)
+    if not chunks:
+        msg = f"No trees left in '{trees_path}' after discarding {burnin_trees} burn-in trees."
+        raise ValueError(msg)
+
+    with Pool(jobs, initializer=_init_worker, initargs=(trees_path, translate)) as pool:
+        sample = merge_samples(list(map_chunks(pool, collect_chunk, trees_path, chunks, jobs)))
+
+    tree_index = choose_mcc_tree(sample)
+    summary = summarize_clades(sample, tree_index)
+    nodes = sample.tree_slice(tree_index)
+    for mode, output in zip(heights, outputs):
+        if mode == "keep":
+            node_height = sample.values["height"][nodes]
+        else:
+            node_height = np.array(summary["height" if mode == "mean" else "height_median"])
+        newick = format_mcc_newick(sample.parent[nodes], sample.taxon[nodes], node_height, summary)
+        write_nexus_tree(output, taxa, newick)
+        typer.echo(f"Wrote {mode} heights MCC tree to {output}")
+
+
+if __name__ == "__main__":
+    typer.run(mcc_tree)
@@ -1,129 +1,399 @@
 import csv
-from bisect import bisect_left
+from dataclasses import dataclass
 from datetime import datetime
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
-import dendropy
 import matplotlib.pyplot as plt
 import numpy as np
 import typer
 
 try:
-  from episodic.workflow.scripts.write_taxon_groups import read_group_members
+  from episodic.workflow.scripts.beast_trees import (
+    TreeArrays,
+    TreeChunk,
+    chunk_count,
+    load_tree_index,
+    map_chunks,
+    read_header,
+    split_tree_offsets,
+    yield_chunk_trees,
+  )
+  from episodic.workflow.scripts.tree_sample import (
+    is_tree_sample,
+    read_tree_sample,
+    read_tree_sample_taxa,
+    split_tree_sample,
+  )
+  from episodic.workflow.scripts.write_taxon_groups import load_taxon_registry
 except ModuleNotFoundError:
-  from write_taxon_groups import read_group_members
+  from beast_trees import (
+    TreeArrays,
+    TreeChunk,
+    chunk_count,
+    load_tree_index,
+    map_chunks,
+    read_header,
+    split_tree_offsets,
+    yield_chunk_trees,
+  )
+  from tree_sample import is_tree_sample, read_tree_sample, read_tree_sample_taxa, split_tree_sample
+  from write_taxon_groups import load_taxon_registry
 
 app = typer.Typer()
 
-def extract_and_sort_rates(tree):
+
+@dataclass
+class GroupIndex:
+    """
+    Bitset index of group membership, built once and reused for every tree.
+
+    Attributes:
+      groups (List[str]): The group labels, in output order.
+      taxon_bits (Dict[str, int]): A single-bit mask for every taxon that belongs to a group.
+      group_masks (List[int]): The union of the member bits of each group.
+      taxon_groups (Dict[str, List[int]]): The indices of the groups each taxon belongs to.
     """
-    Extracts and sorts rates from a given tree.
+
+    groups: List[str]
+    taxon_bits: Dict[str, int]
+    group_masks: List[int]
+    taxon_groups: Dict[str, List[int]]
+
+
+def build_group_index(group_members: Dict[str, List[str]]) -> GroupIndex:
+    """
+    Builds a bitset index from the taxa assigned to each group.
 
     Args:
-      tree (dendropy.Tree): The tree to extract rates from.
+      group_members (Dict[str, List[str]]): Taxa assigned to each analyzed group.
 
     Returns:
-      List[float]: A list of sorted rates.
+      GroupIndex: The group index.
 
     Examples:
-      >>> extract_and_sort_rates(tree)
-      [0.1, 0.2, 0.3]
+      >>> build_group_index({'A': ['a1', 'a2'], 'B': ['b1']}).group_masks
+      [3, 4]
     """
-    rates = [
-        float(node.annotations.get_value("rate"))
-        for node in tree
-        if node.annotations.get_value("rate")
-    ]
-    sorted_rates = sorted(rates)
-    return sorted_rates
+    taxon_bits: Dict[str, int] = {}
+    taxon_groups: Dict[str, List[int]] = {}
+    group_masks = []
+    for group_idx, taxa in enumerate(group_members.values()):
+        mask = 0
+        for taxon in taxa:
+            bit = taxon_bits.setdefault(taxon, 1 << len(taxon_bits))
+            mask |= bit
+            taxon_groups.setdefault(taxon, []).append(group_idx)
+        group_masks.append(mask)
+    return GroupIndex(
+        groups=list(group_members),
+        taxon_bits=taxon_bits,
+        group_masks=group_masks,
+        taxon_groups=taxon_groups,
+    )
+
 
-def analyze_tree(tree, group_members, group_stats):
+def find_group_mrcas(tree, group_index: GroupIndex):
     """
-    Analyzes a given tree and updates group statistics.
+    Finds the MRCA of every group in a single post-order pass over a tree.
+
+    Each node carries the bitset of group taxa below it and the groups that are only partially
+    below it. A group is resolved at the first node whose bitset covers all of its taxa present
+    in the tree, so the work per tree does not grow with the number of groups.
 
     Args:
-      tree (dendropy.Tree): The tree to analyze.
-      group_members (Dict[str, List[str]]): Taxa assigned to each analyzed group.
-      group_stats (Dict[str, Dict[str, List]]): A dictionary containing group statistics.
+      tree (dendropy.Tree): The tree to search.
+      group_index (GroupIndex): The group index, see `build_group_index`.
 
     Returns:
-      None
+      List[dendropy.Node]: The MRCA node of each group, in `group_index.groups` order.
+
+    Raises:
+      ValueError: If a group has no taxa present in the tree.
+    """
+    leaves = tree.leaf_nodes()
+    present = 0
+    for leaf in leaves:
+        present |= group_index.taxon_bits.get(leaf.taxon.label, 0)
+    group_masks = [mask & present for mask in group_index.group_masks]
+    for group, mask in zip(group_index.groups, group_masks):
+        if not mask:
+            msg = f"Group '{group}' has no taxa present in the tree."
+            raise ValueError(msg)
+
+    mrcas = [None] * len(group_masks)
+    node_masks = {}
+    node_open_groups = {}
+    for node in tree.postorder_node_iter():
+        if node.is_leaf():
+            label = node.taxon.label
+            mask = group_index.taxon_bits.get(label, 0)
+            open_groups = set(group_index.taxon_groups.get(label, ()))
+        else:
+            mask = 0
+            open_groups = set()
+            for child in node.child_node_iter():
+                mask |= node_masks.pop(id(child))
+                open_groups |= node_open_groups.pop(id(child))
+        resolved = {g for g in open_groups if mask & group_masks[g] == group_masks[g]}
+        for group_idx in resolved:
+            mrcas[group_idx] = node
+        node_masks[id(node)] = mask
+        node_open_groups[id(node)] = open_groups - resolved
+    return mrcas
+
+
+def extract_rates(tree, group_index):
+    """
+    Extracts the node rates of a tree and the position of each group's stem rate among them.
+
+    Args:
+      tree (dendropy.Tree): The tree to extract rates from.
+      group_index (GroupIndex): Bitset index of the taxa assigned to each analyzed group.
+
+    Returns:
+      Tuple[List[float], List[int]]: The rates of all nodes with a `rate` annotation, in preorder,
+        and the index into those rates of each group's MRCA.
+
+    Raises:
+      ValueError: If the MRCA of a group has no rate annotation.
 
     Examples:
-      >>> analyze_tree(tree, ['A', 'B'], {'A': {'ranks': [], 'quantiles': []}, 'B': {'ranks': [], 'quantiles': []}})
-    """
-    # Assuming sorted_rates is generated here for each tree passed to this function
-    sorted_rates = extract_and_sort_rates(tree)
-    tree_taxa = {node.taxon.label for node in tree if node.taxon is not None}
-    for group, taxa in group_members.items():
-        taxon_labels = [taxon for taxon in taxa if taxon in tree_taxa]
-        if not taxon_labels:
+      >>> extract_rates(tree, build_group_index({'A': ['a1', 'a2']}))
+      ([0.1, 0.3, 0.2], [1])
+    """
+    rates = []
+    rate_columns = {}
+    for node in tree:
+        rate = node.annotations.get_value("rate")
+        if rate:
+            rate_columns[id(node)] = len(rates)
+            rates.append(float(rate))
+
+    stem_indices = []
+    for group, mrca in zip(group_index.groups, find_group_mrcas(tree, group_index)):
+        if id(mrca) not in rate_columns:
+            msg = f"The MRCA of group '{group}' has no rate annotation."
+            raise ValueError(msg)
+        stem_indices.append(rate_columns[id(mrca)])
+    return rates, stem_indices
+
+
+def extract_array_rates(
+    tree: TreeArrays, taxon_bits: List[int], taxon_groups: List[List[int]], group_index: GroupIndex
+):
+    """
+    Extracts the node rates of a tree stored as arrays and the position of each group's stem rate among them.
+
+    The array counterpart of `extract_rates`: the nodes are already in post-order, so group
+    bitsets and MRCAs are resolved in one pass over the arrays.
+
+    Args:
+      tree (TreeArrays): The tree to extract rates from.
+      taxon_bits (List[int]): The group bit of each taxon index, 0 for taxa in no group.
+      taxon_groups (List[List[int]]): The groups of each taxon index.
+      group_index (GroupIndex): Bitset index of the taxa assigned to each analyzed group.
+
+    Returns:
+      Tuple[np.ndarray, List[int]]: The rates of all nodes with a `rate` annotation, in post-order,
+        and the index into those rates of each group's MRCA.
+
+    Raises:
+      ValueError: If a group has no taxa present in the tree or its MRCA has no rate annotation.
+    """
+    taxa = tree.taxon.tolist()
+    parents = tree.parent.tolist()
+    masks = [taxon_bits[taxon] if taxon >= 0 else 0 for taxon in taxa]
+    open_groups = [set(taxon_groups[taxon]) if taxon >= 0 else set() for taxon in taxa]
+    present = 0
+    for mask in masks:
+        present |= mask
+    group_masks = [mask & present for mask in group_index.group_masks]
+    for group, mask in zip(group_index.groups, group_masks):
+        if not mask:
             msg = f"Group '{group}' has no taxa present in the tree."
             raise ValueError(msg)
 
-        mrca = tree.mrca(taxon_labels=taxon_labels)
-        group_rate = float(mrca.annotations.get_value("rate"))
+    mrcas = [-1] * len(group_masks)
+    for node, parent in enumerate(parents):
+        resolved = {g for g in open_groups[node] if masks[node] & group_masks[g] == group_masks[g]}
+        for group_idx in resolved:
+            mrcas[group_idx] = node
+        if parent >= 0:
+            masks[parent] |= masks[node]
+            open_groups[parent] |= open_groups[node] - resolved
+
+    rate = tree.annotations.get("rate", np.full(len(parents), np.nan))
+    has_rate = ~np.isnan(rate)
+    rate_columns = np.cumsum(has_rate) - 1
+    stem_indices = []
+    for group, mrca in zip(group_index.groups, mrcas):
+        if not has_rate[mrca]:
+            msg = f"The MRCA of group '{group}' has no rate annotation."
+            raise ValueError(msg)
+        stem_indices.append(int(rate_columns[mrca]))
+    return rate[has_rate], stem_indices
+
+
+def rank_group_rates(rates: np.ndarray, stem_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ranks each group's stem rate among the node rates of its tree, for many trees at once.
+
+    The rank of a rate is one plus the number of strictly smaller rates in the same tree (the
+    `bisect_left` position in the sorted rates), and the quantile is the rank divided by the
+    number of rates.
+
+    Args:
+      rates (np.ndarray): A (trees x nodes) array of node rates.
+      stem_indices (np.ndarray): A (trees x groups) array of column indices into `rates`.
+
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: The (trees x groups) ranks and quantiles.
+
+    Examples:
+      >>> rank_group_rates(np.array([[0.3, 0.1, 0.3, 0.2]]), np.array([[0, 1]]))
+      (array([[3, 1]]), array([[0.75, 0.25]]))
+    """
+    n_trees, n_nodes = rates.shape
+    order = np.argsort(rates, axis=1, kind="stable")
+    sorted_rates = np.take_along_axis(rates, order, axis=1)
+
+    # Position of every node in its sorted row
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.broadcast_to(np.arange(n_nodes), (n_trees, n_nodes)), axis=1)
+
+    # Ties share the position of their first occurrence, as with bisect_left
+    columns = np.arange(n_nodes)
+    is_first = np.ones_like(sorted_rates, dtype=bool)
+    is_first[:, 1:] = sorted_rates[:, 1:] != sorted_rates[:, :-1]
+    first_positions = np.maximum.accumulate(np.where(is_first, columns, 0), axis=1)
 
-        # Use bisect_left for efficient rank finding in a sorted list
-        rank = bisect_left(sorted_rates, group_rate) + 1
-        group_stats[group]["ranks"].append(rank)
+    stem_positions = np.take_along_axis(positions, stem_indices, axis=1)
+    ranks = np.take_along_axis(first_positions, stem_positions, axis=1) + 1
+    return ranks, ranks / n_nodes
 
-        quantile = rank / len(sorted_rates)
-        group_stats[group]["quantiles"].append(quantile)
+
+_worker_state = {}
+
+
+def _init_worker(trees_path, header, group_index):
+    _worker_state.update(trees_path=trees_path, header=header, group_index=group_index)
+    if is_tree_sample(trees_path):
+        sample = read_tree_sample(trees_path)
+        _worker_state["sample"] = sample
+        _worker_state["taxon_bits"] = [group_index.taxon_bits.get(label, 0) for label in sample.taxa]
+        _worker_state["taxon_groups"] = [group_index.taxon_groups.get(label, []) for label in sample.taxa]
+
+
+def analyze_chunk(chunk: TreeChunk) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Analyzes every tree in a chunk of the trees file.
+
+    Runs in a worker process initialised with `_init_worker`. The node rates of the chunk are
+    collected into a (trees x nodes) array and ranked in one vectorized step.
+
+    Args:
+      chunk (TreeChunk): The byte range of trees to analyze.
+
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: The (trees x groups) ranks and quantiles of the trees in the chunk.
+    """
+    group_index = _worker_state["group_index"]
+    rates = []
+    stem_indices = []
+    if "sample" in _worker_state:
+        for tree in _worker_state["sample"].yield_trees(range(chunk.start, chunk.end)):
+            tree_rates, tree_stem_indices = extract_array_rates(
+                tree, _worker_state["taxon_bits"], _worker_state["taxon_groups"], group_index
+            )
+            rates.append(tree_rates)
+            stem_indices.append(tree_stem_indices)
+        return rank_group_rates(np.array(rates, dtype=float), np.array(stem_indices, dtype=np.intp))
+    for tree in yield_chunk_trees(_worker_state["trees_path"], _worker_state["header"], chunk):
+        tree_rates, tree_stem_indices = extract_rates(tree, group_index)
+        rates.append(tree_rates)
+        stem_indices.append(tree_stem_indices)
+    return rank_group_rates(np.array(rates, dtype=float), np.array(stem_indices, dtype=np.intp))
 
 
 @app.command()
 def analyze_rates(
-    trees_path: str = typer.Argument(..., help="Path to the BEAST output trees file"),
-    groups_file: Path = typer.Option(..., "--groups-file", help="TSV mapping taxa to group labels"),
+    trees_path: str = typer.Argument(..., help="Path to the BEAST output trees file or binary tree sample (.npz)"),
+    groups_file: Path = typer.Option(
+        ..., "--groups-file", help="Taxon registry (.npz) or TSV mapping taxa to group labels"
+    ),
     output_plot_path: str = typer.Option(..., "--output-plot", help="Output path for the plot file"),
     output_csv_path: str = typer.Option(..., "--output-csv", help="Output path for the CSV file"),
     burnin: float = typer.Option(0.1, "--burnin", "-b", help="Fraction of trees to discard as burn-in"),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="Number of worker processes used to analyze trees"),
 ):
     """
     Analyzes rates from a given BEAST output trees file and generates a plot and CSV file.
 
     Args:
-      trees_path (str): The path to the BEAST output trees file.
-      groups_file (Path): TSV mapping taxa to group labels.
+      trees_path (str): The path to the BEAST output trees file, or a binary tree sample written by
+        `tree_sample.py convert`.
+      groups_file (Path): Taxon registry written by `write_taxon_groups.py --registry`, or a TSV mapping
+        taxa to group labels.
       output_plot_path (str): The output path for the plot file.
       output_csv_path (str): The output path for the CSV file.
       burnin (float): The fraction of trees to discard as burn-in.
+      jobs (int): The number of worker processes. Trees are split into chunks at `tree STATE_` lines
+        and the per-chunk results are merged in tree order, so the output does not depend on `jobs`.
 
     Returns:
       None
 
     Examples:
-      >>> analyze_rates('trees.nexus', Path('groups.tsv'), 'plot.png', 'stats.csv', 0.1)
+      >>> analyze_rates('trees.nexus', Path('groups.tsv'), 'plot.png', 'stats.csv', 0.1, jobs=4)
     """
-    group_members = read_group_members(groups_file)
-    groups = list(group_members)
+    registry = load_taxon_registry(groups_file)
+    group_members = registry.group_members()
+    groups = registry.groups
 
     # time ow long it takes to run
     now = datetime.now()
-    tree_yielder = dendropy.Tree.yield_from_files(files=[trees_path], schema="nexus", preserve_underscores=True)
-    total_trees = sum(1 for _ in tree_yielder)  # Count total trees
-    burnin_count = int(total_trees * burnin)
+    if is_tree_sample(trees_path):
+        _, total_trees = read_tree_sample_taxa(Path(trees_path))
+        burnin_count = int(total_trees * burnin)
+        chunks = split_tree_sample(total_trees, jobs, first_tree=burnin_count)
+        header = None
+    else:
+        index = load_tree_index(Path(trees_path))
+        total_trees = len(index)
+        burnin_count = int(total_trees * burnin)
+        offsets = index.offsets[burnin_count:]
+        n_chunks = chunk_count(index.trees_end - int(offsets[0]), jobs) if len(offsets) else 0
+        chunks = split_tree_offsets(offsets, index.trees_end, n_chunks, first_tree=burnin_count)
+        header = read_header(Path(trees_path), index.header_length)
     total_time = datetime.now() - now
     print(f"Total time to count trees: {total_time}")
+    if not chunks:
+        msg = f"No trees left in '{trees_path}' after discarding {burnin_count} burn-in trees."
+        raise ValueError(msg)
 
-    tree_yielder = dendropy.Tree.yield_from_files(  # Reinitialize generator
-        files=[trees_path], schema="nexus", preserve_underscores=True
-    )
-    group_stats: Dict[str, Dict[str, List]] = {g: {"ranks": [], "quantiles": []} for g in groups}
+    chunk_ranks = []
+    chunk_quantiles = []
 
-    with typer.progressbar(
-            tree_yielder,
-            length=total_trees,
+    initargs = (Path(trees_path), header, build_group_index(group_members))
+    with Pool(jobs, initializer=_init_worker, initargs=initargs) as pool, typer.progressbar(
+            map_chunks(pool, analyze_chunk, Path(trees_path), chunks, jobs),
+            length=len(chunks),
             label="Processing trees",
             show_pos=True,
             show_percent=True
         ) as progress:
-        for tree_idx, tree in enumerate(progress):
-            if tree_idx < burnin_count:
-                continue
-            analyze_tree(tree, group_members, group_stats)
+        for ranks, quantiles in progress:
+            chunk_ranks.append(ranks)
+            chunk_quantiles.append(quantiles)
+
+    all_ranks = np.concatenate(chunk_ranks)
+    all_quantiles = np.concatenate(chunk_quantiles)
+    mean_ranks = all_ranks.mean(axis=0)
+    rank_credible_intervals = np.percentile(all_ranks, [2.5, 97.5], axis=0).T
+    mean_quantiles = all_quantiles.mean(axis=0)
+    quantile_credible_intervals = np.percentile(all_quantiles, [2.5, 97.5], axis=0).T
 
     csv_data = [
         [
@@ -138,17 +408,12 @@ def analyze_rates(
     plt.figure(figsize=(15, 5 * len(groups)))
 
     for i, group in enumerate(groups, start=1):
-        ranks = group_stats[group]["ranks"]
-        quantiles = group_stats[group]["quantiles"]
-
-        mean_rank = np.mean(ranks)
-        rank_credible_interval = (np.percentile(ranks, 2.5), np.percentile(ranks, 97.5))
-
-        mean_quantile = np.mean(quantiles)
-        quantile_credible_interval = (
-            np.percentile(quantiles, 2.5),
-            np.percentile(quantiles, 97.5),
-        )
+        ranks = all_ranks[:, i - 1]
+        quantiles = all_quantiles[:, i - 1]
+        mean_rank = mean_ranks[i - 1]
+        rank_credible_interval = rank_credible_intervals[i - 1]
+        mean_quantile = mean_quantiles[i - 1]
+        quantile_credible_interval = quantile_credible_intervals[i - 1]
 
         csv_data.append(
             [
@@ -19,6 +19,11 @@ import pandas as pd
 import seaborn as sns
 import typer
 
+try:
+    from episodic.workflow.scripts.compression import open_text
+except ModuleNotFoundError:
+    from compression import open_text
+
 app = typer.Typer()
 
 SUBSTITUTION_ORDER = ["AC", "AG", "AT", "CG", "CT", "GT"]
@@ -26,7 +31,8 @@ TRANSVERSIONS = {"AC", "AT", "CG", "GT"}
 
 
 def _read_log(path: Path, burnin: float) -> pd.DataFrame:
-    raw = pd.read_csv(path, sep="\t", comment="#")
+    with open_text(path) as handle:
+        raw = pd.read_csv(handle, sep="\t", comment="#")
     return raw.iloc[int(len(raw) * burnin) :].reset_index(drop=True)
 
 
@@ -32,6 +32,11 @@ import pandas as pd
 import seaborn as sns
 import typer
 
+try:
+    from episodic.workflow.scripts.compression import open_text, strip_compression_suffix
+except ModuleNotFoundError:
+    from compression import open_text, strip_compression_suffix
+
 app = typer.Typer()
 
 BACKGROUND_PATTERNS = [
@@ -108,8 +113,9 @@ def _display_state(state: str, foreground_label: Optional[str], background_label
 
 
 def _read_table(path: Path) -> pd.DataFrame:
-    sep = "\t" if path.suffix in {".log", ".tsv", ".txt"} else ","
-    return pd.read_csv(path, sep=sep, comment="#")
+    sep = "\t" if strip_compression_suffix(path).suffix in {".log", ".tsv", ".txt"} else ","
+    with open_text(path) as handle:
+        return pd.read_csv(handle, sep=sep, comment="#")
 
 
 def _drop_burnin(df: pd.DataFrame, burnin: float) -> pd.DataFrame:
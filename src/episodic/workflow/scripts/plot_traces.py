@@ -12,6 +12,11 @@ import pandas as pd
 import typer
 from matplotlib.ticker import MaxNLocator, ScalarFormatter
 
+try:
+    from episodic.workflow.scripts.compression import open_text
+except ModuleNotFoundError:
+    from compression import open_text
+
 
 DEFAULT_MAX_POINTS = 10000
 DEFAULT_DPI = 300
@@ -275,7 +280,8 @@ def plot_traces(
     debug_log(debug, f"Output format: {output_format}")
 
     read_start = time.perf_counter()
-    df = pd.read_csv(trace_log, sep="\t", comment="#")
+    with open_text(trace_log) as handle:
+        df = pd.read_csv(handle, sep="\t", comment="#")
     debug_log(debug, f"Loaded trace log with shape {df.shape} in {time.perf_counter() - read_start:.2f}s")
 
     if "state" not in df.columns:
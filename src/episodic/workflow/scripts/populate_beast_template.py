@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import os
 import re
+import shutil
+import tempfile
 from dataclasses import dataclass
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
-from jinja2 import StrictUndefined, Template
+import numpy as np
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader, StrictUndefined, Template
 
-from episodic.workflow.scripts.write_taxon_groups import build_group_members, read_group_members
-from episodic.workflow.utils import date_to_decimal_year
+from episodic.workflow.scripts.compression import open_binary
+from episodic.workflow.scripts.resource_model import alignment_statistics, write_alignment_statistics
+from episodic.workflow.scripts.write_taxon_groups import build_group_members, build_taxon_registry, load_taxon_registry
+from episodic.workflow.utils import dates_to_decimal_years
 
 
 @dataclass
@@ -18,32 +26,153 @@ class Taxon:
 
     Attributes:
       id (str): The id of the taxon.
-      sequence (str): The sequence of the taxon.
+      sequence (str): The sequence of the taxon, or an `EncodedSequence` read from an alignment sidecar.
       date (float): The date of the taxon.
       uncertainty (float): The uncertainty of the taxon's date.
     """
     id: str
-    sequence: str
+    sequence: Union[str, "EncodedSequence"]
     date: float
     uncertainty: float = 0.0
 
 
-@dataclass
+class EncodedSequence:
+    """
+    A sequence kept in its parsed bytes, e.g. a row of an alignment sidecar, and only decoded when rendered.
+
+    Templates render it like a string, so each sequence exists as a Python string only while it
+    is being written out.
+
+    Examples:
+      >>> str(EncodedSequence(b"ACGT"))
+      'ACGT'
+      >>> EncodedSequence(b"ACGT") == "ACGT"
+      True
+    """
+
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __str__(self) -> str:
+        return bytes(self.buffer).decode("ascii")
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def __eq__(self, other) -> bool:
+        return str(self) == str(other)
+
+    def __repr__(self) -> str:
+        return f"EncodedSequence({len(self)} characters)"
+
+
+@dataclass(eq=False)
+class TaxonTable:
+    """
+    The taxa shared by all alignment partitions, stored as arrays.
+
+    Attributes:
+      ids (List[str]): The taxon ids (fasta headers).
+      dates (np.ndarray): The decimal sampling date of each taxon.
+      uncertainties (np.ndarray): The sampling date uncertainty of each taxon.
+    """
+
+    ids: List[str]
+    dates: np.ndarray
+    uncertainties: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TaxonTable):
+            return NotImplemented
+        return (
+            self.ids == other.ids
+            and np.array_equal(self.dates, other.dates)
+            and np.array_equal(self.uncertainties, other.uncertainties)
+        )
+
+
+@dataclass(eq=False)
 class Partition:
     """
     Dataclass representing an alignment partition.
 
+    The sequences are kept as one (taxa x sites) uint8 matrix in the order of the partition's
+    alignment, and `rows` maps the shared taxon table onto it, so the partitions of an analysis
+    share a single copy of the taxon ids and dates.
+
     Attributes:
       prefix (str): XML-safe prefix used for non-rate IDs.
       background_prefix (str): XML-safe prefix used for background-rate IDs.
       foreground_prefix (str): XML-safe prefix used for foreground/local-rate IDs.
-      taxa (List[Taxon]): Partition sequences keyed by shared taxon IDs.
+      table (TaxonTable): The taxa shared by all partitions.
+      sequences (np.ndarray): The (taxa x sites) uint8 sequences of the partition.
+      rows (np.ndarray): The row of `sequences` holding each taxon of `table`.
+      constant_patterns (List[int], optional): Counts of constant A, C, G and T sites left out of
+        the sequences, see `alignment_sidecar.compress_site_patterns`.
     """
 
     prefix: str
     background_prefix: str
     foreground_prefix: str
-    taxa: List[Taxon]
+    table: TaxonTable
+    sequences: np.ndarray
+    rows: np.ndarray
+    constant_patterns: Optional[List[int]] = None
+
+    @property
+    def taxa(self) -> "PartitionTaxa":
+        """The taxa of the partition in taxon table order, e.g. for iterating in templates."""
+        return PartitionTaxa(self)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Partition):
+            return NotImplemented
+        return (
+            (self.prefix, self.background_prefix, self.foreground_prefix, self.constant_patterns)
+            == (other.prefix, other.background_prefix, other.foreground_prefix, other.constant_patterns)
+            and self.table == other.table
+            and np.array_equal(self.sequences[self.rows], other.sequences[other.rows])
+        )
+
+
+class PartitionTaxa:
+    """
+    A read-only sequence of the taxa of a partition.
+
+    `Taxon` objects are only created as the taxa are iterated over, with the sequences as
+    `EncodedSequence` views into the partition's sequence matrix.
+    """
+
+    __slots__ = ("partition",)
+
+    def __init__(self, partition: Partition):
+        self.partition = partition
+
+    def __len__(self) -> int:
+        return len(self.partition.table)
+
+    def __getitem__(self, index: int) -> Taxon:
+        table = self.partition.table
+        index = range(len(table))[index]
+        return Taxon(
+            id=table.ids[index],
+            sequence=EncodedSequence(self.partition.sequences[self.partition.rows[index]]),
+            date=float(table.dates[index]),
+            uncertainty=float(table.uncertainties[index]),
+        )
+
+    def __iter__(self) -> Iterator[Taxon]:
+        table = self.partition.table
+        sequences = self.partition.sequences
+        for taxon_id, row, date, uncertainty in zip(
+            table.ids, self.partition.rows.tolist(), table.dates.tolist(), table.uncertainties.tolist()
+        ):
+            yield Taxon(id=taxon_id, sequence=EncodedSequence(sequences[row]), date=date, uncertainty=uncertainty)
 
 
 @dataclass
@@ -122,76 +251,339 @@ def labeled_rate_prefix(
     return safe_label
 
 
+def match_partition_taxa(reference: TaxonTable, table: TaxonTable, alignment_path: Path) -> np.ndarray:
+    """
+    Matches the taxa of a partition to the taxa of the first partition.
+
+    The taxon sets and the sampling dates are compared as whole arrays rather than taxon by taxon.
+
+    Returns:
+      np.ndarray: The index in `table` of each reference taxon, in reference order.
+
+    Raises:
+      ValueError: If the partition has different taxa or sampling dates.
+    """
+    reference_ids = np.array(reference.ids, dtype=object)
+    ids = np.array(table.ids, dtype=object)
+    reference_order = np.argsort(reference_ids, kind="stable")
+    order = np.argsort(ids, kind="stable")
+    if len(ids) != len(reference_ids) or not np.array_equal(ids[order], reference_ids[reference_order]):
+        msg = (
+            "All alignment partitions must contain the same set of taxon headers. "
+            f"Partition '{alignment_path}' does not match the first alignment."
+        )
+        raise ValueError(
+            msg
+        )
+
+    rows = np.empty(len(order), dtype=np.intp)
+    rows[reference_order] = order
+    mismatched = (table.dates[rows] != reference.dates) | (table.uncertainties[rows] != reference.uncertainties)
+    if mismatched.any():
+        msg = (
+            "All alignment partitions must encode identical sampling dates for each taxon. "
+            f"Mismatch found for taxon '{reference.ids[int(np.argmax(mismatched))]}' in '{alignment_path}'."
+        )
+        raise ValueError(msg)
+    return rows
+
+
+def build_partition(
+    prefix: str,
+    table: TaxonTable,
+    sequences: np.ndarray,
+    rows: np.ndarray,
+    multiple_partitions: bool,
+    foreground_label: Optional[str] = None,
+    background_label: Optional[str] = None,
+    compress_patterns: bool = False,
+) -> Partition:
+    """
+    Build a partition with its labeled rate prefixes.
+
+    With `compress_patterns`, constant A, C, G and T sites are left out of the sequences and
+    emitted as `constantPatterns` counts instead, see `alignment_sidecar.compress_site_patterns`.
+    """
+    constant_patterns = None
+    if compress_patterns:
+        from episodic.workflow.scripts.alignment_sidecar import compress_site_patterns
+
+        sequences, constant_patterns = compress_site_patterns(sequences)
+    return Partition(
+        prefix=prefix,
+        background_prefix=labeled_rate_prefix(
+            background_label,
+            prefix,
+            multiple_partitions,
+            default_label="background",
+        ),
+        foreground_prefix=labeled_rate_prefix(foreground_label, prefix, multiple_partitions),
+        table=table,
+        sequences=sequences,
+        rows=rows,
+        constant_patterns=constant_patterns,
+    )
+
+
 def build_partitions(
     alignment_paths: List[Path],
     date_delimiter: str,
     date_index: int,
     foreground_label: Optional[str] = None,
     background_label: Optional[str] = None,
+    compress_patterns: bool = False,
 ) -> List[Partition]:
-    """Parse and validate multiple FASTA alignments into BEAST partitions."""
+    """
+    Parse and validate multiple FASTA alignments into BEAST partitions.
+
+    All partitions share the taxon table of the first alignment, see `build_partition` for
+    `compress_patterns`.
+    """
     if not alignment_paths:
         msg = "At least one alignment partition must be provided."
         raise ValueError(msg)
 
     used_prefixes = set()
     partitions: List[Partition] = []
-    reference_taxa: Optional[List[Taxon]] = None
-    reference_by_id = {}
+    reference: Optional[TaxonTable] = None
 
     multiple_partitions = len(alignment_paths) > 1
 
     for alignment_path in alignment_paths:
-        taxa = taxa_from_fasta(alignment_path, date_delimiter=date_delimiter, date_index=date_index)
-        if not taxa:
+        table, sequences = read_alignment(alignment_path, date_delimiter=date_delimiter, date_index=date_index)
+        if not len(table):
             msg = f"Alignment partition '{alignment_path}' does not contain any taxa."
             raise ValueError(msg)
 
-        if reference_taxa is None:
-            reference_taxa = taxa
-            reference_by_id = {taxon.id: taxon for taxon in reference_taxa}
-            ordered_taxa = taxa
+        if reference is None:
+            reference = table
+            rows = np.arange(len(table))
         else:
-            partition_by_id = {taxon.id: taxon for taxon in taxa}
-            if set(partition_by_id) != set(reference_by_id):
-                msg = (
-                    "All alignment partitions must contain the same set of taxon headers. "
-                    f"Partition '{alignment_path}' does not match the first alignment."
-                )
-                raise ValueError(
-                    msg
-                )
-
-            ordered_taxa = []
-            for reference_taxon in reference_taxa:
-                taxon = partition_by_id[reference_taxon.id]
-                if taxon.date != reference_taxon.date or taxon.uncertainty != reference_taxon.uncertainty:
-                    msg = (
-                        "All alignment partitions must encode identical sampling dates for each taxon. "
-                        f"Mismatch found for taxon '{reference_taxon.id}' in '{alignment_path}'."
-                    )
-                    raise ValueError(msg)
-                ordered_taxa.append(taxon)
+            rows = match_partition_taxa(reference, table, alignment_path)
 
         prefix = build_partition_prefix(alignment_path, used_prefixes)
         partitions.append(
-            Partition(
-                prefix=prefix,
-                background_prefix=labeled_rate_prefix(
-                    background_label,
-                    prefix,
-                    multiple_partitions,
-                    default_label="background",
-                ),
-                foreground_prefix=labeled_rate_prefix(foreground_label, prefix, multiple_partitions),
-                taxa=ordered_taxa,
+            build_partition(
+                prefix,
+                reference,
+                sequences,
+                rows,
+                multiple_partitions,
+                foreground_label,
+                background_label,
+                compress_patterns,
             )
         )
 
     return partitions
 
 
-def taxa_from_fasta(fasta_path, date_delimiter="|", date_index=-1) -> List[Taxon]:
+def partitions_from_sidecar(
+    sidecar_path: Path,
+    foreground_label: Optional[str] = None,
+    background_label: Optional[str] = None,
+    compress_patterns: bool = False,
+) -> List[Partition]:
+    """
+    Build BEAST partitions from an alignment sidecar written by `alignment_sidecar.py`, see `build_partitions`.
+
+    The sidecar rows are already in taxon table order, so the partitions are views into its
+    sequence matrix.
+    """
+    from episodic.workflow.scripts.alignment_sidecar import read_alignment_sidecar
+
+    sidecar = read_alignment_sidecar(sidecar_path)
+    table = TaxonTable(ids=sidecar.taxa, dates=sidecar.dates, uncertainties=sidecar.uncertainties)
+    rows = np.arange(len(table))
+    used_prefixes = set()
+    multiple_partitions = len(sidecar.paths) > 1
+    partitions: List[Partition] = []
+    for partition_index, alignment_path in enumerate(sidecar.paths):
+        prefix = build_partition_prefix(Path(alignment_path), used_prefixes)
+        partitions.append(
+            build_partition(
+                prefix,
+                table,
+                sidecar.partition_sequences(partition_index),
+                rows,
+                multiple_partitions,
+                foreground_label,
+                background_label,
+                compress_patterns,
+            )
+        )
+    return partitions
+
+
+def read_fasta_records(fasta_path) -> Iterator[Tuple[str, bytes]]:
+    """
+    Streams the records of a (optionally gzip or zstd compressed) fasta file.
+
+    The sequence lines of each record are collected and joined once, so wrapped sequences are
+    read in linear time and only one record is held in memory at a time.
+
+    Args:
+      fasta_path (Path): The path to the fasta file.
+
+    Yields:
+      Tuple[str, bytes]: The header (without `>`) and the sequence of each record.
+
+    Raises:
+      ValueError: If the fasta file is invalid.
+    """
+    header = None
+    fragments: List[bytes] = []
+    with open_binary(fasta_path) as fasta_file:
+        for line in fasta_file:
+            if line.startswith(b">"):
+                if header is not None:
+                    yield header, b"".join(fragments)
+                header = line[1:].strip().decode()
+                fragments = []
+            elif header is None:
+                msg = "Invalid fasta file."
+                raise ValueError(msg)
+            else:
+                fragments.append(line.strip())
+    if header is None:
+        msg = "Invalid fasta file."
+        raise ValueError(msg)
+    yield header, b"".join(fragments)
+
+
+SCAN_BUFFER_BYTES = 1024 * 1024
+
+
+def scan_fasta_headers(fasta_path, buffer_size: int = SCAN_BUFFER_BYTES) -> Iterator[str]:
+    """
+    Streams the headers of a (optionally gzip or zstd compressed) fasta file without reading its sequences into records.
+
+    The file is read in fixed-size blocks and only the header lines are decoded, so the cost of
+    the scan does not depend on how long or how wrapped the sequences are.
+
+    Yields:
+      str: Each header, without `>`.
+
+    Raises:
+      ValueError: If the file has no headers.
+    """
+    found = False
+    pending: Optional[List[bytes]] = None
+    at_line_start = True
+    with open_binary(fasta_path) as fasta_file:
+        for block in iter(lambda: fasta_file.read(buffer_size), b""):
+            position = 0
+            if pending is not None:
+                end = block.find(b"\n")
+                if end < 0:
+                    pending.append(block)
+                    continue
+                pending.append(block[:end])
+                yield b"".join(pending).strip().decode()
+                pending = None
+                position = end
+            if at_line_start and block.startswith(b">", position):
+                start = position
+            else:
+                start = block.find(b"\n>", position)
+                start = start + 1 if start >= 0 else -1
+            while start >= 0:
+                found = True
+                end = block.find(b"\n", start)
+                if end < 0:
+                    pending = [block[start + 1 :]]
+                    break
+                yield block[start + 1 : end].strip().decode()
+                start = block.find(b"\n>", end)
+                start = start + 1 if start >= 0 else -1
+            at_line_start = block.endswith(b"\n")
+    if pending is not None:
+        yield b"".join(pending).strip().decode()
+    if not found:
+        msg = "Invalid fasta file."
+        raise ValueError(msg)
+
+
+def scan_header_dates(fasta_path, date_delimiter="|", date_index=-1) -> np.ndarray:
+    """Return the decimal sampling date of every taxon of a fasta file, read from its headers alone."""
+    dates = [parse_header_date(header, date_delimiter, date_index)[0] for header in scan_fasta_headers(fasta_path)]
+    return np.array(dates_to_decimal_years(dates), dtype=np.float64)
+
+
+def parse_header_date(header: str, date_delimiter="|", date_index=-1) -> Tuple[str, float]:
+    """
+    Extracts the date and its uncertainty from a fasta header.
+
+    Examples:
+      >>> parse_header_date("A|1992/1")
+      ('1992', 1.0)
+      >>> parse_header_date("B@2020-07-02", date_delimiter="@")
+      ('2020-07-02', 0.0)
+    """
+    # 1992/1 = 1992 to 1993
+    date_with_uncertainty = header.split(date_delimiter)[date_index]
+    date, *uncertainty = date_with_uncertainty.split("/")
+    return date, float(uncertainty[0]) if uncertainty else 0.0
+
+
+def sequence_block(sequences: List[bytes]):
+    """
+    Packs aligned sequences into a single (taxa x sites) uint8 NumPy array.
+
+    Raises:
+      ValueError: If the sequences are not all the same length.
+    """
+    lengths = {len(sequence) for sequence in sequences}
+    if len(lengths) > 1:
+        msg = "Aligned sequences must all have the same length."
+        raise ValueError(msg)
+    n_sites = lengths.pop() if lengths else 0
+    return np.frombuffer(b"".join(sequences), dtype=np.uint8).reshape(len(sequences), n_sites)
+
+
+def read_taxon_table(fasta_path, date_delimiter="|", date_index=-1) -> Tuple[TaxonTable, List[bytes]]:
+    """
+    Parses a fasta file into a taxon table and the raw sequence of each taxon.
+
+    Args:
+      fasta_path (Path): The path to the fasta file.
+      date_delimiter (str): The delimiter for the date in the fasta header.
+      date_index (int): The index of the date in the fasta header.
+
+    Returns:
+      Tuple[TaxonTable, List[bytes]]: The taxa and their sequences, in file order.
+
+    Raises:
+      ValueError: If the fasta file is invalid.
+    """
+    headers = []
+    sequences = []
+    for header, sequence in read_fasta_records(fasta_path):
+        headers.append(header)
+        sequences.append(sequence)
+
+    dates, uncertainties = zip(*(parse_header_date(header, date_delimiter, date_index) for header in headers))
+    table = TaxonTable(
+        ids=headers,
+        # headers share few distinct dates, so convert each distinct date once
+        dates=np.array(dates_to_decimal_years(dates), dtype=np.float64),
+        uncertainties=np.array(uncertainties, dtype=np.float64),
+    )
+    return table, sequences
+
+
+def read_alignment(fasta_path, date_delimiter="|", date_index=-1) -> Tuple[TaxonTable, np.ndarray]:
+    """
+    Parses a fasta alignment into a taxon table and a (taxa x sites) uint8 sequence matrix.
+
+    Raises:
+      ValueError: If the fasta file is invalid or the sequences are not aligned.
+    """
+    table, sequences = read_taxon_table(fasta_path, date_delimiter=date_delimiter, date_index=date_index)
+    return table, sequence_block(sequences)
+
+
+def taxa_from_fasta(fasta_path, date_delimiter="|", date_index=-1, as_array=False):
     """
     Parses a fasta file into a list of Taxon objects.
 
@@ -199,45 +591,211 @@ def taxa_from_fasta(fasta_path, date_delimiter="|", date_index=-1) -> List[Taxon
       fasta_path (Path): The path to the fasta file.
       date_delimiter (str): The delimiter for the date in the fasta header.
       date_index (int): The index of the date in the fasta header.
+      as_array (bool): Return the sequences as one (taxa x sites) uint8 NumPy array instead of
+        Python strings. The taxa are then returned with empty sequences.
 
     Returns:
-      List[Taxon]: A list of Taxon objects representing the taxa in the fasta file.
+      List[Taxon]: A list of Taxon objects representing the taxa in the fasta file, or a tuple of
+        the taxa and the sequence array when `as_array` is set.
 
     Raises:
       ValueError: If the fasta file is invalid.
     """
-    # Read the fasta file
-    with open(fasta_path) as fasta_file:
-        fasta_lines = fasta_file.readlines()
+    table, sequences = read_taxon_table(fasta_path, date_delimiter=date_delimiter, date_index=date_index)
+    taxa = [
+        Taxon(id=taxon_id, sequence="" if as_array else sequence.decode(), date=date, uncertainty=uncertainty)
+        for taxon_id, sequence, date, uncertainty in zip(
+            table.ids, sequences, table.dates.tolist(), table.uncertainties.tolist()
+        )
+    ]
+    if as_array:
+        return taxa, sequence_block(sequences)
+    return taxa
 
-    # check if valid fasta
-    if not fasta_lines:
-        msg = "Invalid fasta file."
+
+CLOCKS = [
+    "strict",
+    "relaxed",
+    "flc-stem",
+    "flc-shared-stem",
+    "flc-clade",
+    "flc-shared-clade",
+    "flc-stem-and-clade",
+    "flc-shared-stem-and-clade",
+]
+
+
+TEMPLATE_CACHE_VARIABLE = "EPISODIC_TEMPLATE_CACHE"
+
+
+def template_cache_dir() -> Path:
+    """
+    Return the default directory for compiled templates.
+
+    This is `$EPISODIC_TEMPLATE_CACHE` if set, otherwise `episodic/templates` under the user cache
+    directory (`$XDG_CACHE_HOME` or `~/.cache`).
+    """
+    if os.environ.get(TEMPLATE_CACHE_VARIABLE):
+        return Path(os.environ[TEMPLATE_CACHE_VARIABLE])
+    cache_home = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return cache_home / "episodic" / "templates"
+
+
+def load_beast_template(template_path: Path, cache_dir: Optional[Path] = None) -> Template:
+    """
+    Load a BEAST XML template, reusing its compiled bytecode from earlier runs.
+
+    Compiled templates are cached in `cache_dir` (default `template_cache_dir()`) keyed on the
+    SHA-256 of the template source, so the bundled template and custom templates are each compiled
+    once and edited templates are recompiled. Caching is skipped if the directory is not writable.
+
+    Args:
+      template_path (Path): The path to the template.
+      cache_dir (Path, optional): The bytecode cache directory.
+
+    Returns:
+      Template: The compiled template.
+    """
+    source = Path(template_path).read_text()
+    cache_dir = Path(cache_dir) if cache_dir is not None else template_cache_dir()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(str(cache_dir)) if os.access(cache_dir, os.W_OK) else None
+    except OSError:
+        bytecode_cache = None
+    environment = Environment(
+        loader=FunctionLoader(lambda _name: source),
+        undefined=StrictUndefined,
+        bytecode_cache=bytecode_cache,
+    )
+    return environment.get_template(hashlib.sha256(source.encode()).hexdigest())
+
+
+def load_partitions(
+    alignment_paths: List[Path],
+    date_delimiter="|",
+    date_index=-1,
+    foreground_label: Optional[str] = None,
+    background_label: Optional[str] = None,
+    alignment_sidecar: Optional[Path] = None,
+    compress_patterns: bool = False,
+) -> List[Partition]:
+    """Parse the alignment partitions, or read them from an alignment sidecar when one is given."""
+    if alignment_sidecar is not None:
+        return partitions_from_sidecar(
+            alignment_sidecar,
+            foreground_label=foreground_label,
+            background_label=background_label,
+            compress_patterns=compress_patterns,
+        )
+    return build_partitions(
+        alignment_paths,
+        date_delimiter=date_delimiter,
+        date_index=date_index,
+        foreground_label=foreground_label,
+        background_label=background_label,
+        compress_patterns=compress_patterns,
+    )
+
+
+def resolve_group_members(
+    taxon_ids: List[str], groups: Optional[List[str]] = None, groups_file: Optional[Path] = None
+) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Resolve the configured groups and their member taxa.
+
+    The groups file can be a taxon registry (`taxon_groups.npz`) or a TSV mapping taxa to groups,
+    see `write_taxon_groups.load_taxon_registry`.
+
+    Raises:
+      ValueError: If neither groups nor a groups file are given, or a group references unknown taxa.
+    """
+    if groups_file is not None:
+        registry = load_taxon_registry(groups_file)
+    elif groups is not None:
+        registry = build_taxon_registry(taxon_ids, build_group_members(taxon_ids, groups))
+    else:
+        msg = "Either groups or groups_file must be provided."
         raise ValueError(msg)
-    if not fasta_lines[0].startswith(">"):
-        msg = "Invalid fasta file."
+
+    known_taxa = set(taxon_ids)
+    group_taxa = {registry.taxa[member] for member in np.unique(registry.members).tolist()}
+    missing_taxa = group_taxa - known_taxa
+    if missing_taxa:
+        missing_taxa_str = ", ".join(sorted(missing_taxa))
+        msg = f"Group mapping references taxa not present in the alignment: {missing_taxa_str}"
         raise ValueError(msg)
-    # Parse the fasta file into Taxon objects. Support multi-line sequences.
-    taxa = []
-    for line in fasta_lines:
-        if line.startswith(">"):
-            header = line[1:].strip()
-            # 1992/1 = 1992 to 1993
-            date_with_uncertainty = header.split(date_delimiter)[date_index]
-            date, *uncertainty = date_with_uncertainty.split("/")
-            if uncertainty:
-                uncertainty = float(uncertainty[0])
-            else:
-                uncertainty = 0.0
-            try:
-                date = float(date)
-            except ValueError:
-                date = date_to_decimal_year(date)
-            taxa.append(Taxon(id=header, sequence="", date=float(date), uncertainty=uncertainty))
-        else:
-            taxa[-1].sequence += line.strip()
+    return registry.groups, registry.group_members()
 
-    return taxa
+
+def write_beast_xml(template: Template, context: Dict[str, Any], output: Path) -> Path:
+    """Render a template straight to a file, writing each chunk as soon as it is produced."""
+    template.stream(**context).dump(str(output), encoding="utf-8")
+    return output
+
+
+def beast_xml_context(
+    work_dir: Path,
+    name: str,
+    clock: str,
+    partitions: List[Partition],
+    groups: List[str],
+    group_members: Dict[str, List[str]],
+    fixed_tree: Optional[str] = None,
+    rate_gamma_prior_shape: float = 0.5,
+    rate_gamma_prior_scale: float = 0.1,
+    chain_length: int = 100000000,
+    samples: int = 10000,
+    mle_chain_length: int = 1000000,
+    mle_path_steps: int = 100,
+    mle_log_every: int = 10000,
+    *,
+    trace: bool = True,
+    trees: bool = True,
+    mle: bool = True,
+) -> Dict[str, Any]:
+    """Build the variables the BEAST XML template is rendered with, see `populate_beast_template`."""
+    log_every = max(1, chain_length // samples)
+
+    trace_log = None
+    if trace:
+        trace_log = Log(
+            log_every=log_every,
+            file_name=f"{name}.log",
+        )
+
+    tree_log = None
+    if trees:
+        tree_log = Log(
+            log_every=log_every,
+            file_name=f"{name}.trees",
+        )
+
+    mle_log = None
+    if mle:
+        mle_log = MLE(
+            log_every=mle_log_every,
+            file_name=f"{name}.mle.log",
+            results_file_name=work_dir / f"{name}.mle.results.log",
+            chain_length=mle_chain_length,
+            path_steps=mle_path_steps,
+        )
+
+    return {
+        "taxa": partitions[0].taxa,
+        "partitions": partitions,
+        "groups": groups,
+        "groupMembers": group_members,
+        "clock": clock,
+        "fixedTree": fixed_tree,
+        "rateGammaPriorShape": rate_gamma_prior_shape,
+        "rateGammaPriorScale": rate_gamma_prior_scale,
+        "chainLength": chain_length,
+        "screenLogEvery": log_every,
+        "traceLog": trace_log,
+        "treeLog": tree_log,
+        "marginalLikelihoodEstimator": mle_log,
+    }
 
 
 def populate_beast_template(
@@ -260,10 +818,14 @@ def populate_beast_template(
     fixed_tree: Optional[Path] = None,
     foreground_label: Optional[str] = None,
     background_label: Optional[str] = None,
+    alignment_sidecar: Optional[Path] = None,
+    compress_patterns: bool = False,
     *,
     trace: bool = True,
     trees: bool = True,
     mle: bool = True,
+    output: Optional[Path] = None,
+    template_cache: Optional[Path] = None,
 ):
     """
     Populates a Beast XML template with an alignment file.
@@ -274,7 +836,7 @@ def populate_beast_template(
             template_path (Path): The path to the input Beast template file.
             alignment_paths (List[Path]): The paths to the input alignment partitions.
             groups (list): A list of groups to include in the analysis.
-            groups_file (Path): Optional TSV mapping taxa to groups.
+            groups_file (Path): Optional taxon registry (.npz) or TSV mapping taxa to groups.
             clock (str): The clock model to use in the analysis.
             rate_gamma_prior_shape (float): The shape parameter of the gamma prior on the rate.
             rate_gamma_prior_scale (float): The scale parameter of the gamma prior on the rate.
@@ -288,14 +850,18 @@ def populate_beast_template(
             fixed_tree (Path): The path to the fixed tree file.
             foreground_label (str): Optional label prefix for foreground/local-rate parameters.
             background_label (str): Optional label prefix for background clock-rate parameters.
+            alignment_sidecar (Path): Optional pre-parsed alignment sidecar used instead of parsing `alignment_paths`.
+            compress_patterns (bool): Emit constant sites as pattern counts instead of alignment columns.
 
     Keyword Args:
       trace (bool): Whether to enable the trace log.
       trees (bool): Whether to enable the trees log.
       mle (bool): Whether to run the marginal likelihood estimator.
+      output (Path): Stream the rendered XML to this file instead of returning it as a string.
+      template_cache (Path): The compiled template cache directory, see `load_beast_template`.
 
     Returns:
-      str: The rendered Beast XML template.
+      str: The rendered Beast XML template, or the output path when `output` is given.
 
     Examples:
             >>> populate_beast_template(
@@ -322,87 +888,270 @@ def populate_beast_template(
       <Rendered Beast XML template>
     """
     # Load the template
-    template = Template(template_path.read_text(), undefined=StrictUndefined)
+    template = load_beast_template(template_path, template_cache)
 
     # Parse alignment partitions into Taxon objects
-    partitions = build_partitions(
+    partitions = load_partitions(
         alignment_paths,
         date_delimiter=date_delimiter,
         date_index=date_index,
         foreground_label=foreground_label,
         background_label=background_label,
+        alignment_sidecar=alignment_sidecar,
+        compress_patterns=compress_patterns,
     )
-    taxa = partitions[0].taxa
-    taxon_ids = [taxon.id for taxon in taxa]
-
-    if groups_file is not None:
-        group_members = read_group_members(groups_file)
-        groups = list(group_members)
-    elif groups is not None:
-        group_members = build_group_members(taxon_ids, groups)
-    else:
-        msg = "Either groups or groups_file must be provided."
-        raise ValueError(msg)
-
-    missing_taxa = {
-        taxon_id
-        for members in group_members.values()
-        for taxon_id in members
-        if taxon_id not in taxon_ids
-    }
-    if missing_taxa:
-        missing_taxa_str = ", ".join(sorted(missing_taxa))
-        msg = f"Group mapping references taxa not present in the alignment: {missing_taxa_str}"
-        raise ValueError(msg)
+    groups, group_members = resolve_group_members(partitions[0].table.ids, groups, groups_file)
 
     if fixed_tree is not None:
         fixed_tree = fixed_tree.read_text()
 
-    log_every = max(1, chain_length // samples)
+    context = beast_xml_context(
+        work_dir=work_dir,
+        name=name,
+        clock=clock,
+        partitions=partitions,
+        groups=groups,
+        group_members=group_members,
+        fixed_tree=fixed_tree,
+        rate_gamma_prior_shape=rate_gamma_prior_shape,
+        rate_gamma_prior_scale=rate_gamma_prior_scale,
+        chain_length=chain_length,
+        samples=samples,
+        mle_chain_length=mle_chain_length,
+        mle_path_steps=mle_path_steps,
+        mle_log_every=mle_log_every,
+        trace=trace,
+        trees=trees,
+        mle=mle,
+    )
 
-    trace_log = None
-    if trace:
-        trace_log = Log(
-            log_every=log_every,
-            file_name=f"{name}.log",
-        )
+    # Render the template, streaming it to the output file when one is given
+    if output is not None:
+        return write_beast_xml(template, context, output)
+    return template.render(**context)
 
-    tree_log = None
-    if trees:
-        tree_log = Log(
-            log_every=log_every,
-            file_name=f"{name}.trees",
-        )
 
-    mle_log = None
-    if mle:
-        mle_log = MLE(
-            log_every=mle_log_every,
-            file_name=f"{name}.mle.log",
-            results_file_name=work_dir / f"{name}.mle.results.log",
-            chain_length=mle_chain_length,
-            path_steps=mle_path_steps,
-        )
+@dataclass
+class XMLVariant:
+    """
+    A BEAST XML file rendered by `populate_beast_templates`.
 
-    # Render the template
-    rendered_template = template.render(
-        taxa=taxa,
-        partitions=partitions,
-        groups=groups,
-        groupMembers=group_members,
-        clock=clock,
-        fixedTree=fixed_tree,
-        rateGammaPriorShape=rate_gamma_prior_shape,
-        rateGammaPriorScale=rate_gamma_prior_scale,
-        chainLength=chain_length,
-        screenLogEvery=log_every,
-        traceLog=trace_log,
-        treeLog=tree_log,
-        marginalLikelihoodEstimator=mle_log,
+    Attributes:
+      output (Path): The XML file to write. Its stem names the BEAST output files.
+      clock (str): The clock model to use in the analysis.
+      mle (bool): Whether the XML runs the marginal likelihood estimator instead of the MCMC chain.
+      burnin (bool): Whether the XML runs the burn-in chain the chunks of a marginal likelihood
+        run start from, with no log files (its state is saved with `-save_state`).
+    """
+
+    output: Path
+    clock: str
+    mle: bool = False
+    burnin: bool = False
+
+
+# BEAST output files of XMLs in an XML store are named after this instead of the run
+STORE_RUN_NAME = "beast"
+HASH_BUFFER_BYTES = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(HASH_BUFFER_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_beast_xml(template: Template, context: Dict[str, Any], xml_store: Path) -> Path:
+    """
+    Render an XML into a content-addressed store.
+
+    Returns:
+      Path: The stored XML, `<xml_store>/<sha256 of the XML>.xml`.
+    """
+    xml_store.mkdir(parents=True, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=xml_store, suffix=".tmp")
+    os.close(handle)
+    write_beast_xml(template, context, Path(temporary))
+    stored = xml_store / f"{file_sha256(Path(temporary))}.xml"
+    # an existing entry has the same content, so replacing it is harmless
+    os.replace(temporary, stored)
+    return stored
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """Hard link a file to a new path, copying it where hard links are not supported."""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+_worker_state = {}
+
+
+def _init_worker(template_path, settings, template_cache=None, xml_store=None):
+    # forked workers inherit the compiled template of the parent process
+    if _worker_state.get("template_path") != template_path:
+        _worker_state.update(template_path=template_path, template=load_beast_template(template_path, template_cache))
+    _worker_state.update(settings=settings, xml_store=xml_store)
+
+
+def _variant_context(variant: XMLVariant, name: str, work_dir: Path) -> Dict[str, Any]:
+    settings = dict(_worker_state["settings"])
+    mle_burnin_length = settings.pop("mle_burnin_length")
+    if variant.mle:
+        settings["chain_length"] = 1
+    if variant.burnin:
+        # one state past the burn-in, so the state at the end of the burn-in is saved
+        settings["chain_length"] = mle_burnin_length + 1
+    return beast_xml_context(
+        work_dir=work_dir,
+        name=name,
+        clock=variant.clock,
+        trace=not (variant.mle or variant.burnin),
+        trees=not (variant.mle or variant.burnin),
+        mle=variant.mle,
+        **settings,
+    )
+
+
+def render_variant(variant: XMLVariant) -> Path:
+    """Render and write one XML variant. Runs in a worker process initialised with `_init_worker`."""
+    context = _variant_context(variant, name=variant.output.stem, work_dir=variant.output.parent)
+    variant.output.parent.mkdir(parents=True, exist_ok=True)
+    return write_beast_xml(_worker_state["template"], context, variant.output)
+
+
+def render_stored_variant(variant: XMLVariant) -> Path:
+    """
+    Render the run-independent XML of a variant into the XML store, with BEAST output files named
+    after `STORE_RUN_NAME`. Runs in a worker process initialised with `_init_worker`.
+    """
+    context = _variant_context(variant, name=STORE_RUN_NAME, work_dir=Path())
+    return store_beast_xml(_worker_state["template"], context, _worker_state["xml_store"])
+
+
+def populate_beast_templates(
+    template_path: Path,
+    variants: List[XMLVariant],
+    alignment_paths: List[Path],
+    groups: Optional[List[str]] = None,
+    groups_file: Optional[Path] = None,
+    rate_gamma_prior_shape: float = 0.5,
+    rate_gamma_prior_scale: float = 0.1,
+    chain_length: int = 100000000,
+    samples: int = 10000,
+    mle_chain_length: int = 1000000,
+    mle_path_steps: int = 100,
+    mle_log_every: int = 10000,
+    mle_burnin_length: int = 1000000,
+    date_delimiter="|",
+    date_index=-1,
+    fixed_tree: Optional[Path] = None,
+    foreground_label: Optional[str] = None,
+    background_label: Optional[str] = None,
+    alignment_sidecar: Optional[Path] = None,
+    compress_patterns: bool = False,
+    jobs: int = 1,
+    template_cache: Optional[Path] = None,
+    xml_store: Optional[Path] = None,
+    statistics: Optional[Path] = None,
+) -> List[Path]:
+    """
+    Renders many BEAST XML files from one template in a single process.
+
+    The template is compiled and the partitions are parsed once, then every variant is rendered
+    and written, by `jobs` worker processes when more than one is requested. Duplicate runs of a
+    clock only differ in their file names (the seed is set on the BEAST command line).
+
+    Args:
+      template_path (Path): The path to the input Beast template file.
+      variants (List[XMLVariant]): The XML files to render.
+      jobs (int): The number of worker processes used for rendering.
+      template_cache (Path): The compiled template cache directory, see `load_beast_template`.
+      xml_store (Path): Render each distinct XML once into this content-addressed store and hard
+        link the variants to it. The BEAST output files of stored XMLs are named `beast.*` in the
+        directory of each variant, to be renamed after the run.
+      statistics (Path): Also write the taxon and site pattern counts of the partitions, which
+        the BEAST job resources are estimated from (see `resource_model.py`), to this file.
+      mle_burnin_length (int): The chain length of burn-in variants.
+
+    The remaining arguments are shared by all variants, see `populate_beast_template`. MLE
+    variants run a chain of length 1 with the trace and trees logs disabled.
+
+    Returns:
+      List[Path]: The XML files written.
+
+    Examples:
+      >>> populate_beast_templates(
+      ...     Path("template.xml"),
+      ...     [
+      ...         XMLVariant(Path("flc-stem_1.xml"), "flc-stem"),
+      ...         XMLVariant(Path("flc-stem_mle_1.xml"), "flc-stem", mle=True),
+      ...     ],
+      ...     alignment_paths=[Path("alignment.fasta")],
+      ...     groups=["group1"],
+      ...     jobs=2,
+      ... )
+      [PosixPath('flc-stem_1.xml'), PosixPath('flc-stem_mle_1.xml')]
+    """
+    partitions = load_partitions(
+        alignment_paths,
+        date_delimiter=date_delimiter,
+        date_index=date_index,
+        foreground_label=foreground_label,
+        background_label=background_label,
+        alignment_sidecar=alignment_sidecar,
+        compress_patterns=compress_patterns,
     )
+    groups, group_members = resolve_group_members(partitions[0].table.ids, groups, groups_file)
+    if statistics is not None:
+        write_alignment_statistics(alignment_statistics(partitions), statistics)
+    settings = {
+        "partitions": partitions,
+        "groups": groups,
+        "group_members": group_members,
+        "fixed_tree": fixed_tree.read_text() if fixed_tree is not None else None,
+        "rate_gamma_prior_shape": rate_gamma_prior_shape,
+        "rate_gamma_prior_scale": rate_gamma_prior_scale,
+        "chain_length": chain_length,
+        "samples": samples,
+        "mle_chain_length": mle_chain_length,
+        "mle_path_steps": mle_path_steps,
+        "mle_log_every": mle_log_every,
+        "mle_burnin_length": mle_burnin_length,
+    }
+
+    if xml_store is None:
+        targets, render = variants, render_variant
+    else:
+        # duplicates of a clock render identically, so render one XML per clock and run type
+        targets = list({(variant.clock, variant.mle, variant.burnin): variant for variant in variants}.values())
+        render = render_stored_variant
 
-    # Write the rendered template to a file
-    return rendered_template
+    _init_worker(template_path, settings, template_cache, xml_store)
+    if jobs == 1 or len(targets) < 2:
+        rendered = [render(target) for target in targets]
+    else:
+        with Pool(
+            min(jobs, len(targets)),
+            initializer=_init_worker,
+            initargs=(template_path, settings, template_cache, xml_store),
+        ) as pool:
+            rendered = pool.map(render, targets)
+    if xml_store is None:
+        return rendered
+
+    stored = {(target.clock, target.mle, target.burnin): path for target, path in zip(targets, rendered)}
+    for variant in variants:
+        link_or_copy(stored[(variant.clock, variant.mle, variant.burnin)], variant.output)
+    return [variant.output for variant in variants]
 
 
 if __name__ == "__main__":
@@ -414,9 +1163,18 @@ if __name__ == "__main__":
         dest="alignments",
         type=Path,
         action="append",
-        required=True,
         help="Path to an input alignment partition. Repeat for multiple partitions.",
     )
+    parser.add_argument(
+        "--alignment-sidecar",
+        type=Path,
+        help="Pre-parsed alignment sidecar written by alignment_sidecar.py, used instead of --alignment.",
+    )
+    parser.add_argument(
+        "--compress-patterns",
+        action="store_true",
+        help="Leave constant A/C/G/T sites out of the alignments and emit them as constant pattern counts.",
+    )
     parser.add_argument(
         "--date-delimiter",
         type=str,
@@ -434,21 +1192,12 @@ if __name__ == "__main__":
         nargs="+",
         help="List of groups to include in the analysis. Space-separated list.",
     )
-    parser.add_argument("--groups-file", type=Path, help="TSV mapping taxa to group labels.")
+    parser.add_argument("--groups-file", type=Path, help="Taxon registry (.npz) or TSV mapping taxa to group labels.")
     parser.add_argument(
         "--clock",
         type=str,
         help="Clock model to use in the analysis.",
-        choices=[
-            "strict",
-            "relaxed",
-            "flc-stem",
-            "flc-shared-stem",
-            "flc-clade",
-            "flc-shared-clade",
-            "flc-stem-and-clade",
-            "flc-shared-stem-and-clade",
-        ],
+        choices=CLOCKS,
     )
     parser.add_argument(
         "--rate-gamma-prior-shape",
@@ -485,38 +1234,123 @@ if __name__ == "__main__":
         default=10000,
         help="Log every for the marginal likelihood estimator.",
     )
+    parser.add_argument(
+        "--mle-burnin-length",
+        type=int,
+        default=1000000,
+        help="Length of the burn-in chain the chunks of a marginal likelihood run start from.",
+    )
     parser.add_argument("--fixed-tree", type=Path, help="Path to the fixed tree file.")
     parser.add_argument("--foreground-label", help="Optional label prefix for foreground/local-rate parameters.")
     parser.add_argument("--background-label", help="Optional label prefix for background clock-rate parameters.")
-    parser.add_argument("--output", type=Path, required=True, help="Path to the output Beast XML file.")
+    parser.add_argument("--output", type=Path, help="Path to the output Beast XML file.")
+    parser.add_argument(
+        "--xml",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("CLOCK", "OUTPUT"),
+        help="Render a BEAST XML file for a clock in batch mode. Repeat for every clock and duplicate.",
+    )
+    parser.add_argument(
+        "--mle-xml",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("CLOCK", "OUTPUT"),
+        help="Render a marginal likelihood estimation XML file for a clock in batch mode.",
+    )
+    parser.add_argument(
+        "--mle-burnin-xml",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("CLOCK", "OUTPUT"),
+        help="Render the burn-in XML of a chunked marginal likelihood run for a clock in batch mode.",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used in batch mode.")
+    parser.add_argument(
+        "--xml-store",
+        type=Path,
+        help="In batch mode, render each distinct XML once into this directory and hard link the outputs to it.",
+    )
+    parser.add_argument(
+        "--statistics",
+        type=Path,
+        help="In batch mode, also write the taxon and site pattern counts of the partitions to this JSON file.",
+    )
+    parser.add_argument(
+        "--template-cache",
+        type=Path,
+        help=f"Directory for compiled templates. Defaults to ${TEMPLATE_CACHE_VARIABLE} or the user cache directory.",
+    )
 
     # Parse the command line arguments
     args = parser.parse_args()
+    if not args.alignments and args.alignment_sidecar is None:
+        parser.error("one of --alignment or --alignment-sidecar is required")
+    if args.output is None and not (args.xml or args.mle_xml or args.mle_burnin_xml):
+        parser.error("one of --output or --xml/--mle-xml/--mle-burnin-xml is required")
+    for clock, _ in args.xml + args.mle_xml + args.mle_burnin_xml:
+        if clock not in CLOCKS:
+            parser.error(f"invalid clock '{clock}' (choose from {', '.join(CLOCKS)})")
 
-    # Call the function to populate the Beast template
-    beast_xml = populate_beast_template(
-        work_dir=args.output.parent,
-        name=args.output.stem,
-        template_path=args.template,
-        alignment_paths=args.alignments,
-        date_delimiter=args.date_delimiter,
-        date_index=args.date_index,
-        groups=args.groups,
-        groups_file=args.groups_file,
-        clock=args.clock,
-        chain_length=1 if args.mle else args.chain_length,
-        samples=args.samples,
-        fixed_tree=args.fixed_tree,
-        rate_gamma_prior_shape=args.rate_gamma_prior_shape,
-        rate_gamma_prior_scale=args.rate_gamma_prior_scale,
-        foreground_label=args.foreground_label,
-        background_label=args.background_label,
-        trace=args.no_trace,
-        trees=args.no_trees,
-        mle=args.mle,
-        mle_chain_length=args.mle_chain_length,
-        mle_path_steps=args.mle_path_steps,
-        mle_log_every=args.mle_log_every,
-    )
-    # save to file
-    args.output.write_text(beast_xml)
+    if args.xml or args.mle_xml or args.mle_burnin_xml:
+        populate_beast_templates(
+            template_path=args.template,
+            variants=[XMLVariant(Path(output), clock) for clock, output in args.xml]
+            + [XMLVariant(Path(output), clock, mle=True) for clock, output in args.mle_xml]
+            + [XMLVariant(Path(output), clock, burnin=True) for clock, output in args.mle_burnin_xml],
+            alignment_paths=args.alignments or [],
+            alignment_sidecar=args.alignment_sidecar,
+            compress_patterns=args.compress_patterns,
+            date_delimiter=args.date_delimiter,
+            date_index=args.date_index,
+            groups=args.groups,
+            groups_file=args.groups_file,
+            chain_length=args.chain_length,
+            samples=args.samples,
+            fixed_tree=args.fixed_tree,
+            rate_gamma_prior_shape=args.rate_gamma_prior_shape,
+            rate_gamma_prior_scale=args.rate_gamma_prior_scale,
+            foreground_label=args.foreground_label,
+            background_label=args.background_label,
+            mle_chain_length=args.mle_chain_length,
+            mle_path_steps=args.mle_path_steps,
+            mle_log_every=args.mle_log_every,
+            mle_burnin_length=args.mle_burnin_length,
+            jobs=args.jobs,
+            template_cache=args.template_cache,
+            xml_store=args.xml_store,
+            statistics=args.statistics,
+        )
+    else:
+        # Call the function to populate the Beast template
+        populate_beast_template(
+            work_dir=args.output.parent,
+            name=args.output.stem,
+            template_path=args.template,
+            alignment_paths=args.alignments or [],
+            alignment_sidecar=args.alignment_sidecar,
+            compress_patterns=args.compress_patterns,
+            date_delimiter=args.date_delimiter,
+            date_index=args.date_index,
+            groups=args.groups,
+            groups_file=args.groups_file,
+            clock=args.clock,
+            chain_length=1 if args.mle else args.chain_length,
+            samples=args.samples,
+            fixed_tree=args.fixed_tree,
+            rate_gamma_prior_shape=args.rate_gamma_prior_shape,
+            rate_gamma_prior_scale=args.rate_gamma_prior_scale,
+            foreground_label=args.foreground_label,
+            background_label=args.background_label,
+            trace=args.no_trace,
+            trees=args.no_trees,
+            mle=args.mle,
+            mle_chain_length=args.mle_chain_length,
+            mle_path_steps=args.mle_path_steps,
+            mle_log_every=args.mle_log_every,
+            output=args.output,
+            template_cache=args.template_cache,
+        )
@@ -0,0 +1,391 @@
+import csv
+import json
+import math
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import typer
+
+app = typer.Typer()
+
+FEATURES = ("intercept", "log_taxa", "log_patterns", "log_partitions", "log_states", "relaxed", "flc", "gpu", "mle")
+FEATURES_SUFFIX = ".features.json"
+# one-sided 95% quantile of the standard normal, so about 1 in 20 jobs exceeds its estimate
+QUANTILE = 1.645
+MIN_MEM_MB = 2000
+MIN_RUNTIME = 10
+# weight of the prior coefficients and residual variance, in jobs
+PRIOR_STRENGTH = 1.0
+PRIOR_SIGMA_WEIGHT = 2.0
+
+
+class AlignmentStatistics(NamedTuple):
+    """
+    The alignment statistics BEAST memory and runtime scale with.
+
+    Attributes:
+      taxa (int): The number of taxa.
+      patterns (List[int]): The number of unique site patterns of each partition.
+    """
+
+    taxa: int
+    patterns: List[int]
+
+
+def count_site_patterns(sequences: np.ndarray, constant_patterns: Optional[List[int]] = None) -> int:
+    """
+    Counts the unique site patterns (alignment columns) of a (taxa x sites) uint8 alignment.
+
+    Constant sites left out of the alignment (see `alignment_sidecar.compress_site_patterns`)
+    add one pattern per nucleotide they were counted for.
+
+    Examples:
+      >>> count_site_patterns(np.frombuffer(b"AACAAC", np.uint8).reshape(2, 3), [0, 0, 4, 0])
+      3
+    """
+    patterns = len(np.unique(np.ascontiguousarray(sequences.T), axis=0)) if sequences.size else 0
+    return patterns + sum(1 for count in constant_patterns or [] if count)
+
+
+def alignment_statistics(partitions) -> AlignmentStatistics:
+    """Return the statistics of the partitions of an analysis, see `populate_beast_template.Partition`."""
+    return AlignmentStatistics(
+        taxa=len(partitions[0].table),
+        patterns=[count_site_patterns(partition.sequences, partition.constant_patterns) for partition in partitions],
+    )
+
+
+def write_alignment_statistics(statistics: AlignmentStatistics, output: Path) -> None:
+    """Write alignment statistics as JSON."""
+    Path(output).write_text(json.dumps(statistics._asdict(), indent=2))
+
+
+def read_alignment_statistics(path: Path) -> AlignmentStatistics:
+    """Read alignment statistics written by `write_alignment_statistics`."""
+    return AlignmentStatistics(**json.loads(Path(path).read_text()))
+
+
+class JobFeatures(NamedTuple):
+    """
+    The properties of a BEAST job its resources are predicted from.
+
+    Attributes:
+      taxa (int): The number of taxa.
+      patterns (int): The number of unique site patterns summed over the partitions.
+      partitions (int): The number of partitions.
+      states (int): The number of MCMC states the job runs, over all path steps for MLE jobs.
+      clock (str): The clock model, e.g. 'flc-stem'.
+      gpu (bool): Whether BEAST runs on a BEAGLE GPU resource.
+      mle (bool): Whether the job runs the marginal likelihood estimator.
+    """
+
+    taxa: int
+    patterns: int
+    partitions: int
+    states: int
+    clock: str
+    gpu: bool = False
+    mle: bool = False
+
+    @classmethod
+    def from_statistics(cls, statistics: AlignmentStatistics, **kwargs) -> "JobFeatures":
+        """Return the features of a job on an alignment with the given statistics."""
+        return cls(
+            taxa=statistics.taxa, patterns=sum(statistics.patterns), partitions=len(statistics.patterns), **kwargs
+        )
+
+    def vector(self) -> np.ndarray:
+        """
+        Return the feature vector, in `FEATURES` order.
+
+        Examples:
+          >>> JobFeatures(100, 500, 1, 10000000, 'relaxed').vector().round(2).tolist()
+          [1.0, 4.61, 6.21, 0.0, 16.12, 1.0, 0.0, 0.0, 0.0]
+        """
+        return np.array(
+            [
+                1.0,
+                math.log(max(self.taxa, 1)),
+                math.log(max(self.patterns, 1)),
+                math.log(max(self.partitions, 1)),
+                math.log(max(self.states, 1)),
+                float(self.clock.startswith("relaxed")),
+                float(self.clock.startswith("flc")),
+                float(self.gpu),
+                float(self.mle),
+            ]
+        )
+
+
+class JobRecord(NamedTuple):
+    """
+    The measured resources of a finished job.
+
+    Attributes:
+      benchmark (str): The benchmark file the measurements were read from.
+      features (JobFeatures): The properties of the job.
+      mem_mb (float, optional): The peak resident memory in MB, None if it was not measured.
+      runtime (float): The wall-clock time in minutes.
+    """
+
+    benchmark: str
+    features: JobFeatures
+    mem_mb: Optional[float]
+    runtime: float
+
+
+# log-linear coefficients in `FEATURES` order, before any benchmarks are seen. Memory scales with
+# the size of the partial likelihood buffers (taxa x patterns), runtime with the number of states
+# times the patterns, and the relaxed clock adds a rate per branch
+PRIOR_COEFFICIENTS = {
+    "memory": [2.2, 0.4, 0.4, 0.1, 0.0, 0.0, 0.0, 0.0, 0.0],
+    "runtime": [-22.4, 0.5, 1.0, 0.0, 1.0, 0.3, 0.1, -1.0, 0.0],
+}
+PRIOR_SIGMA = {"memory": 0.5, "runtime": 0.5}
+
+
+class ResourceModel(NamedTuple):
+    """
+    Log-linear models of the peak memory (MB) and runtime (minutes) of BEAST jobs.
+
+    `log(resource) = coefficients . features`, with the features of `JobFeatures.vector`, and a
+    residual standard deviation `sigma` on the log scale.
+
+    Attributes:
+      coefficients (Dict[str, np.ndarray]): The 'memory' and 'runtime' coefficients.
+      sigma (Dict[str, float]): The 'memory' and 'runtime' residual standard deviations.
+      records (List[JobRecord]): The jobs the model was fitted to.
+    """
+
+    coefficients: Dict[str, np.ndarray]
+    sigma: Dict[str, float]
+    records: List[JobRecord]
+
+    def predict(self, features: JobFeatures, quantile: float = QUANTILE) -> Tuple[float, float]:
+        """
+        Predicts the memory (MB) and runtime (minutes) of a job.
+
+        The estimates are `quantile` standard deviations above the fitted mean, so they cover
+        most jobs rather than half of them.
+
+        Examples:
+          >>> mem_mb, runtime = prior_model().predict(JobFeatures(1000, 3000, 1, 10000000, 'flc-stem'))
+          >>> round(mem_mb), round(runtime)
+          (8008, 446)
+        """
+        vector = features.vector()
+        return tuple(
+            math.exp(float(self.coefficients[target] @ vector) + quantile * self.sigma[target])
+            for target in ("memory", "runtime")
+        )
+
+
+def prior_model() -> ResourceModel:
+    """Return the model used before any benchmarks have been fitted."""
+    return ResourceModel(
+        coefficients={target: np.array(values) for target, values in PRIOR_COEFFICIENTS.items()},
+        sigma=dict(PRIOR_SIGMA),
+        records=[],
+    )
+
+
+def fit_coefficients(
+    features: np.ndarray, targets: np.ndarray, prior: np.ndarray, prior_sigma: float
+) -> Tuple[np.ndarray, float]:
+    """
+    Fits log-linear coefficients by ridge regression towards the prior coefficients.
+
+    With few benchmarks the coefficients stay close to the prior and move towards the least
+    squares fit as benchmarks accumulate; the residual variance is pooled with the prior in the
+    same way.
+
+    Args:
+      features (np.ndarray): The (jobs x features) feature vectors.
+      targets (np.ndarray): The log resource of each job.
+      prior (np.ndarray): The prior coefficients.
+      prior_sigma (float): The prior residual standard deviation.
+
+    Returns:
+      Tuple[np.ndarray, float]: The coefficients and the residual standard deviation.
+    """
+    penalty = PRIOR_STRENGTH * np.eye(len(prior))
+    coefficients = np.linalg.solve(features.T @ features + penalty, features.T @ targets + penalty @ prior)
+    residuals = targets - features @ coefficients
+    sum_of_squares = PRIOR_SIGMA_WEIGHT * prior_sigma**2 + float(residuals @ residuals)
+    variance = sum_of_squares / (PRIOR_SIGMA_WEIGHT + len(targets))
+    return coefficients, math.sqrt(variance)
+
+
+def fit_resource_model(records: List[JobRecord]) -> ResourceModel:
+    """Fit the memory and runtime models to the measured resources of past jobs."""
+    prior = prior_model()
+    coefficients, sigma = dict(prior.coefficients), dict(prior.sigma)
+    for target, measured in (
+        ("memory", [(record.features, record.mem_mb) for record in records if record.mem_mb]),
+        ("runtime", [(record.features, record.runtime) for record in records if record.runtime]),
+    ):
+        if measured:
+            coefficients[target], sigma[target] = fit_coefficients(
+                np.array([features.vector() for features, _ in measured]),
+                np.log([value for _, value in measured]),
+                prior.coefficients[target],
+                prior.sigma[target],
+            )
+    return ResourceModel(coefficients=coefficients, sigma=sigma, records=list(records))
+
+
+def write_resource_model(model: ResourceModel, output: Path) -> None:
+    """Write a resource model, including the records it was fitted to, as JSON."""
+    data = {
+        "features": list(FEATURES),
+        "coefficients": {target: values.tolist() for target, values in model.coefficients.items()},
+        "sigma": model.sigma,
+        "records": [{**record._asdict(), "features": record.features._asdict()} for record in model.records],
+    }
+    Path(output).write_text(json.dumps(data, indent=2))
+
+
+def read_resource_model(path: Path) -> ResourceModel:
+    """Read a resource model written by `write_resource_model`."""
+    data = json.loads(Path(path).read_text())
+    if data.get("features") != list(FEATURES):
+        msg = f"{path} was fitted to different features, refit it from its benchmarks."
+        raise ValueError(msg)
+    return ResourceModel(
+        coefficients={target: np.array(values) for target, values in data["coefficients"].items()},
+        sigma=data["sigma"],
+        records=[
+            JobRecord(**{**record, "features": JobFeatures(**record["features"])}) for record in data.get("records", [])
+        ],
+    )
+
+
+def load_resource_model(path: Optional[Path] = None) -> ResourceModel:
+    """Read a resource model, or return the prior model if no path is given."""
+    return prior_model() if path is None else read_resource_model(path)
+
+
+def estimate_resources(model: ResourceModel, features: JobFeatures, attempt: int = 1) -> Dict[str, int]:
+    """
+    Estimates the Snakemake `mem_mb` and `runtime` (minutes) resources of a BEAST job.
+
+    Both scale with the attempt, so a job that is restarted after running out of memory or
+    time asks for more.
+
+    Examples:
+      >>> estimate_resources(prior_model(), JobFeatures(1000, 3000, 1, 10000000, 'flc-stem'), attempt=2)
+      {'mem_mb': 16016, 'runtime': 893}
+    """
+    mem_mb, runtime = model.predict(features)
+    return {
+        "mem_mb": math.ceil(max(mem_mb, MIN_MEM_MB) * attempt),
+        "runtime": math.ceil(max(runtime, MIN_RUNTIME) * attempt),
+    }
+
+
+def features_path(benchmark: Path) -> Path:
+    """Return the job features file written next to a benchmark file."""
+    return Path(benchmark).with_suffix(FEATURES_SUFFIX)
+
+
+def read_benchmark(path: Path) -> Tuple[Optional[float], float]:
+    """
+    Reads a Snakemake benchmark file.
+
+    Returns:
+      Tuple[Optional[float], float]: The peak resident memory in MB (None if it was not
+        measured) and the wall-clock time in minutes, the largest of any repeats.
+    """
+    with open(path, newline="") as handle:
+        rows = list(csv.DictReader(handle, delimiter="\t"))
+    if not rows:
+        msg = f"{path} has no measurements."
+        raise ValueError(msg)
+
+    def largest(column: str) -> Optional[float]:
+        values = []
+        for row in rows:
+            try:
+                values.append(float(row.get(column, "")))
+            except ValueError:
+                continue
+        return max(values) if values else None
+
+    return largest("max_rss"), (largest("s") or 0.0) / 60
+
+
+def read_job_records(paths: Iterable[Path]) -> List[JobRecord]:
+    """
+    Reads the benchmarks of past jobs that have a features file next to them.
+
+    Args:
+      paths (Iterable[Path]): Benchmark files, or directories searched for benchmark (.tsv) files.
+
+    Returns:
+      List[JobRecord]: The measured jobs.
+    """
+    records = []
+    for path in paths:
+        benchmarks = sorted(Path(path).rglob("*.tsv")) if Path(path).is_dir() else [Path(path)]
+        for benchmark in benchmarks:
+            if not features_path(benchmark).exists():
+                continue
+            mem_mb, runtime = read_benchmark(benchmark)
+            features = JobFeatures(**json.loads(features_path(benchmark).read_text()))
+            records.append(JobRecord(str(benchmark), features, mem_mb, runtime))
+    return records
+
+
+@app.command()
+def fit(
+    model_path: Path = typer.Argument(..., help="Resource model (.json) to update, created if missing"),
+    benchmarks: List[Path] = typer.Argument(..., help="Benchmark files or directories of past runs"),
+):
+    """
+    Updates a resource model with the benchmarks of past BEAST and MLE jobs.
+
+    The model keeps the jobs it was fitted to, so benchmark directories can be deleted once they
+    have been added. A job whose benchmark is added again replaces its earlier record.
+
+    Examples:
+      >>> fit(Path('resource_model.json'), [Path('results/benchmarks')])
+    """
+    model = read_resource_model(model_path) if model_path.exists() else prior_model()
+    new_records = read_job_records(benchmarks)
+    records = {record.benchmark: record for record in model.records + new_records}
+    model = fit_resource_model(list(records.values()))
+    write_resource_model(model, model_path)
+    benchmarks_read = f"{len(new_records)} benchmark{'s' if len(new_records) != 1 else ''} read"
+    typer.echo(
+        f"Fitted {model_path} to {len(model.records)} jobs ({benchmarks_read}), "
+        f"memory sigma {model.sigma['memory']:.2f}, runtime sigma {model.sigma['runtime']:.2f}"
+    )
+
+
+@app.command()
+def predict(
+    statistics_path: Path = typer.Argument(..., help="Alignment statistics (.json) written with the XMLs"),
+    clock: str = typer.Option(..., help="Clock model"),
+    states: int = typer.Option(..., help="Number of MCMC states, over all path steps for MLE jobs"),
+    gpu: bool = typer.Option(False, "--gpu", help="Predict for a BEAGLE GPU run"),
+    mle: bool = typer.Option(False, "--mle", help="Predict for a marginal likelihood job"),
+    model_path: Optional[Path] = typer.Option(
+        None, "--model", help="Resource model (.json). Defaults to the prior model"
+    ),
+):
+    """
+    Prints the estimated memory and runtime of a BEAST job.
+
+    Examples:
+      >>> predict(Path('results/xml/alignment_statistics.json'), 'flc-stem', 10000000, False, False, None)
+    """
+    features = JobFeatures.from_statistics(
+        read_alignment_statistics(statistics_path), states=states, clock=clock, gpu=gpu, mle=mle
+    )
+    resources = estimate_resources(load_resource_model(model_path), features)
+    typer.echo(f"mem_mb={resources['mem_mb']} runtime={resources['runtime']}")
+
+
+if __name__ == "__main__":
+    app()
@@ -1,12 +1,21 @@
+import io
 from pathlib import Path
+from typing import List, TextIO
 
 import dendropy
 import typer
 
+try:
+    from episodic.workflow.scripts.compression import open_text, strip_compression_suffix
+except ModuleNotFoundError:
+    from compression import open_text, strip_compression_suffix
+
+READ_BUFFER_CHARS = 1024 * 1024
+
 
 def get_schema(path: Path):
     """
-    Gets the schema for a given file.
+    Gets the schema for a given file, ignoring a `.gz` or `.zst` compression suffix.
 
     Args:
       path (Path): The path to the file.
@@ -21,13 +30,64 @@ def get_schema(path: Path):
       >>> get_schema(Path('file.nexus'))
       'nexus'
     """
-    if path.suffix in [".nxs", ".nexus", ".treefile"]:
+    suffix = strip_compression_suffix(path).suffix
+    if suffix in [".nxs", ".nexus", ".treefile", ".trees"]:
         return "nexus"
-    if path.suffix in [".newick", ".nwk"]:
+    if suffix in [".newick", ".nwk"]:
         return "newick"
     raise Exception(f"Cannot get schema for file {path}")
 
 
+class SingleQuoteReader(io.TextIOBase):
+    """
+    Reads a text stream with double quotes replaced by single quotes, one buffer at a time.
+
+    The dendropy NEXUS tokenizer only treats single quotes as quotes, so double-quoted labels
+    are rewritten as the file is read rather than in a full in-memory copy of the file.
+    """
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+        self._buffer = ""
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self) -> bool:
+        chunk = self._stream.read(READ_BUFFER_CHARS)
+        self._buffer = chunk.replace('"', "'")
+        self._position = 0
+        return bool(chunk)
+
+    def read(self, size: int = -1) -> str:
+        # dendropy reads one character at a time, so serve those straight from the buffer
+        if size == 1 and self._position < len(self._buffer):
+            char = self._buffer[self._position]
+            self._position += 1
+            return char
+        pieces = []
+        while size is None or size < 0 or size > 0:
+            if self._position >= len(self._buffer) and not self._fill():
+                break
+            end = len(self._buffer) if size is None or size < 0 else self._position + size
+            piece = self._buffer[self._position : end]
+            self._position += len(piece)
+            if size is not None and size > 0:
+                size -= len(piece)
+            pieces.append(piece)
+        return "".join(pieces)
+
+
+def label_nodes(tree: dendropy.Tree, node_label: str) -> None:
+    """Label the nodes of a tree from an annotation, formatting numeric values with two significant digits."""
+    for node in tree:
+        try:
+            node.label = "%.2g" % float(node.annotations.get_value(node_label))
+        except:
+            node.label = node.annotations.get_value(node_label)
+
+
 def tree_converter(
     input: Path = typer.Argument(..., help="The path to the tree file in newick format."),
     output: Path = typer.Argument(..., help="The path to the tree file in newick format."),
@@ -38,10 +98,14 @@ def tree_converter(
         "", help="The output file schema. If empty then it tries to infer the schema from the file extension."
     ),
     node_label: str = typer.Option("", help="Label the nodes from an annotation if present."),
-):
+) -> int:
     """
     Converts a tree file from one format to another.
 
+    Trees are parsed one at a time. Newick output is written as each tree is parsed, so whole
+    posterior samples can be converted without holding them in memory; NEXUS output needs a
+    shared taxa block and is written once all trees are read.
+
     Args:
       input (Path): The path to the tree file in newick format.
       output (Path): The path to the tree file in newick format.
@@ -50,32 +114,72 @@ def tree_converter(
       node_label (str): Label the nodes from an annotation if present.
 
     Returns:
-      None
+      int: The number of trees converted.
 
     Examples:
       >>> tree_converter(Path('input.nwk'), Path('output.nexus'), input_schema='newick', output_schema='nexus', node_label='label')
+      1
     """
     if not input_schema:
         input_schema = get_schema(input)
     if not output_schema:
         output_schema = get_schema(output)
 
-    input_str = input.read_text()
-
-    # Replace quote char because dendropy nexus tokenizer only uses single quotes by default
-    input_str = input_str.replace('"', "'")
+    taxon_namespace = dendropy.TaxonNamespace()
+    trees = dendropy.TreeList(taxon_namespace=taxon_namespace)
+    count = 0
+    with open_text(input) as handle, open(output, "w") as out:
+        # Replace quote char because dendropy nexus tokenizer only uses single quotes by default
+        for tree in dendropy.Tree.yield_from_files(
+            files=[SingleQuoteReader(handle)], schema=input_schema, taxon_namespace=taxon_namespace
+        ):
+            if node_label:
+                label_nodes(tree, node_label)
+            if output_schema == "newick":
+                tree.write(file=out, schema=output_schema, suppress_rooting=True)
+            else:
+                trees.append(tree)
+            count += 1
+        if output_schema != "newick":
+            if len(trees) == 1:
+                trees[0].write(file=out, schema=output_schema, suppress_rooting=True)
+            else:
+                trees.write(file=out, schema=output_schema, suppress_rooting=True)
+    return count
+
+
+def convert_trees(
+    paths: List[Path] = typer.Argument(..., help="Input and output paths as pairs: IN OUT [IN OUT ...]."),
+    input_schema: str = typer.Option(
+        "", help="The input file schema. If empty then it tries to infer the schema from the file extension."
+    ),
+    output_schema: str = typer.Option(
+        "", help="The output file schema. If empty then it tries to infer the schema from the file extension."
+    ),
+    node_label: str = typer.Option("", help="Label the nodes from an annotation if present."),
+):
+    """
+    Converts one or more tree files in a single process.
 
-    tree = dendropy.Tree.get(data=input_str, schema=input_schema)
+    Args:
+      paths (List[Path]): Input and output paths as pairs: IN OUT [IN OUT ...].
+      input_schema (str): The input file schema. If empty then it is inferred from each input's extension.
+      output_schema (str): The output file schema. If empty then it is inferred from each output's extension.
+      node_label (str): Label the nodes from an annotation if present.
 
-    if node_label:
-        for node in tree:
-            try:
-                node.label = "%.2g" % float(node.annotations.get_value(node_label))
-            except:
-                node.label = node.annotations.get_value(node_label)
+    Returns:
+      None
 
-    tree.write(path=output, schema=output_schema, suppress_rooting=True)
+    Examples:
+      >>> convert_trees([Path('a.nexus'), Path('a.nwk'), Path('b.nexus'), Path('b.nwk')], '', '', 'posterior')
+    """
+    if len(paths) % 2:
+        msg = "Provide an output path for every input path."
+        raise typer.BadParameter(msg)
+    for input_path, output in zip(paths[::2], paths[1::2]):
+        count = tree_converter(input_path, output, input_schema, output_schema, node_label)
+        typer.echo(f"Converted {count} tree{'s' if count != 1 else ''} from {input_path} to {output}")
 
 
 if __name__ == "__main__":
-    typer.run(tree_converter)
\ No newline at end of file
+    typer.run(convert_trees)
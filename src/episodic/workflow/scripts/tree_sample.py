@@ -0,0 +1,304 @@
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import typer
+
+try:
+    from episodic.workflow.scripts.beast_trees import (
+        TreeArrays,
+        TreeChunk,
+        chunk_count,
+        load_tree_index,
+        map_chunks,
+        node_heights,
+        parse_translate,
+        quote,
+        read_translate,
+        select_trees,
+        split_tree_offsets,
+        translate_entries,
+        yield_chunk_arrays,
+    )
+except ModuleNotFoundError:
+    from beast_trees import (
+        TreeArrays,
+        TreeChunk,
+        chunk_count,
+        load_tree_index,
+        map_chunks,
+        node_heights,
+        parse_translate,
+        quote,
+        read_translate,
+        select_trees,
+        split_tree_offsets,
+        translate_entries,
+        yield_chunk_arrays,
+    )
+
+app = typer.Typer()
+
+ANNOTATION_PREFIX = "annotation_"
+
+
+class TreeSample(NamedTuple):
+    """
+    A posterior tree sample stored as flat NumPy arrays with a shared taxon table.
+
+    The nodes of every tree are stored in post-order (children before their parent, root last)
+    and the trees are concatenated, so the nodes of tree `i` are
+    `node_offsets[i]:node_offsets[i + 1]`.
+
+    Attributes:
+      taxa (List[str]): The taxon labels; `taxon` indexes into this list.
+      states (np.ndarray): The MCMC state of each tree.
+      node_offsets (np.ndarray): The index of the first node of each tree, plus the total number of nodes.
+      parent (np.ndarray): The parent of every node within its own tree, -1 for roots.
+      taxon (np.ndarray): The taxon index of every tip, -1 for internal nodes.
+      length (np.ndarray): The branch length above every node, NaN for roots.
+      height (np.ndarray): The height of every node above the most recent tip of its tree.
+      annotations (Dict[str, np.ndarray]): Numeric node annotations such as `rate`, NaN where missing.
+    """
+
+    taxa: List[str]
+    states: np.ndarray
+    node_offsets: np.ndarray
+    parent: np.ndarray
+    taxon: np.ndarray
+    length: np.ndarray
+    height: np.ndarray
+    annotations: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def tree(self, tree_index: int) -> TreeArrays:
+        """Return a single tree of the sample."""
+        nodes = slice(int(self.node_offsets[tree_index]), int(self.node_offsets[tree_index + 1]))
+        return TreeArrays(
+            parent=self.parent[nodes].astype(np.intp),
+            length=self.length[nodes],
+            taxon=self.taxon[nodes].astype(np.intp),
+            annotations={key: values[nodes] for key, values in self.annotations.items()},
+        )
+
+    def yield_trees(self, selection: Iterable[int]) -> Iterator[TreeArrays]:
+        """Yield the selected trees of the sample, e.g. `range(burnin, len(sample))`."""
+        for tree_index in selection:
+            yield self.tree(tree_index)
+
+
+def is_tree_sample(path: Path) -> bool:
+    """Return whether a path is a binary tree sample rather than a NEXUS trees file."""
+    return Path(path).suffix == ".npz"
+
+
+def build_tree_sample(trees: Iterable[TreeArrays], taxa: List[str], states: Iterable[int]) -> TreeSample:
+    """
+    Flattens a sequence of trees into a tree sample.
+
+    Args:
+      trees (Iterable[TreeArrays]): The trees, with taxon indices into `taxa`.
+      taxa (List[str]): The taxon labels.
+      states (Iterable[int]): The MCMC state of each tree.
+
+    Returns:
+      TreeSample: The tree sample.
+    """
+    trees = list(trees)
+    sizes = [len(tree.parent) for tree in trees]
+    keys = sorted({key for tree in trees for key in tree.annotations})
+    return TreeSample(
+        taxa=list(taxa),
+        states=np.array(list(states), dtype=np.int64),
+        node_offsets=np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64),
+        parent=np.concatenate([tree.parent for tree in trees]).astype(np.int32),
+        taxon=np.concatenate([tree.taxon for tree in trees]).astype(np.int32),
+        length=np.concatenate([tree.length for tree in trees]),
+        height=np.concatenate([node_heights(tree) for tree in trees]),
+        annotations={
+            key: np.concatenate([tree.annotations.get(key, np.full(size, np.nan)) for tree, size in zip(trees, sizes)])
+            for key in keys
+        },
+    )
+
+
+def write_tree_sample(sample: TreeSample, output: Path) -> None:
+    """Write a tree sample to a compressed NumPy `.npz` file."""
+    arrays = {
+        "taxa": np.array(sample.taxa, dtype=str),
+        "states": sample.states,
+        "node_offsets": sample.node_offsets,
+        "parent": sample.parent,
+        "taxon": sample.taxon,
+        "length": sample.length,
+        "height": sample.height,
+        **{f"{ANNOTATION_PREFIX}{key}": values for key, values in sample.annotations.items()},
+    }
+    with open(output, "wb") as handle:
+        np.savez_compressed(handle, **arrays)
+
+
+def read_tree_sample(path: Path) -> TreeSample:
+    """Read a tree sample written by `write_tree_sample`."""
+    with np.load(path) as data:
+        return TreeSample(
+            taxa=data["taxa"].tolist(),
+            states=data["states"],
+            node_offsets=data["node_offsets"],
+            parent=data["parent"],
+            taxon=data["taxon"],
+            length=data["length"],
+            height=data["height"],
+            annotations={
+                name[len(ANNOTATION_PREFIX) :]: data[name] for name in data.files if name.startswith(ANNOTATION_PREFIX)
+            },
+        )
+
+
+def read_tree_sample_taxa(path: Path) -> Tuple[List[str], int]:
+    """Return the taxon table and number of trees of a tree sample without loading the node arrays."""
+    with np.load(path) as data:
+        return data["taxa"].tolist(), len(data["states"])
+
+
+def split_tree_sample(n_trees: int, n_chunks: int, first_tree: int = 0) -> List[TreeChunk]:
+    """
+    Splits the trees of a sample from `first_tree` onwards into contiguous chunks.
+
+    The chunks are `TreeChunk`s over tree indices rather than byte offsets, so the same worker
+    code can be given either kind of chunk.
+
+    Examples:
+      >>> split_tree_sample(5, 2, first_tree=1)
+      [TreeChunk(first_tree=1, start=1, end=3, body=None), TreeChunk(first_tree=3, start=3, end=5, body=None)]
+    """
+    return split_tree_offsets(list(range(first_tree, n_trees)), n_trees, n_chunks, first_tree=first_tree)
+
+
+def format_newick(tree: TreeArrays, labels: List[str]) -> str:
+    """
+    Formats a tree as a BEAST-style newick string with `[&key=value]` node annotations.
+
+    Args:
+      tree (TreeArrays): The tree to format.
+      labels (List[str]): The tip label of each taxon index, e.g. the translate keys.
+
+    Returns:
+      str: The newick string, terminated by `;`.
+    """
+    parents = tree.parent.tolist()
+    children: List[List[int]] = [[] for _ in parents]
+    for node, parent in enumerate(parents):
+        if parent >= 0:
+            children[parent].append(node)
+
+    formatted: List[str] = [""] * len(parents)
+    for node in range(len(parents)):
+        if children[node]:
+            label = "(" + ",".join(formatted[child] for child in children[node]) + ")"
+        else:
+            label = labels[int(tree.taxon[node])]
+        annotations = [
+            f"{key}={float(values[node])!r}" for key, values in tree.annotations.items() if not np.isnan(values[node])
+        ]
+        if annotations:
+            label += f"[&{','.join(annotations)}]"
+        if not np.isnan(tree.length[node]):
+            label += f":{float(tree.length[node])!r}"
+        formatted[node] = label
+    return f"{formatted[-1]};"
+
+
+def write_nexus_trees(sample: TreeSample, output: Path, selection: Optional[Iterable[int]] = None) -> int:
+    """
+    Exports trees of a sample as a BEAST-style NEXUS trees file, e.g. for R tooling.
+
+    Args:
+      sample (TreeSample): The tree sample.
+      output (Path): The output NEXUS path.
+      selection (Iterable[int], optional): The trees to export. Defaults to all trees.
+
+    Returns:
+      int: The number of trees written.
+    """
+    selection = range(len(sample)) if selection is None else selection
+    keys = [str(i + 1) for i in range(len(sample.taxa))]
+    taxlabels = "".join(f"\t\t{quote(label)}\n" for label in sample.taxa)
+    translate = ",\n".join(f"\t\t{key} {quote(label)}" for key, label in zip(keys, sample.taxa))
+    count = 0
+    with open(output, "w") as handle:
+        handle.write("#NEXUS\n\n")
+        handle.write(f"Begin taxa;\n\tDimensions ntax={len(sample.taxa)};\n\tTaxlabels\n{taxlabels}\t\t;\nEnd;\n\n")
+        handle.write(f"Begin trees;\n\tTranslate\n{translate}\n\t\t;\n")
+        for tree_index in selection:
+            newick = format_newick(sample.tree(tree_index), keys)
+            handle.write(f"tree STATE_{int(sample.states[tree_index])} = [&R] {newick}\n")
+            count += 1
+        handle.write("End;\n")
+    return count
+
+
+_worker_state = {}
+
+
+def _init_worker(trees_path, translate):
+    _worker_state.update(trees_path=trees_path, translate=translate)
+
+
+def parse_chunk(chunk: TreeChunk) -> List[TreeArrays]:
+    """Parse the trees in a chunk. Runs in a worker process initialised with `_init_worker`."""
+    return list(yield_chunk_arrays(_worker_state["trees_path"], _worker_state["translate"], chunk))
+
+
+@app.command()
+def convert(
+    trees_path: Path = typer.Argument(..., help="BEAST trees file to convert"),
+    output: Path = typer.Argument(..., help="Output tree sample (.npz)"),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="Number of worker processes used to parse trees"),
+):
+    """
+    Converts a BEAST trees file into a binary tree sample.
+
+    The trees file is parsed once and every tree consumer (`phylo_rate_quantile_analysis.py`,
+    `mcc_tree.py`) can then read the sample instead of re-parsing the NEXUS text.
+
+    Examples:
+      >>> convert(Path('run.trees'), Path('run.trees.npz'), jobs=4)
+    """
+    index = load_tree_index(trees_path)
+    translate = read_translate(trees_path, index)
+    taxa = [label for _, label in translate_entries(translate)]
+    n_chunks = chunk_count(index.trees_end - index.header_length, jobs)
+    chunks = split_tree_offsets(index.offsets, index.trees_end, n_chunks)
+    with Pool(jobs, initializer=_init_worker, initargs=(trees_path, parse_translate(translate))) as pool:
+        chunk_trees = map_chunks(pool, parse_chunk, trees_path, chunks, jobs)
+        trees = [tree for trees_in_chunk in chunk_trees for tree in trees_in_chunk]
+    write_tree_sample(build_tree_sample(trees, taxa, index.states), output)
+    typer.echo(f"Wrote {len(trees)} trees to {output} ({output.stat().st_size} of {trees_path.stat().st_size} bytes)")
+
+
+@app.command()
+def export(
+    sample_path: Path = typer.Argument(..., help="Tree sample (.npz) to export"),
+    output: Path = typer.Argument(..., help="Output NEXUS trees file"),
+    burnin: float = typer.Option(0.0, help="Fraction of trees to discard as burn-in"),
+    every: int = typer.Option(1, min=1, help="Keep every k-th tree after the burn-in"),
+    max_trees: Optional[int] = typer.Option(None, min=1, help="Thin evenly so at most this many trees remain"),
+):
+    """
+    Exports a binary tree sample as a NEXUS trees file, e.g. for `densitree.R`.
+
+    Examples:
+      >>> export(Path('run.trees.npz'), Path('run.thinned.trees'), burnin=0.1, every=1, max_trees=1000)
+    """
+    sample = read_tree_sample(sample_path)
+    selection = select_trees(len(sample), int(len(sample) * burnin), every, max_trees)
+    count = write_nexus_trees(sample, output, selection)
+    typer.echo(f"Wrote {count} of {len(sample)} trees to {output}")
+
+
+if __name__ == "__main__":
+    app()
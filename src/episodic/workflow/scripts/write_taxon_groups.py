@@ -1,9 +1,19 @@
 import csv
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional
 
+import numpy as np
 import typer
 
+try:
+    from episodic.workflow.scripts.compression import open_text, strip_compression_suffix
+except ModuleNotFoundError:
+    from compression import open_text, strip_compression_suffix
+
+REGISTRY_SUFFIX = ".npz"
+
 
 def read_fasta_headers(alignment_path: Path) -> List[str]:
     """Return FASTA headers without the leading '>' character."""
@@ -15,19 +25,85 @@ def read_fasta_headers(alignment_path: Path) -> List[str]:
     return headers
 
 
+def read_taxon_ids(alignment_path: Path) -> List[str]:
+    """Return the taxon ids of an alignment FASTA or of a pre-parsed alignment sidecar (.npz)."""
+    if alignment_path.suffix == ".npz":
+        with np.load(alignment_path) as data:
+            return data["taxa"].tolist()
+    return read_fasta_headers(alignment_path)
+
+
+class GroupMatcher:
+    """
+    Finds the longest configured group contained in taxon labels.
+
+    The groups are compiled once into an Aho-Corasick automaton, so each label is assigned in a
+    single scan however many groups there are. Ties between equally long groups go to the group
+    configured first.
+
+    Examples:
+      >>> GroupMatcher(["B.1", "B.1.1.7"]).assign("sample@B.1.1.7@2021.1")
+      'B.1.1.7'
+    """
+
+    def __init__(self, groups: Iterable[str]):
+        self.groups = [group for group in dict.fromkeys(groups) if group]
+        # rank 0 is the preferred group: the longest, then the first configured
+        self._ranked = sorted(self.groups, key=len, reverse=True)
+        rank = {group: index for index, group in enumerate(self._ranked)}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._best: List[Optional[int]] = [None]
+        for group in self.groups:
+            state = 0
+            for char in group:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._best.append(None)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._best[state] = rank[group]
+
+        # breadth-first, so the failure state of every node is complete before its children's
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # a group ending here is longer than any group ending at its failure state
+                if self._best[child] is None:
+                    self._best[child] = self._best[self._fail[child]]
+                queue.append(child)
+
+    def assign(self, taxon: str) -> str:
+        """Return the longest configured group in a taxon label, or an empty string."""
+        goto, fail, best = self._goto, self._fail, self._best
+        state = 0
+        match = None
+        for char in taxon:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            rank = best[state]
+            if rank is not None and (match is None or rank < match):
+                match = rank
+        return "" if match is None else self._ranked[match]
+
+
 def assign_group(taxon: str, groups: Iterable[str]) -> str:
-    """Assign the longest matching configured group to a taxon label."""
-    matches = [group for group in groups if group in taxon]
-    if not matches:
-        return ""
-    return max(matches, key=len)
+    """Assign the longest matching configured group to a taxon label, see `GroupMatcher`."""
+    return GroupMatcher(groups).assign(taxon)
 
 
 def build_group_members(taxa: Iterable[str], groups: Iterable[str]) -> Dict[str, List[str]]:
     """Map each configured group to the taxa assigned to it."""
     group_members: Dict[str, List[str]] = {group: [] for group in groups}
+    matcher = GroupMatcher(group_members)
     for taxon in taxa:
-        group = assign_group(taxon, groups)
+        group = matcher.assign(taxon)
         if group:
             group_members[group].append(taxon)
     return group_members
@@ -49,26 +125,348 @@ def read_group_members(groups_path: Path) -> Dict[str, List[str]]:
     return group_members
 
 
-def write_taxon_groups(alignment_path: Path, output_path: Path, groups: List[str]) -> None:
-    """Write a TSV mapping taxa to configured groups."""
-    headers = read_fasta_headers(alignment_path)
-    group_members = build_group_members(headers, groups)
-    assigned_groups = {taxon: group for group, taxa in group_members.items() for taxon in taxa}
+@dataclass(eq=False)
+class TaxonRegistry:
+    """
+    An indexed table of taxa and the groups they belong to.
+
+    Group membership is stored as taxon indices, with the members of group `i` at
+    `members[member_offsets[i]:member_offsets[i + 1]]`, and taxa are looked up by id through a
+    hash index built once when the registry is created.
+
+    Attributes:
+      taxa (List[str]): The taxon ids.
+      groups (List[str]): The group labels.
+      member_offsets (np.ndarray): The first member of each group, plus the total number of members.
+      members (np.ndarray): The taxon index of each group member.
+    """
+
+    taxa: List[str]
+    groups: List[str]
+    member_offsets: np.ndarray
+    members: np.ndarray
+    index: Dict[str, int] = field(init=False, repr=False)
+    group_index: Dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.index = {taxon: index for index, taxon in enumerate(self.taxa)}
+        self.group_index = {group: index for index, group in enumerate(self.groups)}
+
+    def __len__(self) -> int:
+        return len(self.taxa)
+
+    def __contains__(self, taxon: str) -> bool:
+        return taxon in self.index
+
+    def member_indices(self, group: str) -> np.ndarray:
+        """Return the taxon indices of the members of a group."""
+        group_index = self.group_index[group]
+        return self.members[int(self.member_offsets[group_index]) : int(self.member_offsets[group_index + 1])]
+
+    def group_members(self) -> Dict[str, List[str]]:
+        """
+        Map each group to its member taxa, as `read_group_members` does.
+
+        Examples:
+          >>> build_taxon_registry(["a1", "b1", "a2"], {"A": ["a1", "a2"], "B": ["b1"]}).group_members()
+          {'A': ['a1', 'a2'], 'B': ['b1']}
+        """
+        taxa = self.taxa
+        members = self.members.tolist()
+        offsets = self.member_offsets.tolist()
+        return {
+            group: [taxa[member] for member in members[start:end]]
+            for group, start, end in zip(self.groups, offsets, offsets[1:])
+        }
+
+
+def build_taxon_registry(taxa: Iterable[str], group_members: Dict[str, List[str]]) -> TaxonRegistry:
+    """
+    Builds a taxon registry from the taxa of an analysis and the members of each group.
+
+    Group members that are not in `taxa` are added to the end of the taxon table.
+    """
+    taxa = list(dict.fromkeys(taxa))
+    index = {taxon: position for position, taxon in enumerate(taxa)}
+    members = []
+    for group_taxa in group_members.values():
+        for taxon in group_taxa:
+            if taxon not in index:
+                index[taxon] = len(taxa)
+                taxa.append(taxon)
+            members.append(index[taxon])
+    sizes = [len(group_taxa) for group_taxa in group_members.values()]
+    return TaxonRegistry(
+        taxa=taxa,
+        groups=list(group_members),
+        member_offsets=np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64),
+        members=np.array(members, dtype=np.int32),
+    )
+
+
+def write_taxon_registry(registry: TaxonRegistry, output: Path) -> None:
+    """Write a taxon registry to a compressed NumPy `.npz` file."""
+    with open(output, "wb") as handle:
+        np.savez_compressed(
+            handle,
+            taxa=np.array(registry.taxa, dtype=str),
+            groups=np.array(registry.groups, dtype=str),
+            member_offsets=registry.member_offsets,
+            members=registry.members,
+        )
+
+
+def read_taxon_registry(path: Path) -> TaxonRegistry:
+    """Read a taxon registry written by `write_taxon_registry`."""
+    with np.load(path) as data:
+        return TaxonRegistry(
+            taxa=data["taxa"].tolist(),
+            groups=data["groups"].tolist(),
+            member_offsets=data["member_offsets"],
+            members=data["members"],
+        )
+
+
+def load_taxon_registry(groups_path: Path) -> TaxonRegistry:
+    """Load a taxon registry (.npz), or build one from a TSV mapping taxa to groups."""
+    groups_path = Path(groups_path)
+    if groups_path.suffix == REGISTRY_SUFFIX:
+        return read_taxon_registry(groups_path)
+    with groups_path.open(newline="") as handle:
+        taxa = [row["taxon"].strip() for row in csv.DictReader(handle, delimiter="\t")]
+    return build_taxon_registry(taxa, read_group_members(groups_path))
+
+
+def read_lineage_aliases(aliases_path: Path) -> Dict[str, str]:
+    """
+    Read a precomputed lineage lookup table, e.g. Pango aliases, as a mapping of alias to lineage.
+
+    The table is a TSV (or CSV) with a header row whose first two columns are the alias and the
+    lineage it stands for. Rows with an empty lineage are ignored.
+    """
+    delimiter = "," if strip_compression_suffix(Path(aliases_path)).suffix == ".csv" else "\t"
+    aliases: Dict[str, str] = {}
+    with open_text(aliases_path) as handle:
+        reader = csv.reader(handle, delimiter=delimiter)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 2 and row[0].strip() and row[1].strip():
+                aliases[row[0].strip()] = row[1].strip()
+    return aliases
+
+
+def expand_lineage(lineage: str, aliases: Dict[str, str]) -> str:
+    """
+    Expands a lineage whose name, or first component, is an alias.
+
+    Examples:
+      >>> expand_lineage("Q.1", {"Q": "B.1.1.7"})
+      'B.1.1.7.1'
+    """
+    if lineage in aliases:
+        return aliases[lineage]
+    prefix, dot, rest = lineage.partition(".")
+    if prefix in aliases:
+        return aliases[prefix] + dot + rest
+    return lineage
+
+
+class LineageCollapser:
+    """
+    Collapses lineages onto the configured groups they descend from.
+
+    Lineages and groups are expanded through the alias table, and each lineage is assigned the
+    configured group that is the lineage itself or its closest parent (`B.1.1.7.1` → `B.1.1.7`).
+    Without configured groups every lineage is its own (expanded) group. Each distinct lineage is
+    only resolved once.
+
+    Examples:
+      >>> LineageCollapser(["B.1.1.7", "B.1"], {"Q": "B.1.1.7"}).collapse("Q.1")
+      'B.1.1.7'
+    """
+
+    def __init__(self, groups: Iterable[str], aliases: Optional[Dict[str, str]] = None):
+        self.aliases = aliases or {}
+        self.groups = {expand_lineage(group, self.aliases): group for group in groups if group}
+        self._cache: Dict[str, str] = {}
+
+    def collapse(self, lineage: str) -> str:
+        """Return the configured group of a lineage, or an empty string."""
+        if lineage not in self._cache:
+            expanded = expand_lineage(lineage, self.aliases) if lineage else ""
+            group = expanded if not self.groups else ""
+            while self.groups and expanded:
+                if expanded in self.groups:
+                    group = self.groups[expanded]
+                    break
+                expanded = expanded.rpartition(".")[0]
+            self._cache[lineage] = group
+        return self._cache[lineage]
+
+
+def header_id(header: str, delimiter: str = "|", index: Optional[int] = 0) -> str:
+    """
+    Return the field of a header that identifies the taxon in a metadata table.
+
+    Examples:
+      >>> header_id("EPI_ISL_1@B.1.1.7@2021.1", delimiter="@", index=0)
+      'EPI_ISL_1'
+    """
+    if index is None:
+        return header
+    return header.split(delimiter)[index]
+
+
+def assign_metadata_groups(
+    headers: List[str],
+    metadata_path: Path,
+    groups: Iterable[str],
+    id_column: str = "strain",
+    group_column: str = "lineage",
+    header_delimiter: str = "|",
+    id_index: Optional[int] = 0,
+    aliases: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
+    """
+    Assigns taxa to groups from a metadata table.
+
+    The headers are hashed by id and the metadata is streamed row by row and joined against
+    them, so only the alignment taxa are held in memory however large the table is. The group
+    column is collapsed onto the configured groups, see `LineageCollapser`.
+
+    Args:
+      headers (List[str]): The alignment headers.
+      metadata_path (Path): A TSV or CSV metadata table, optionally gzip or zstd compressed.
+      groups (Iterable[str]): The configured groups.
+      id_column (str): The metadata column holding the taxon id.
+      group_column (str): The metadata column holding the lineage.
+      header_delimiter (str): The delimiter of the header fields.
+      id_index (int, optional): The header field holding the taxon id, or None for the whole header.
+      aliases (Dict[str, str], optional): Lineage aliases, see `read_lineage_aliases`.
+
+    Returns:
+      Dict[str, str]: The group of every assigned header.
+
+    Raises:
+      ValueError: If the metadata table does not have the id and group columns.
+    """
+    headers_by_id: Dict[str, List[str]] = {}
+    for header in headers:
+        headers_by_id.setdefault(header_id(header, header_delimiter, id_index), []).append(header)
+
+    collapser = LineageCollapser(groups, aliases)
+    assigned_groups: Dict[str, str] = {}
+    delimiter = "," if strip_compression_suffix(Path(metadata_path)).suffix == ".csv" else "\t"
+    with open_text(metadata_path) as handle:
+        reader = csv.reader(handle, delimiter=delimiter)
+        columns = next(reader, [])
+        missing = [column for column in (id_column, group_column) if column not in columns]
+        if missing:
+            msg = f"Metadata table '{metadata_path}' has no column {', '.join(repr(column) for column in missing)}."
+            raise ValueError(msg)
+        id_position, group_position = columns.index(id_column), columns.index(group_column)
+        for row in reader:
+            matches = headers_by_id.pop(row[id_position], None) if len(row) > id_position else None
+            if matches is None:
+                continue
+            group = collapser.collapse(row[group_position].strip() if len(row) > group_position else "")
+            if group:
+                assigned_groups.update(dict.fromkeys(matches, group))
+            if not headers_by_id:
+                break
+    return assigned_groups
+
+
+def write_taxon_groups(
+    alignment_path: Path,
+    output_path: Path,
+    groups: List[str],
+    registry_path: Optional[Path] = None,
+    metadata_path: Optional[Path] = None,
+    **metadata_options,
+) -> None:
+    """
+    Write a TSV mapping taxa to configured groups, and optionally the matching taxon registry.
+
+    Taxa are assigned by matching the groups in their headers, or from a metadata table when
+    `metadata_path` is given (see `assign_metadata_groups` for the `metadata_options`).
+    """
+    headers = read_taxon_ids(alignment_path)
+    if metadata_path is not None:
+        assigned_groups = assign_metadata_groups(headers, metadata_path, groups, **metadata_options)
+    else:
+        group_members = build_group_members(headers, groups)
+        assigned_groups = {taxon: group for group, taxa in group_members.items() for taxon in taxa}
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # the groups in the order `read_group_members` reads them back from the TSV
+    written_members: Dict[str, List[str]] = {}
     with output_path.open("w") as handle:
         handle.write("taxon\tgroup\n")
         for taxon in headers:
-            handle.write(f"{taxon}\t{assigned_groups.get(taxon, '')}\n")
+            group = assigned_groups.get(taxon, "")
+            handle.write(f"{taxon}\t{group}\n")
+            if group:
+                written_members.setdefault(group, []).append(taxon)
+
+    if registry_path is not None:
+        write_taxon_registry(build_taxon_registry(headers, written_members), registry_path)
 
 
 def main(
-    alignment_path: Path = typer.Argument(..., help="Alignment FASTA used in the analysis."),
+    alignment_path: Path = typer.Argument(..., help="Alignment FASTA or alignment sidecar used in the analysis."),
     output_path: Path = typer.Argument(..., help="Output TSV path for taxon group assignments."),
     groups: Optional[List[str]] = typer.Option(None, "--group", help="Configured group labels."),
+    registry_path: Optional[Path] = typer.Option(None, "--registry", help="Also write a taxon registry (.npz)."),
+    metadata_path: Optional[Path] = typer.Option(
+        None, "--metadata", help="Assign groups from this metadata table (TSV or CSV) instead of the headers."
+    ),
+    id_column: str = typer.Option("strain", help="Metadata column holding the taxon id."),
+    group_column: str = typer.Option("lineage", help="Metadata column holding the lineage."),
+    header_delimiter: str = typer.Option("|", help="Delimiter of the header fields."),
+    id_index: int = typer.Option(0, help="Index of the header field holding the metadata id. 0-based."),
+    full_header_id: bool = typer.Option(
+        False, "--full-header-id", help="Match the whole header against the id column."
+    ),
+    aliases_path: Optional[Path] = typer.Option(
+        None, "--lineage-aliases", help="TSV (alias, lineage) used to expand lineages before collapsing."
+    ),
 ) -> None:
-    """Create a taxon-to-group mapping file for downstream tree annotation."""
-    write_taxon_groups(alignment_path=alignment_path, output_path=output_path, groups=groups or [])
+    """
+    Create a taxon-to-group mapping file for downstream tree annotation.
+
+    Examples:
+      >>> main(
+      ...     Path('alignment.npz'),
+      ...     Path('taxon_groups.tsv'),
+      ...     ['B.1.1.7'],
+      ...     None,
+      ...     Path('metadata.tsv.gz'),
+      ...     'strain',
+      ...     'pango_lineage',
+      ...     '@',
+      ...     0,
+      ...     False,
+      ...     Path('aliases.tsv'),
+      ... )
+    """
+    metadata_options = {}
+    if metadata_path is not None:
+        metadata_options = {
+            "id_column": id_column,
+            "group_column": group_column,
+            "header_delimiter": header_delimiter,
+            "id_index": None if full_header_id else id_index,
+            "aliases": read_lineage_aliases(aliases_path) if aliases_path is not None else None,
+        }
+    write_taxon_groups(
+        alignment_path=alignment_path,
+        output_path=output_path,
+        groups=groups or [],
+        registry_path=registry_path,
+        metadata_path=metadata_path,
+        **metadata_options,
+    )
 
 
 if __name__ == "__main__":
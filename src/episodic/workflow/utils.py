@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Sequence
 
 
 def decimal_year_to_date(decimal_year):
@@ -46,3 +48,66 @@ def date_to_decimal_year(date_str):
     days_passed = (date - start_of_year).days
     decimal_year = year + days_passed / days_in_year
     return decimal_year
+
+
+@lru_cache(maxsize=None)
+def parse_decimal_year(date_str):
+    """
+    Parses a date that is either a decimal year or in the format '%Y-%m-%d', caching repeated dates.
+
+    Args:
+      date_str (str): The date to parse.
+
+    Returns:
+      float: The decimal year.
+
+    Examples:
+      >>> parse_decimal_year('2020.5')
+      2020.5
+      >>> parse_decimal_year('2020-07-02')
+      2020.5
+    """
+    try:
+        return float(date_str)
+    except ValueError:
+        return date_to_decimal_year(date_str)
+
+
+def dates_to_decimal_years(date_strs: Sequence[str]) -> List[float]:
+    """
+    Converts many dates to decimal years, parsing each distinct date once.
+
+    Distinct '%Y-%m-%d' dates are converted together with NumPy datetime arithmetic when NumPy is
+    available, which gives the same values as `date_to_decimal_year`. Anything else, such as
+    decimal years or dates without zero padding, goes through `parse_decimal_year`.
+
+    Args:
+      date_strs (Sequence[str]): The dates to convert.
+
+    Returns:
+      List[float]: The decimal year of each date, in order.
+
+    Examples:
+      >>> dates_to_decimal_years(['2020-07-02', '2019.25', '2020-07-02'])
+      [2020.5, 2019.25, 2020.5]
+    """
+    unique = list(dict.fromkeys(date_strs))
+    iso_dates = [date for date in unique if len(date) == 10 and date[4] == "-" and date[7] == "-"]
+    decimal_years = {}
+    try:
+        import numpy as np
+
+        days = np.array(iso_dates, dtype="datetime64[D]")
+    except (ImportError, ValueError):
+        iso_dates = []
+    if iso_dates:
+        years = days.astype("datetime64[Y]")
+        start_of_year = years.astype("datetime64[D]")
+        days_in_year = ((years + 1).astype("datetime64[D]") - start_of_year).astype(int)
+        days_passed = (days - start_of_year).astype(int)
+        values = years.astype(int) + 1970 + days_passed / days_in_year
+        decimal_years.update(zip(iso_dates, values.tolist()))
+    for date in unique:
+        if date not in decimal_years:
+            decimal_years[date] = parse_decimal_year(date)
+    return [decimal_years[date] for date in date_strs]
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import numpy as np
+
+from episodic.workflow.scripts.alignment_sidecar import (
+    build_alignment_sidecar,
+    compress_site_patterns,
+    load_alignment_summary,
+    read_alignment_sidecar,
+    write_alignment_sidecar,
+)
+from episodic.workflow.scripts.populate_beast_template import (
+    build_partitions,
+    partitions_from_sidecar,
+    scan_fasta_headers,
+    taxa_from_fasta,
+)
+
+ALIGNMENTS = [Path("tests/data/HA1.fasta"), Path("tests/data/HA2.fasta")]
+
+
+def test_sidecar_matches_parsed_partitions(tmp_path):
+    sidecar_path = tmp_path / "alignment.npz"
+    write_alignment_sidecar(build_alignment_sidecar(ALIGNMENTS, date_delimiter="@"), sidecar_path)
+
+    sidecar = read_alignment_sidecar(sidecar_path)
+    assert sidecar.sequences.dtype == np.uint8
+    assert sidecar.sequences.shape == (len(sidecar.taxa), int(sidecar.site_offsets[-1]))
+    assert len(sidecar.site_offsets) == len(ALIGNMENTS) + 1
+
+    expected = build_partitions(ALIGNMENTS, date_delimiter="@", date_index=-1, foreground_label="fg")
+    assert partitions_from_sidecar(sidecar_path, foreground_label="fg") == expected
+
+
+def test_compress_site_patterns_counts_constant_sites():
+    _, sequences = taxa_from_fasta(Path("tests/data/BA.2.86.afa"), date_delimiter="@", as_array=True)
+
+    variable, counts = compress_site_patterns(sequences)
+
+    assert variable.shape[0] == sequences.shape[0]
+    assert variable.shape[1] + sum(counts) == sequences.shape[1]
+    assert all((column != column[0]).any() or chr(column[0]) not in "ACGT" for column in variable.T)
+    # every constant site is counted under its nucleotide
+    constant = sequences[:, (sequences == sequences[0]).all(axis=0)]
+    assert counts == [int((constant[0] == ord(base)).sum()) for base in "ACGT"]
+
+
+def test_load_alignment_summary_scans_headers_and_caches(tmp_path):
+    alignment = tmp_path / "HA1.fasta"
+    alignment.write_text(ALIGNMENTS[0].read_text())
+    cache_path = tmp_path / "alignment.summary.json"
+    taxa = taxa_from_fasta(alignment, date_delimiter="@")
+
+    for buffer_size in (1, 7, 4096):
+        assert list(scan_fasta_headers(alignment, buffer_size)) == [taxon.id for taxon in taxa]
+
+    summary = load_alignment_summary(cache_path, alignment, date_delimiter="@")
+    assert summary == (len(taxa), min(taxon.date for taxon in taxa), max(taxon.date for taxon in taxa))
+    assert cache_path.exists()
+
+    alignment.write_text(ALIGNMENTS[0].read_text() + ">new@2030\nACGT\n")
+    updated = load_alignment_summary(cache_path, alignment, date_delimiter="@")
+    assert updated == (len(taxa) + 1, summary.min_date, 2030.0)
@@ -0,0 +1,43 @@
+import os
+
+from episodic.workflow.scripts.beast_checkpoint import beast_checkpoint_args, checkpoint_state
+from episodic.workflow.scripts.beast_trees import build_tree_index
+
+
+def write_run(tmp_path, states):
+    xml = tmp_path / "run" / "run.xml"
+    xml.parent.mkdir()
+    xml.write_text("<beast/>\n")
+    log = xml.parent / "beast.log"
+    log.write_text("state\tposterior\n" + "".join(f"{state}\t-1.5\n" for state in states) + "130")
+    lines = open("tests/data/flc.trees").read().splitlines(keepends=True)
+    trees = [line for line in lines if line.startswith("tree STATE_")]
+    trees_path = xml.parent / "beast.trees"
+    trees_path.write_text("".join(lines[: lines.index(trees[0])] + trees[: len(states)]))
+    return xml, log, trees_path
+
+
+def test_beast_checkpoint_args_resume_and_rewind_outputs(tmp_path):
+    xml, log, trees = write_run(tmp_path, range(0, 13000, 1000))
+    checkpoint = tmp_path / "run.checkpoint"
+    checkpoint.write_text("state\t10000\nlnL\t-1.5\n")
+
+    args = beast_checkpoint_args(checkpoint, xml, [log, trees], 5000)
+
+    assert args == ["-load_state", str(checkpoint), "-save_every", "5000", "-save_state", str(checkpoint)]
+    assert log.read_text().splitlines()[-1] == "9000\t-1.5"
+    assert build_tree_index(trees).states.tolist() == list(range(0, 10000, 1000))
+
+
+def test_beast_checkpoint_args_ignore_stale_and_partial_checkpoints(tmp_path):
+    xml, log, trees = write_run(tmp_path, range(0, 13000, 1000))
+    checkpoint = tmp_path / "run.checkpoint"
+    checkpoint.write_text("sta")
+    assert checkpoint_state(checkpoint) is None
+    assert beast_checkpoint_args(checkpoint, xml, [log, trees], 5000)[0] == "-overwrite"
+    assert not checkpoint.exists()
+
+    checkpoint.write_text("state\t10000\n")
+    os.utime(checkpoint, ns=(0, 0))
+    assert beast_checkpoint_args(checkpoint, xml, [log, trees], 5000)[0] == "-overwrite"
+    assert log.read_text().endswith("130")
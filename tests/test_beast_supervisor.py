@@ -0,0 +1,85 @@
+import numpy as np
+
+from episodic.workflow.scripts.beast_supervisor import (
+    TraceLog,
+    assess_convergence,
+    effective_sample_size,
+    finalize_outputs,
+    split_rhat,
+)
+from episodic.workflow.scripts.beast_trees import build_tree_index
+
+COLUMNS = ["state", "posterior", "likelihood", "BA.2.86.stem.rate"]
+
+
+def write_trace(path, values, log_every=1000):
+    with open(path, "w") as handle:
+        handle.write("# BEAST v10.5.0\n")
+        handle.write("\t".join(COLUMNS) + "\n")
+        for sample, row in enumerate(values):
+            handle.write("\t".join([str(sample * log_every), *(f"{value:.6f}" for value in row)]) + "\n")
+
+
+def test_trace_log_reads_complete_lines_incrementally(tmp_path):
+    path = tmp_path / "beast.log"
+    trace = TraceLog(path)
+    assert trace.update() == 0
+
+    path.write_text("# BEAST v10.5.0\nstate\tposterior\n0\t-10.5\n1000\t-9")
+    assert trace.update() == 1
+    assert trace.columns == ["state", "posterior"]
+
+    with open(path, "a") as handle:
+        handle.write(".5\n2000\t-8.5\n")
+    assert trace.update() == 2
+    assert trace.values.tolist() == [[0, -10.5], [1000, -9.5], [2000, -8.5]]
+
+
+def test_effective_sample_size_and_rhat_detect_autocorrelation_and_drift():
+    rng = np.random.default_rng(1)
+    independent = rng.normal(size=(2000, 1))
+    # an AR(1) chain with phi = 0.9 has an ESS of about n * (1 - phi) / (1 + phi)
+    correlated = np.zeros((2000, 1))
+    for sample in range(1, 2000):
+        correlated[sample] = 0.9 * correlated[sample - 1] + rng.normal()
+
+    assert effective_sample_size(independent)[0] > 1500
+    assert 50 < effective_sample_size(correlated)[0] < 200
+    assert split_rhat([independent, rng.normal(size=(2000, 1))])[0] < 1.01
+    assert split_rhat([independent, rng.normal(loc=1.0, size=(2000, 1))])[0] > 1.1
+
+
+def test_assess_convergence_uses_ess_and_rhat_across_duplicates(tmp_path):
+    rng = np.random.default_rng(2)
+    write_trace(tmp_path / "run_1.log", rng.normal(size=(1000, 3)))
+    write_trace(tmp_path / "run_2.log", rng.normal(size=(1000, 3)))
+    write_trace(tmp_path / "run_3.log", rng.normal(loc=3.0, size=(1000, 3)))
+    trace, mixed, stuck = (TraceLog(tmp_path / f"run_{run}.log") for run in (1, 2, 3))
+    for log in (trace, mixed, stuck):
+        log.update()
+
+    converged = assess_convergence(trace, [mixed], min_ess=200)
+    assert converged.converged
+    assert converged.samples == 900
+    assert converged.chains == 2
+    assert not assess_convergence(trace, [mixed], min_ess=5000).converged
+    assert not assess_convergence(trace, [stuck], min_ess=200).converged
+
+
+def test_finalize_outputs_cuts_log_and_trees_to_last_common_state(tmp_path):
+    log_path = tmp_path / "beast.log"
+    trees_path = tmp_path / "beast.trees"
+    write_trace(log_path, np.zeros((12, 3)))
+    with open(log_path, "a") as handle:
+        handle.write("12000\t-1")
+    # the stopped run wrote trees up to STATE_10000 plus part of STATE_11000
+    lines = open("tests/data/flc.trees").read().splitlines(keepends=True)
+    trees = [line for line in lines if line.startswith("tree STATE_")]
+    header = lines[: lines.index(trees[0])]
+    trees_path.write_text("".join(header + trees[:11]) + trees[11][:40])
+
+    assert finalize_outputs(log_path, trees_path) == 10000
+
+    assert log_path.read_text().splitlines()[-1].startswith("10000\t")
+    assert trees_path.read_text().endswith("End;\n")
+    assert build_tree_index(trees_path).states.tolist() == list(range(0, 11000, 1000))
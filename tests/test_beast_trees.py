@@ -0,0 +1,121 @@
+import os
+import shutil
+from pathlib import Path
+
+import dendropy
+
+from episodic.workflow.scripts.beast_trees import (
+    build_tree_index,
+    load_tree_index,
+    parse_translate,
+    read_header,
+    read_translate,
+    read_tree_lines,
+    select_trees,
+    split_tree_offsets,
+    tree_index_path,
+    write_trees_subset,
+    yield_chunk_trees,
+)
+
+TREES_PATH = Path("tests/data/flc.trees")
+
+
+def test_build_tree_index_finds_every_tree():
+    index = build_tree_index(TREES_PATH)
+
+    data = TREES_PATH.read_bytes()
+    assert len(index) == 20
+    assert index.states.tolist() == [state * 1000 for state in range(20)]
+    assert index.header_length == index.offsets[0]
+    assert all(data[offset:].startswith(b"tree STATE_") for offset in index.offsets)
+    ends = index.offsets + index.lengths
+    assert all(data[end - 1 : end] == b"\n" for end in ends.tolist())
+    assert data[index.trees_end :].startswith(b"End;")
+
+
+def test_read_translate_reads_only_the_translate_block():
+    index = build_tree_index(TREES_PATH)
+
+    translate = read_translate(TREES_PATH, index)
+
+    assert translate.lstrip().startswith("Translate")
+    assert translate.endswith(";")
+    assert parse_translate(translate) == parse_translate(read_header(TREES_PATH, index.header_length))
+
+
+def test_load_tree_index_writes_sidecar_and_rebuilds_when_stale(tmp_path):
+    trees_path = tmp_path / "run.trees"
+    shutil.copy(TREES_PATH, trees_path)
+
+    index = load_tree_index(trees_path)
+    assert tree_index_path(trees_path).exists()
+    assert load_tree_index(trees_path).offsets.tolist() == index.offsets.tolist()
+
+    lines = trees_path.read_text().splitlines(keepends=True)
+    trees_path.write_text("".join(lines[:-6] + lines[-5:]))
+    os.utime(trees_path, ns=(index.mtime_ns + 1, index.mtime_ns + 1))
+
+    assert len(load_tree_index(trees_path)) == 19
+
+
+def test_load_tree_index_rebuilds_truncated_sidecar(tmp_path):
+    trees_path = tmp_path / "run.trees"
+    shutil.copy(TREES_PATH, trees_path)
+    index = load_tree_index(trees_path)
+    sidecar = tree_index_path(trees_path)
+    sidecar.write_bytes(sidecar.read_bytes()[:100])
+
+    assert load_tree_index(trees_path).offsets.tolist() == index.offsets.tolist()
+    assert load_tree_index(trees_path).offsets.tolist() == index.offsets.tolist()
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".tmp"] == []
+
+
+def test_select_trees_discards_burnin_and_thins():
+    assert select_trees(20, burnin=5, every=5).tolist() == [5, 10, 15]
+    assert select_trees(20, burnin=2, max_trees=3).tolist() == [2, 10, 19]
+    assert select_trees(3, max_trees=10).tolist() == [0, 1, 2]
+
+
+def test_read_tree_lines_seeks_to_selected_trees():
+    index = build_tree_index(TREES_PATH)
+
+    lines = list(read_tree_lines(TREES_PATH, index, [3, 4, 10]))
+
+    assert [line.split()[1] for line in lines] == ["STATE_3000", "STATE_4000", "STATE_10000"]
+
+
+def test_write_trees_subset_is_valid_nexus(tmp_path):
+    index = build_tree_index(TREES_PATH)
+    output = tmp_path / "thinned.trees"
+
+    count = write_trees_subset(TREES_PATH, index, select_trees(len(index), every=4), output)
+
+    trees = dendropy.TreeList.get(path=str(output), schema="nexus", preserve_underscores=True)
+    assert count == 5
+    assert [tree.label for tree in trees] == [f"STATE_{state * 1000}" for state in range(0, 20, 4)]
+
+
+def test_split_tree_offsets_covers_all_trees_in_order():
+    index = build_tree_index(TREES_PATH)
+    offsets = index.offsets.tolist()
+
+    chunks = split_tree_offsets(offsets[5:], index.trees_end, 4, first_tree=5)
+
+    assert [chunk.first_tree for chunk in chunks] == [5, 9, 13, 16]
+    assert chunks[0].start == offsets[5]
+    assert chunks[-1].end == index.trees_end
+    assert all(a.end == b.start for a, b in zip(chunks, chunks[1:]))
+
+
+def test_yield_chunk_trees_matches_full_parse():
+    index = build_tree_index(TREES_PATH)
+    header = read_header(TREES_PATH, index.header_length)
+
+    trees = [
+        tree
+        for chunk in split_tree_offsets(index.offsets, index.trees_end, 3)
+        for tree in yield_chunk_trees(TREES_PATH, header, chunk)
+    ]
+
+    assert [tree.label for tree in trees] == [f"STATE_{state * 1000}" for state in range(20)]
@@ -0,0 +1,50 @@
+import re
+
+import numpy as np
+
+from episodic.workflow.scripts.combine_mle import main, marginal_likelihood, read_path_samples
+
+
+def power_posterior_samples(rng, powers, samples, y=1.5):
+    """Exact samples of the log likelihood of x ~ N(0, 1), y | x ~ N(x, 1) under each power posterior."""
+    theta = np.repeat(powers, samples)
+    x = rng.normal(theta * y / (1 + theta), 1 / np.sqrt(1 + theta))
+    delta = -0.5 * np.log(2 * np.pi) - (y - x) ** 2 / 2
+    return theta, delta
+
+
+def test_marginal_likelihood_matches_analytic_value():
+    rng = np.random.default_rng(1)
+    powers = np.linspace(0, 1, 51) ** (1 / 0.3)
+    theta, delta = power_posterior_samples(rng, powers, 4000)
+    # y ~ N(0, 2)
+    expected = -0.5 * np.log(2 * np.pi * 2) - 1.5**2 / 4
+
+    estimate = marginal_likelihood(theta, delta)
+
+    assert estimate.powers == 51
+    assert abs(estimate.path_sampling - expected) < 0.02
+    assert abs(estimate.stepping_stone - expected) < 0.02
+
+
+def test_combined_chunk_logs_match_single_log(tmp_path):
+    rng = np.random.default_rng(2)
+    powers = np.linspace(1, 0, 11)
+    logs = []
+    for chunk in range(3):
+        theta, delta = power_posterior_samples(rng, powers, 20)
+        log = tmp_path / f"run_chunk_{chunk + 1}.mle.log"
+        rows = "".join(f"{state}\t{d}\t{t}\n" for state, (t, d) in enumerate(zip(theta, delta)))
+        log.write_text("state\tpathLikelihood.delta\tpathLikelihood.theta\n" + rows)
+        logs.append((log, theta, delta))
+
+    theta, delta = read_path_samples([log for log, _, _ in logs])
+    assert len(theta) == 3 * 11 * 20
+    expected = marginal_likelihood(np.concatenate([t for _, t, _ in logs]), np.concatenate([d for _, _, d in logs]))
+    assert marginal_likelihood(theta, delta) == expected
+
+    output = tmp_path / "run.stdout"
+    main([log for log, _, _ in logs], output)
+    # read as extract_mle.py does, which keeps the last (stepping-stone) estimate
+    lines = [line for line in output.read_text().splitlines() if line.startswith("log marginal likelihood")]
+    assert float(re.search(r"-?\d+\.\d+", lines[-1]).group()) == expected.stepping_stone
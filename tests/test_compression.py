@@ -0,0 +1,69 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from episodic.workflow.scripts.beast_trees import build_tree_index, read_tree_lines
+from episodic.workflow.scripts.compression import compress_file, detect_compression, open_binary, open_text
+from episodic.workflow.scripts.mcc_tree import mcc_tree
+from episodic.workflow.scripts.phylo_rate_quantile_analysis import analyze_rates
+from episodic.workflow.scripts.tree_converter import tree_converter
+
+TREES_PATH = Path("tests/data/flc.trees")
+GROUPS_PATH = Path("tests/data/flc_taxon_groups.tsv")
+
+
+@pytest.mark.parametrize("method, suffix", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_open_binary_streams_compressed_files(tmp_path, method, suffix):
+    if method == "zstd":
+        pytest.importorskip("zstandard")
+    compressed = tmp_path / f"flc.trees{suffix}"
+
+    compress_file(TREES_PATH, compressed, method)
+
+    assert detect_compression(compressed) == method
+    assert detect_compression(TREES_PATH) is None
+    with open_text(compressed) as handle:
+        assert handle.read() == TREES_PATH.read_text()
+    with open_binary(compressed) as handle:
+        handle.seek(100)
+        assert handle.read(50) == TREES_PATH.read_bytes()[100:150]
+
+
+def test_tree_index_uses_decompressed_offsets(tmp_path):
+    compressed = tmp_path / "flc.trees.gz"
+    compress_file(TREES_PATH, compressed, "gzip")
+
+    index = build_tree_index(compressed)
+
+    assert index.offsets.tolist() == build_tree_index(TREES_PATH).offsets.tolist()
+    assert [line.split()[1] for line in read_tree_lines(compressed, index, [2, 7])] == ["STATE_2000", "STATE_7000"]
+
+
+def test_tree_readers_match_uncompressed_input(tmp_path):
+    plain = tmp_path / "flc.trees"
+    compressed = tmp_path / "flc.trees.gz"
+    shutil.copy(TREES_PATH, plain)
+    compress_file(TREES_PATH, compressed, "gzip")
+
+    outputs = {}
+    for name, path in [("plain", plain), ("gzip", compressed)]:
+        csv_path = tmp_path / f"{name}.csv"
+        mcc_path = tmp_path / f"{name}.mcc.nexus"
+        analyze_rates(str(path), GROUPS_PATH, str(tmp_path / f"{name}.svg"), str(csv_path), burnin=0.1, jobs=2)
+        mcc_tree(path, ["mean"], [mcc_path], burnin_trees=2, burnin=None, jobs=2)
+        outputs[name] = (csv_path.read_text(), mcc_path.read_text())
+
+    assert outputs["plain"] == outputs["gzip"]
+
+
+def test_tree_converter_reads_compressed_nexus(tmp_path):
+    mcc_path = tmp_path / "run.mcc.nexus"
+    mcc_tree(TREES_PATH, ["mean"], [mcc_path], burnin_trees=2, burnin=None, jobs=1)
+    compressed = tmp_path / "run.mcc.nexus.gz"
+    compress_file(mcc_path, compressed, "gzip")
+
+    tree_converter(compressed, tmp_path / "gz.nwk", "", "", "posterior")
+    tree_converter(mcc_path, tmp_path / "plain.nwk", "", "", "posterior")
+
+    assert (tmp_path / "gz.nwk").read_text() == (tmp_path / "plain.nwk").read_text()
@@ -0,0 +1,78 @@
+import collections
+import math
+from pathlib import Path
+
+import dendropy
+import numpy as np
+import pytest
+
+from episodic.workflow.scripts.beast_trees import (
+    build_tree_index,
+    parse_translate,
+    read_translate,
+    split_tree_offsets,
+    yield_chunk_arrays,
+)
+from episodic.workflow.scripts.mcc_tree import choose_mcc_tree, collect_clades, hpd_interval, mcc_tree, merge_samples
+
+TREES_PATH = Path("tests/data/flc.trees")
+
+
+def _chunk_samples(n_chunks):
+    index = build_tree_index(TREES_PATH)
+    translate = parse_translate(read_translate(TREES_PATH, index))
+    return [
+        collect_clades(yield_chunk_arrays(TREES_PATH, translate, chunk))
+        for chunk in split_tree_offsets(index.offsets, index.trees_end, n_chunks)
+    ]
+
+
+def test_choose_mcc_tree_maximises_rooted_clade_credibility():
+    trees = dendropy.TreeList.get(path=str(TREES_PATH), schema="nexus", preserve_underscores=True)
+    clades = [
+        [frozenset(leaf.taxon.label for leaf in node.leaf_iter()) for node in tree.internal_nodes()]
+        for tree in trees
+    ]
+    counts = collections.Counter(clade for tree_clades in clades for clade in tree_clades)
+    credibility = [sum(math.log(counts[clade] / len(trees)) for clade in tree_clades) for tree_clades in clades]
+
+    (sample,) = _chunk_samples(1)
+
+    assert choose_mcc_tree(sample) == credibility.index(max(credibility))
+
+
+def test_merge_samples_matches_single_chunk():
+    (single,) = _chunk_samples(1)
+    merged = merge_samples(_chunk_samples(3))
+
+    assert choose_mcc_tree(merged) == choose_mcc_tree(single)
+    assert [merged.clades[i] for i in merged.clade_ids] == [single.clades[i] for i in single.clade_ids]
+    np.testing.assert_allclose(merged.values["rate"], single.values["rate"])
+
+
+def test_hpd_interval_is_shortest_interval():
+    assert hpd_interval(np.array([1.0, 2.0, 3.0, 4.0, 100.0]), 0.8).tolist() == [1.0, 4.0]
+
+
+def test_mcc_tree_writes_one_nexus_per_heights(tmp_path):
+    outputs = [tmp_path / "run.mcc.mean.nexus", tmp_path / "run.mcc.median.nexus"]
+
+    mcc_tree(TREES_PATH, ["mean", "median"], outputs, burnin_trees=2, burnin=None, jobs=1)
+
+    for output in outputs:
+        tree = dendropy.Tree.get(path=str(output), schema="nexus", preserve_underscores=True)
+        assert len(tree.leaf_nodes()) == 6
+        assert all(node.annotations.get_value("posterior") for node in tree.internal_nodes())
+
+
+def test_mcc_tree_burnin_fraction_of_short_run(tmp_path):
+    # 20 trees, fewer than 10% of the default 10000 samples
+    fraction = tmp_path / "fraction.nexus"
+    count = tmp_path / "count.nexus"
+    with pytest.raises(ValueError, match="No trees left"):
+        mcc_tree(TREES_PATH, ["mean"], [count], burnin_trees=int(10000 * 0.1), burnin=None, jobs=1)
+
+    mcc_tree(TREES_PATH, ["mean"], [fraction], burnin_trees=0, burnin=0.1, jobs=1)
+    mcc_tree(TREES_PATH, ["mean"], [count], burnin_trees=2, burnin=None, jobs=1)
+
+    assert fraction.read_text() == count.read_text()
@@ -1,6 +1,16 @@
 from pathlib import Path
 
-from episodic.workflow.scripts.populate_beast_template import populate_beast_template
+import pytest
+
+from episodic.workflow.scripts.populate_beast_template import (
+    XMLVariant,
+    build_partitions,
+    load_beast_template,
+    populate_beast_template,
+    populate_beast_templates,
+    taxa_from_fasta,
+)
+from episodic.workflow.utils import date_to_decimal_year
 
 
 def test_populate_beast_template_supports_multiple_partitions(tmp_path):
@@ -88,3 +98,157 @@ def test_populate_beast_template_keeps_external_branch_override_for_stem_models(
 
     assert "<externalBranches>" in xml
     assert '<taxa idref="BA.2.86"/>' in xml
+
+
+def test_taxa_from_fasta_joins_wrapped_sequences(tmp_path):
+    fasta = tmp_path / "wrapped.fasta"
+    fasta.write_text(">a|2020-07-02\nACGT\nAC\n>b|1992/1\nTTTT\nGG\n")
+
+    taxa = taxa_from_fasta(fasta)
+
+    assert [(taxon.id, taxon.sequence) for taxon in taxa] == [("a|2020-07-02", "ACGTAC"), ("b|1992/1", "TTTTGG")]
+    assert taxa[0].date == date_to_decimal_year("2020-07-02")
+    assert (taxa[1].date, taxa[1].uncertainty) == (1992.0, 1.0)
+
+    taxa, sequences = taxa_from_fasta(fasta, as_array=True)
+    assert sequences.shape == (2, 6)
+    assert bytes(sequences[1]) == b"TTTTGG"
+    assert taxa[1].sequence == ""
+
+
+def test_taxa_from_fasta_rejects_invalid_fasta(tmp_path):
+    fasta = tmp_path / "invalid.fasta"
+    fasta.write_text("ACGT\n>a|2020\nACGT\n")
+
+    with pytest.raises(ValueError, match=r"Invalid fasta file\."):
+        taxa_from_fasta(fasta)
+
+
+def test_populate_beast_templates_matches_single_renders(tmp_path):
+    template_path = Path("src/episodic/workflow/templates/beast_xml_template.jinja")
+    alignment_path = Path("tests/data/BA.2.86.afa")
+    variants = [
+        XMLVariant(tmp_path / "flc-stem_1.xml", "flc-stem"),
+        XMLVariant(tmp_path / "strict_1.xml", "strict"),
+        XMLVariant(tmp_path / "flc-stem_mle_1.xml", "flc-stem", mle=True),
+        XMLVariant(tmp_path / "flc-stem_mle_1_burnin.xml", "flc-stem", burnin=True),
+    ]
+
+    written = populate_beast_templates(
+        template_path,
+        variants,
+        alignment_paths=[alignment_path],
+        groups=["BA.2.86"],
+        date_delimiter="@",
+        jobs=2,
+        mle_burnin_length=5000,
+    )
+
+    assert written == [variant.output for variant in variants]
+    for variant in variants:
+        chain_length = 1 if variant.mle else 5001 if variant.burnin else 100000000
+        expected = populate_beast_template(
+            work_dir=tmp_path,
+            name=variant.output.stem,
+            template_path=template_path,
+            alignment_paths=[alignment_path],
+            groups=["BA.2.86"],
+            clock=variant.clock,
+            chain_length=chain_length,
+            date_delimiter="@",
+            trace=not (variant.mle or variant.burnin),
+            trees=not (variant.mle or variant.burnin),
+            mle=variant.mle,
+        )
+        assert variant.output.read_text() == expected
+
+
+def test_populate_beast_template_streams_to_output(tmp_path):
+    kwargs = {
+        "work_dir": tmp_path,
+        "name": "streamed",
+        "template_path": Path("src/episodic/workflow/templates/beast_xml_template.jinja"),
+        "alignment_paths": [Path("tests/data/BA.2.86.afa")],
+        "groups": ["BA.2.86"],
+        "clock": "flc-stem",
+        "date_delimiter": "@",
+    }
+    output = tmp_path / "streamed.xml"
+
+    assert populate_beast_template(**kwargs, output=output) == output
+    assert output.read_text() == populate_beast_template(**kwargs)
+
+
+def test_load_beast_template_caches_bytecode_by_content(tmp_path):
+    cache_dir = tmp_path / "cache"
+    template_path = tmp_path / "template.jinja"
+    template_path.write_text("{{ clock }}")
+
+    assert load_beast_template(template_path, cache_dir).render(clock="strict") == "strict"
+    assert len(list(cache_dir.iterdir())) == 1
+    assert load_beast_template(template_path, cache_dir).render(clock="strict") == "strict"
+    assert len(list(cache_dir.iterdir())) == 1
+
+    template_path.write_text("<{{ clock }}>")
+    assert load_beast_template(template_path, cache_dir).render(clock="strict") == "<strict>"
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_populate_beast_templates_deduplicates_into_xml_store(tmp_path):
+    variants = [
+        XMLVariant(tmp_path / "run_1" / "run_1.xml", "flc-stem"),
+        XMLVariant(tmp_path / "run_2" / "run_2.xml", "flc-stem"),
+        XMLVariant(tmp_path / "strict_1" / "strict_1.xml", "strict"),
+    ]
+
+    populate_beast_templates(
+        Path("src/episodic/workflow/templates/beast_xml_template.jinja"),
+        variants,
+        alignment_paths=[Path("tests/data/BA.2.86.afa")],
+        groups=["BA.2.86"],
+        date_delimiter="@",
+        xml_store=tmp_path / "xml",
+    )
+
+    stored = sorted((tmp_path / "xml").iterdir())
+    assert len(stored) == 2
+    assert variants[0].output.samefile(variants[1].output)
+    assert not variants[0].output.samefile(variants[2].output)
+    assert 'fileName="beast.log"' in variants[0].output.read_text()
+
+
+def test_populate_beast_template_compresses_constant_patterns(tmp_path):
+    xml = populate_beast_template(
+        work_dir=tmp_path,
+        name="compressed",
+        template_path=Path("src/episodic/workflow/templates/beast_xml_template.jinja"),
+        alignment_paths=[Path("tests/data/BA.2.86.afa")],
+        groups=["BA.2.86"],
+        clock="flc-stem",
+        date_delimiter="@",
+        compress_patterns=True,
+    )
+
+    assert '<mergePatterns id="patterns.BA.2.86">' in xml
+    assert "<constantPatterns>" in xml
+    assert '<mergePatterns idref="patterns.BA.2.86"/>' in xml
+
+
+def test_build_partitions_share_one_taxon_table(tmp_path):
+    alignment = Path("tests/data/BA.2.86.afa")
+    records = alignment.read_text().strip().split("\n>")
+    reordered = tmp_path / "reordered.afa"
+    reordered.write_text(">" + "\n>".join(record.lstrip(">") for record in reversed(records)) + "\n")
+
+    first, second = build_partitions([alignment, reordered], date_delimiter="@", date_index=-1)
+
+    assert second.table is first.table
+    assert second.rows.tolist() == list(reversed(range(len(first.table))))
+    assert [(taxon.id, str(taxon.sequence)) for taxon in second.taxa] == [
+        (taxon.id, str(taxon.sequence)) for taxon in first.taxa
+    ]
+
+    renamed = tmp_path / "renamed.afa"
+    renamed.write_text(alignment.read_text().replace(">681@", ">682@", 1))
+    with pytest.raises(ValueError, match="same set of taxon headers"):
+        build_partitions([alignment, renamed], date_delimiter="@", date_index=-1)
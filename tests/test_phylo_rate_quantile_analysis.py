@@ -0,0 +1,81 @@
+from bisect import bisect_left
+from pathlib import Path
+
+import dendropy
+import numpy as np
+import pytest
+
+from episodic.workflow.scripts.beast_trees import parse_newick
+from episodic.workflow.scripts.phylo_rate_quantile_analysis import (
+    analyze_rates,
+    build_group_index,
+    extract_array_rates,
+    extract_rates,
+    find_group_mrcas,
+    rank_group_rates,
+)
+from episodic.workflow.scripts.write_taxon_groups import read_group_members
+
+TREES_PATH = Path("tests/data/flc.trees")
+GROUPS_PATH = Path("tests/data/flc_taxon_groups.tsv")
+
+
+def test_find_group_mrcas_matches_dendropy_mrca():
+    group_members = read_group_members(GROUPS_PATH)
+    group_index = build_group_index(group_members)
+
+    for tree in dendropy.Tree.yield_from_files(files=[str(TREES_PATH)], schema="nexus", preserve_underscores=True):
+        mrcas = find_group_mrcas(tree, group_index)
+        expected = [tree.mrca(taxon_labels=taxa) for taxa in group_members.values()]
+        assert mrcas == expected
+
+
+def test_find_group_mrcas_ignores_taxa_missing_from_tree():
+    tree = dendropy.Tree.get(data="((a,b),(c,d));", schema="newick")
+    group_index = build_group_index({"AB": ["a", "b", "z"], "C": ["c"]})
+
+    ab, c = find_group_mrcas(tree, group_index)
+
+    assert {leaf.taxon.label for leaf in ab.leaf_iter()} == {"a", "b"}
+    assert c.taxon.label == "c"
+
+
+def test_extract_array_rates_matches_extract_rates_with_zero_rates():
+    newick = "((a[&rate=0.0]:1,b[&rate=0.2]:1)[&rate=0.0]:1,(c[&rate=0.3]:1,d[&rate=0.1]:1)[&rate=0.0]:1);"
+    taxa = ["a", "b", "c", "d"]
+    group_index = build_group_index({"AB": ["a", "b"], "CD": ["c", "d"]})
+    tree = dendropy.Tree.get(data=f"#NEXUS\nbegin trees;\ntree t = [&R] {newick}\nend;\n", schema="nexus")
+
+    rates, stem_indices = extract_rates(tree, group_index)
+    array_rates, array_stem_indices = extract_array_rates(
+        parse_newick(newick, {taxon: i for i, taxon in enumerate(taxa)}),
+        [group_index.taxon_bits.get(taxon, 0) for taxon in taxa],
+        [group_index.taxon_groups.get(taxon, []) for taxon in taxa],
+        group_index,
+    )
+
+    assert sorted(array_rates.tolist()) == sorted(rates) == [0.0, 0.0, 0.0, 0.1, 0.2, 0.3]
+    assert [array_rates[i] for i in array_stem_indices] == [rates[i] for i in stem_indices] == [0.0, 0.0]
+    ranks, quantiles = rank_group_rates(np.array([rates]), np.array([stem_indices]))
+    array_ranks, array_quantiles = rank_group_rates(np.array([array_rates]), np.array([array_stem_indices]))
+    assert ranks.tolist() == array_ranks.tolist() == [[1, 1]]
+    np.testing.assert_allclose(quantiles, array_quantiles)
+
+
+def test_rank_group_rates_matches_bisect_left_with_ties():
+    rng = np.random.default_rng(1)
+    rates = rng.integers(0, 5, size=(50, 12)).astype(float)
+    stem_indices = rng.integers(0, 12, size=(50, 3))
+
+    ranks, quantiles = rank_group_rates(rates, stem_indices)
+
+    for tree, (row, stems) in enumerate(zip(rates, stem_indices)):
+        sorted_row = sorted(row)
+        expected = [bisect_left(sorted_row, row[stem]) + 1 for stem in stems]
+        assert ranks[tree].tolist() == expected
+    np.testing.assert_allclose(quantiles, ranks / 12)
+
+
+def test_analyze_rates_rejects_burnin_of_every_tree(tmp_path):
+    with pytest.raises(ValueError, match="No trees left"):
+        analyze_rates(str(TREES_PATH), GROUPS_PATH, str(tmp_path / "plot.svg"), str(tmp_path / "stats.csv"), 1.0)
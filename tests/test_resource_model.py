@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from episodic.workflow.scripts.populate_beast_template import load_partitions
+from episodic.workflow.scripts.resource_model import (
+    JobFeatures,
+    alignment_statistics,
+    estimate_resources,
+    fit,
+    prior_model,
+    read_resource_model,
+)
+
+ALIGNMENTS = [Path("tests/data/HA1.fasta"), Path("tests/data/HA2.fasta")]
+
+
+def test_alignment_statistics_count_patterns_with_and_without_constant_sites():
+    partitions = load_partitions(ALIGNMENTS, date_delimiter="@")
+    compressed = load_partitions(ALIGNMENTS, date_delimiter="@", compress_patterns=True)
+
+    statistics = alignment_statistics(partitions)
+
+    assert statistics.taxa == len(partitions[0].table)
+    assert len(statistics.patterns) == 2
+    assert alignment_statistics(compressed) == statistics
+    sites = [partition.sequences.shape[1] for partition in partitions]
+    assert all(0 < patterns <= n_sites for patterns, n_sites in zip(statistics.patterns, sites))
+
+
+def write_benchmark(directory, name, features, mem_mb, seconds):
+    (directory / f"{name}.tsv").write_text(
+        "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n"
+        f"{seconds}\t0:00:00\t{mem_mb}\t-\t-\t-\t-\t-\t-\t-\n"
+    )
+    (directory / f"{name}.features.json").write_text(json.dumps(features._asdict()))
+
+
+def test_fit_updates_model_from_benchmarks(tmp_path):
+    rng = np.random.default_rng(3)
+    benchmarks = tmp_path / "benchmarks"
+    benchmarks.mkdir()
+    jobs = []
+    for job in range(40):
+        features = JobFeatures(
+            taxa=int(rng.integers(20, 2000)),
+            patterns=int(rng.integers(100, 5000)),
+            partitions=int(rng.integers(1, 3)),
+            states=int(10 ** rng.uniform(6, 8)),
+            clock=["strict", "relaxed", "flc-stem"][job % 3],
+        )
+        # 1 GB plus the partial likelihoods, and 1 minute per 10^10 state-patterns
+        mem_mb = 1000 + features.taxa * features.patterns * 1e-3
+        runtime = features.states * features.patterns * 1e-10
+        write_benchmark(benchmarks, f"job_{job}", features, mem_mb, runtime * 60)
+        jobs.append((features, mem_mb, runtime))
+    model_path = tmp_path / "resource_model.json"
+
+    fit(model_path, [benchmarks])
+    fit(model_path, [benchmarks / "job_0.tsv"])
+
+    model = read_resource_model(model_path)
+    assert len(model.records) == 40
+    for features, mem_mb, runtime in jobs:
+        predicted_mem_mb, predicted_runtime = model.predict(features, quantile=0)
+        assert abs(np.log(predicted_mem_mb / mem_mb)) < 0.35
+        assert abs(np.log(predicted_runtime / runtime)) < 0.35
+        assert model.predict(features)[1] > runtime
+    assert model.sigma["runtime"] < prior_model().sigma["runtime"]
+
+
+def test_estimate_resources_scale_with_attempt_and_floor():
+    small = JobFeatures(taxa=10, patterns=50, partitions=1, states=1000, clock="strict")
+
+    assert estimate_resources(prior_model(), small) == {"mem_mb": 2000, "runtime": 10}
+    assert estimate_resources(prior_model(), small, attempt=2) == {"mem_mb": 4000, "runtime": 20}
@@ -0,0 +1,43 @@
+import io
+from pathlib import Path
+
+import dendropy
+import pytest
+import typer
+
+from episodic.workflow.scripts import tree_converter as module
+from episodic.workflow.scripts.tree_converter import SingleQuoteReader, convert_trees, tree_converter
+
+TREES_PATH = Path("tests/data/flc.trees")
+
+
+def test_single_quote_reader_rewrites_quotes_across_buffers(monkeypatch):
+    monkeypatch.setattr(module, "READ_BUFFER_CHARS", 4)
+    reader = SingleQuoteReader(io.StringIO('tree "a b" = ("x y",z);'))
+
+    assert reader.read(1) + reader.read(3) + reader.read() == "tree 'a b' = ('x y',z);"
+
+
+def test_tree_converter_streams_every_tree_to_newick(tmp_path):
+    output = tmp_path / "flc.nwk"
+
+    count = tree_converter(TREES_PATH, output, "", "", "")
+
+    expected = dendropy.TreeList.get(path=str(TREES_PATH), schema="nexus")
+    assert count == 20
+    assert output.read_text().splitlines() == [
+        tree.as_string(schema="newick", suppress_rooting=True).strip() for tree in expected
+    ]
+
+
+def test_convert_trees_converts_pairs_in_one_call(tmp_path):
+    newick = tmp_path / "tree.nwk"
+    newick.write_text('(("a x":1,b:1)[&posterior=0.95]:1,c:2);\n')
+    outputs = [tmp_path / "one.nexus", tmp_path / "two.nwk"]
+
+    convert_trees([newick, outputs[0], newick, outputs[1]], "", "", "")
+
+    assert dendropy.Tree.get(path=str(outputs[0]), schema="nexus").taxon_namespace.labels() == ["a x", "b", "c"]
+    assert outputs[1].read_text() == "((a_x:1.0,b:1.0):1.0,c:2.0);\n"
+    with pytest.raises(typer.BadParameter):
+        convert_trees([newick], "", "", "")
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import dendropy
+import numpy as np
+
+from episodic.workflow.scripts.beast_trees import (
+    TreeChunk,
+    build_tree_index,
+    parse_translate,
+    read_translate,
+    yield_chunk_arrays,
+)
+from episodic.workflow.scripts.mcc_tree import mcc_tree
+from episodic.workflow.scripts.phylo_rate_quantile_analysis import analyze_rates
+from episodic.workflow.scripts.tree_sample import convert, read_tree_sample, write_nexus_trees
+
+TREES_PATH = Path("tests/data/flc.trees")
+GROUPS_PATH = Path("tests/data/flc_taxon_groups.tsv")
+
+
+def test_convert_round_trips_trees(tmp_path):
+    sample_path = tmp_path / "flc.trees.npz"
+
+    convert(TREES_PATH, sample_path, jobs=2)
+    sample = read_tree_sample(sample_path)
+
+    index = build_tree_index(TREES_PATH)
+    translate = parse_translate(read_translate(TREES_PATH, index))
+    expected = list(yield_chunk_arrays(TREES_PATH, translate, TreeChunk(0, int(index.offsets[0]), index.trees_end)))
+    assert len(sample) == 20
+    assert sample.taxa[0] == "s1@A.1@2020.1"
+    assert sample.states.tolist() == index.states.tolist()
+    for tree_index, tree in enumerate(expected):
+        stored = sample.tree(tree_index)
+        assert stored.parent.tolist() == tree.parent.tolist()
+        np.testing.assert_array_equal(stored.length, tree.length)
+        np.testing.assert_array_equal(stored.annotations["rate"], tree.annotations["rate"])
+
+
+def test_write_nexus_trees_preserves_trees(tmp_path):
+    sample_path = tmp_path / "flc.trees.npz"
+    output = tmp_path / "flc.export.trees"
+    convert(TREES_PATH, sample_path, jobs=1)
+
+    write_nexus_trees(read_tree_sample(sample_path), output, range(5))
+
+    original = dendropy.TreeList.get(path=str(TREES_PATH), schema="nexus", preserve_underscores=True)
+    exported = dendropy.TreeList.get(path=str(output), schema="nexus", preserve_underscores=True)
+    assert len(exported) == 5
+    for before, after in zip(original, exported):
+        assert before.as_string(schema="newick") == after.as_string(schema="newick")
+
+
+def test_tree_consumers_match_nexus_input(tmp_path):
+    sample_path = tmp_path / "flc.trees.npz"
+    convert(TREES_PATH, sample_path, jobs=1)
+
+    outputs = {}
+    for name, path in [("nexus", TREES_PATH), ("sample", sample_path)]:
+        csv_path = tmp_path / f"{name}.csv"
+        mcc_path = tmp_path / f"{name}.mcc.nexus"
+        analyze_rates(str(path), GROUPS_PATH, str(tmp_path / f"{name}.svg"), str(csv_path), burnin=0.1, jobs=2)
+        mcc_tree(path, ["mean"], [mcc_path], burnin_trees=2, burnin=None, jobs=2)
+        outputs[name] = (csv_path.read_text(), mcc_path.read_text())
+
+    assert outputs["nexus"] == outputs["sample"]
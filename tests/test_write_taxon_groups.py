@@ -1,12 +1,36 @@
 from pathlib import Path
 
-from episodic.workflow.scripts.write_taxon_groups import assign_group, read_group_members, write_taxon_groups
+from episodic.workflow.scripts.write_taxon_groups import (
+    GroupMatcher,
+    assign_group,
+    build_group_members,
+    load_taxon_registry,
+    read_group_members,
+    read_lineage_aliases,
+    read_taxon_registry,
+    write_taxon_groups,
+)
 
 
 def test_assign_group_prefers_longest_match():
     assert assign_group("sample@B.1.1.7@2021.1", ["B.1", "B.1.1.7"]) == "B.1.1.7"
 
 
+def test_group_matcher_matches_overlapping_groups():
+    matcher = GroupMatcher(["XBB", "BB.1.5", "XBB.1", "A", "B"])
+
+    assert matcher.assign("s1@XBB.1.5@2023.1") == "BB.1.5"
+    assert matcher.assign("s2@XBB.1@2023.1") == "XBB.1"
+    # equally long groups go to the first configured
+    assert matcher.assign("s3@BA@2022.1") == "A"
+    assert matcher.assign("s4@C@2021.1") == ""
+    assert build_group_members(["s1@XBB.1.5", "s2@AY"], ["XBB.1", "AY", "Q"]) == {
+        "XBB.1": ["s1@XBB.1.5"],
+        "AY": ["s2@AY"],
+        "Q": [],
+    }
+
+
 def test_write_taxon_groups_creates_mapping(tmp_path):
     output_path = tmp_path / "taxon_groups.tsv"
 
@@ -26,4 +50,46 @@ def test_read_group_members_ignores_unassigned_taxa(tmp_path):
     groups_path = tmp_path / "taxon_groups.tsv"
     groups_path.write_text("taxon\tgroup\nfoo\tA\nbar\t\n")
 
-    assert read_group_members(groups_path) == {"A": ["foo"]}
\ No newline at end of file
+    assert read_group_members(groups_path) == {"A": ["foo"]}
+
+
+def test_taxon_registry_round_trips_tsv_groups(tmp_path):
+    alignment = tmp_path / "alignment.fasta"
+    alignment.write_text(">s1@XBB.1.5\nA\n>s2@AY.4\nC\n>s3@B.1\nG\n>s4@AY.4\nT\n")
+    output_path = tmp_path / "taxon_groups.tsv"
+    registry_path = tmp_path / "taxon_groups.npz"
+
+    write_taxon_groups(alignment, output_path, ["XBB.1", "AY", "Q"], registry_path=registry_path)
+
+    registry = read_taxon_registry(registry_path)
+    assert registry.group_members() == read_group_members(output_path)
+    assert load_taxon_registry(output_path).group_members() == registry.group_members()
+    assert registry.index["s3@B.1"] == 2
+    assert registry.member_indices("AY").tolist() == [1, 3]
+
+
+def test_write_taxon_groups_joins_metadata(tmp_path):
+    alignment = tmp_path / "alignment.fasta"
+    alignment.write_text(">s1@2021.1\nA\n>s2@2021.2\nC\n>s3@2021.3\nG\n>s4@2021.4\nT\n")
+    metadata = tmp_path / "metadata.csv"
+    metadata.write_text("lineage,strain\nQ.1,s1\nB.1.1.7,s2\nB.1.2,s3\nB.1.1.7,other\n")
+    aliases = tmp_path / "aliases.tsv"
+    aliases.write_text("alias\tlineage\nQ\tB.1.1.7\n")
+    output_path = tmp_path / "taxon_groups.tsv"
+
+    write_taxon_groups(
+        alignment,
+        output_path,
+        ["B.1.1.7", "B.1"],
+        metadata_path=metadata,
+        header_delimiter="@",
+        aliases=read_lineage_aliases(aliases),
+    )
+
+    assert output_path.read_text() == (
+        "taxon\tgroup\n"
+        "s1@2021.1\tB.1.1.7\n"
+        "s2@2021.2\tB.1.1.7\n"
+        "s3@2021.3\tB.1\n"
+        "s4@2021.4\t\n"
+    )